@@ -1,72 +1,145 @@
 #!/usr/bin/env python3
 import os
-import glob
-from datetime import datetime, timedelta
-import re
+import sys
+import zipfile
+import argparse
+from bisect import bisect_left
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, time, timedelta
 
-def extract_date_from_filename(filename):
-    """从文件名中提取日期"""
-    match = re.search(r'non_us_ips_(\d{8})_\d+\.txt', filename)
-    if match:
-        return match.group(1)
-    return None
+from manifest import BASE_DIR, load_manifest, save_manifest, record_file, remove_file
 
-def cleanup_old_files():
+# 仓库根目录（autoip6.py 所在目录）
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# autoip6.py 的IP历史记录（cache_settings 中的 cache_folder/history_file）
+HISTORY_DB = os.path.join(".cache", "history.db")
+HISTORY_RETENTION_DAYS = 30
+
+def select_expired(entries, cutoff_date, max_files=0, max_bytes=0):
     """
-    删除过期的文件，保留最近7天的数据
+    entries 为按日期排序的 (date, key, info) 列表；
+    先取日期早于 cutoff_date 的前缀，再从最旧的开始补充，直到剩余文件满足数量和大小配额
+    """
+    dates = [date for date, _, _ in entries]
+    # 索引按日期有序，过期文件就是一个前缀区间
+    expired_count = bisect_left(dates, cutoff_date)
+    remaining = entries[expired_count:]
+    remaining_bytes = sum(info['size'] for _, _, info in remaining)
+    while remaining and ((max_files and len(remaining) > max_files) or (max_bytes and remaining_bytes > max_bytes)):
+        remaining_bytes -= remaining[0][2]['size']
+        remaining = remaining[1:]
+        expired_count += 1
+    return entries[:expired_count]
+
+def archive_files(expired, base_dir=BASE_DIR):
+    """把过期文件按月份压缩进 archive/non_us_ips_YYYYMM.zip（追加写入），返回 {归档路径: (月份, 新增IP数)}"""
+    archive_dir = os.path.join(base_dir, "archive")
+    os.makedirs(archive_dir, exist_ok=True)
+    archived = {}
+    for date, key, info in expired:
+        archive_path = os.path.join(archive_dir, f"non_us_ips_{date[:6]}.zip")
+        file_path = os.path.join(base_dir, key)
+        if not os.path.exists(file_path):
+            continue
+        with zipfile.ZipFile(archive_path, 'a', compression=zipfile.ZIP_DEFLATED) as archive:
+            if key not in archive.namelist():
+                archive.write(file_path, key)
+        month, ip_count = archived.get(archive_path, (date[:6], 0))
+        archived[archive_path] = (month, ip_count + info['ip_count'])
+    return archived
+
+def remove_quietly(file_path):
+    try:
+        os.remove(file_path)
+        return True
+    except FileNotFoundError:
+        return False
+
+def cleanup_old_files(retention_days=7, max_files=0, max_bytes=0, archive=False, workers=8, base_dir=BASE_DIR):
+    """
+    按索引清理过期文件：保留最近 retention_days 天的数据，并满足文件数量/总大小配额；
+    archive=True 时过期文件先压缩进按月归档再删除
     """
     print("开始清理旧文件")
     
-    retention_days = 7
-    cutoff_date = datetime.now() - timedelta(days=retention_days)
-    
-    print(f"清理截止日期: {cutoff_date.date()}")
-    
-    base_dir = "non_us_ips"
-    deleted_count = 0
+    cutoff = datetime.now() - timedelta(days=retention_days)
+    print(f"清理截止日期: {cutoff.date()}")
+    # 与按时间比较一致：日期为 D 的文件在 D 日 0 点早于截止时间时过期，即保留的第一天是截止时间向上取整
+    first_kept = cutoff.date() if cutoff.time() == time.min else cutoff.date() + timedelta(days=1)
+    cutoff_date = first_kept.strftime('%Y%m%d')
     
     if not os.path.exists(base_dir):
-        print("non_us_ips 目录不存在，跳过清理")
+        print(f"{base_dir} 目录不存在，跳过清理")
         return 0
     
-    # 清理原始文件
-    for filename in os.listdir(base_dir):
-        if filename.startswith("non_us_ips_") and filename.endswith(".txt"):
-            date_str = extract_date_from_filename(filename)
-            if date_str:
-                try:
-                    file_date = datetime.strptime(date_str, '%Y%m%d')
-                    if file_date < cutoff_date:
-                        file_path = os.path.join(base_dir, filename)
-                        print(f"删除旧文件: {filename}")
-                        os.remove(file_path)
-                        deleted_count += 1
-                except ValueError:
-                    pass
+    manifest = load_manifest(base_dir)
+    entries = sorted(
+        (info['date'], key, info) for key, info in manifest['files'].items() if info['kind'] != 'archive'
+    )
+    expired = select_expired(entries, cutoff_date, max_files, max_bytes)
+    if not expired:
+        # 索引可能是刚扫描目录重建的，也要保存
+        save_manifest(manifest, base_dir)
+        print(f"没有需要清理的文件 (当前 {len(entries)} 个文件)")
+        return 0
     
-    # 清理merged目录中的旧文件
-    merged_dir = os.path.join(base_dir, "merged")
-    if os.path.exists(merged_dir):
-        for file in os.listdir(merged_dir):
-            if file.startswith("merged_ips_") and file.endswith(".txt"):
-                try:
-                    date_str = file.replace("merged_ips_", "").replace(".txt", "")
-                    file_date = datetime.strptime(date_str, '%Y-%m-%d')
-                    
-                    if file_date < cutoff_date:
-                        file_path = os.path.join(merged_dir, file)
-                        print(f"删除旧合并文件: {file}")
-                        os.remove(file_path)
-                        deleted_count += 1
-                except ValueError:
-                    pass
+    if archive:
+        for archive_path, (month, ip_count) in archive_files(expired, base_dir).items():
+            previous = manifest['files'].get(os.path.relpath(archive_path, base_dir).replace(os.sep, '/'), {})
+            record_file(manifest, archive_path, month + "01", 'archive',
+                        previous.get('ip_count', 0) + ip_count, base_dir=base_dir)
+            print(f"已归档到: {archive_path}")
     
+    paths = [os.path.join(base_dir, key) for _, key, _ in expired]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        removed = list(executor.map(remove_quietly, paths))
+    for (date, key, info), path in zip(expired, paths):
+        print(f"{'归档并删除' if archive else '删除'}旧文件: {key} ({date}, {info['ip_count']} 行)")
+        remove_file(manifest, path, base_dir)
+    save_manifest(manifest, base_dir)
+    
+    deleted_count = sum(removed)
     print(f"清理完成。共删除 {deleted_count} 个项目。")
     return deleted_count
 
+def prune_history(db_path=HISTORY_DB, retention_days=HISTORY_RETENTION_DAYS):
+    """
+    在一个事务中删除IP历史记录中过期的数据（HistoryStore.prune）
+
+    只有历史记录存在时才导入 autoip6：它依赖 requests 等第三方库，
+    合并工作流的运行环境没有安装这些依赖，也没有历史记录
+    """
+    if not os.path.exists(db_path):
+        print(f"{db_path} 不存在，跳过历史记录清理")
+        return 0
+    
+    if REPO_DIR not in sys.path:
+        sys.path.insert(0, REPO_DIR)
+    try:
+        from autoip6 import HistoryStore
+    except ImportError as e:
+        print(f"无法导入 autoip6 ({e})，跳过历史记录清理")
+        return 0
+    store = HistoryStore(db_path)
+    try:
+        deleted = store.prune((datetime.now() - timedelta(days=retention_days)).timestamp())
+    finally:
+        store.close()
+    print(f"历史记录清理完成，删除 {deleted} 条 {retention_days} 天以前的记录。")
+    return deleted
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='按索引清理 non_us_ips 中的过期文件')
+    parser.add_argument('--retention-days', type=int, default=7, help='保留最近多少天的文件')
+    parser.add_argument('--max-files', type=int, default=0, help='最多保留的文件数量，0 表示不限')
+    parser.add_argument('--max-bytes', type=int, default=0, help='保留文件的总大小上限（字节），0 表示不限')
+    parser.add_argument('--archive', action='store_true', help='过期文件压缩进按月归档后再删除')
+    parser.add_argument('--workers', type=int, default=8, help='并行删除的线程数')
+    args = parser.parse_args()
     try:
-        cleanup_old_files()
+        cleanup_old_files(args.retention_days, args.max_files, args.max_bytes, args.archive, args.workers)
+        prune_history()
     except Exception as e:
         print(f"清理脚本执行失败: {e}")
         import sys
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+non_us_ips 目录的文件索引（manifest.json）：记录每个文件的日期、类型、大小和IP数量。
+autoip6.py、merge_non_us_ips.py 写文件时更新索引，cleanup_old_files.py 按索引做过期查询，
+不需要再遍历目录和解析文件名。
+"""
+import os
+import re
+import json
+from datetime import datetime
+
+BASE_DIR = "non_us_ips"
+MANIFEST_FILE = "manifest.json"
+
+RUN_FILE_PATTERN = re.compile(r'non_us_ips_(\d{8})_\d+\.txt$')
+MERGED_FILE_PATTERN = re.compile(r'merged_ips_(\d{4}-\d{2}-\d{2})\.txt$')
+
+
+def manifest_path(base_dir=BASE_DIR):
+    return os.path.join(base_dir, MANIFEST_FILE)
+
+
+def count_ips(file_path):
+    """统计文件中的有效行数（非注释、非空行）"""
+    with open(file_path, 'r', encoding='utf-8') as f:
+        return sum(1 for line in f if line.strip() and not line.startswith('#'))
+
+
+def load_manifest(base_dir=BASE_DIR):
+    """读取索引；索引不存在或损坏时扫描一次目录重建"""
+    path = manifest_path(base_dir)
+    if os.path.exists(path):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+            if isinstance(manifest.get('files'), dict):
+                return manifest
+        except (OSError, ValueError) as e:
+            print(f"读取索引失败: {e}，重新扫描目录")
+    return rebuild_manifest(base_dir)
+
+
+def rebuild_manifest(base_dir=BASE_DIR):
+    """扫描目录生成索引，只在索引缺失时执行"""
+    manifest = {'version': 1, 'files': {}}
+    if not os.path.exists(base_dir):
+        return manifest
+    for folder, kind, pattern in ((base_dir, 'run', RUN_FILE_PATTERN),
+                                  (os.path.join(base_dir, 'merged'), 'merged', MERGED_FILE_PATTERN)):
+        if not os.path.exists(folder):
+            continue
+        for filename in os.listdir(folder):
+            match = pattern.match(filename)
+            if match:
+                record_file(manifest, os.path.join(folder, filename), match.group(1).replace('-', ''), kind, base_dir=base_dir)
+    print(f"已重建索引: {len(manifest['files'])} 个文件")
+    return manifest
+
+
+def save_manifest(manifest, base_dir=BASE_DIR):
+    """先写临时文件再替换"""
+    path = manifest_path(base_dir)
+    os.makedirs(base_dir, exist_ok=True)
+    manifest['updated_at'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def record_file(manifest, file_path, date, kind, ip_count=None, base_dir=BASE_DIR):
+    """登记或更新一个文件；date 为 YYYYMMDD，kind 为 run / merged / archive"""
+    key = os.path.relpath(file_path, base_dir).replace(os.sep, '/')
+    manifest['files'][key] = {
+        'date': date,
+        'kind': kind,
+        'size': os.path.getsize(file_path),
+        'ip_count': count_ips(file_path) if ip_count is None else ip_count
+    }
+    return key
+
+
+def remove_file(manifest, file_path, base_dir=BASE_DIR):
+    key = os.path.relpath(file_path, base_dir).replace(os.sep, '/')
+    manifest['files'].pop(key, None)
@@ -1,9 +1,17 @@
 #!/usr/bin/env python3
 import os
 import sys
+import heapq
+import shutil
+import argparse
+import tempfile
+import ipaddress
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
 import glob
 
+from manifest import BASE_DIR, load_manifest, save_manifest, record_file
+
 def extract_original_line_info(line):
     """提取原始行的信息，完全保留原始格式"""
     line = line.rstrip('\n\r')  # 只移除行尾的换行符
@@ -138,17 +146,7 @@ def merge_and_deduplicate_ips(target_date):
         if new_lines_count == 0:
             print("ℹ️ 没有新增的唯一行，跳过文件更新")
             # 虽然没有新增内容，但仍然删除源文件
-            print(f"\n🗑️ 开始删除已处理的源文件...")
-            deleted_count = 0
-            for file_path in files:
-                try:
-                    os.remove(file_path)
-                    print(f"  已删除: {os.path.basename(file_path)}")
-                    deleted_count += 1
-                except Exception as e:
-                    print(f"  删除失败 {os.path.basename(file_path)}: {e}")
-            
-            print(f"✅ 已删除 {deleted_count}/{len(files)} 个源文件")
+            delete_source_files(files)
             return True
     else:
         combined_lines = unique_lines
@@ -201,24 +199,11 @@ def merge_and_deduplicate_ips(target_date):
             
             # 显示文件预览
             print("文件预览 (最后10行):")
-            with open(merged_file, 'r', encoding='utf-8') as f:
-                lines = f.readlines()
-                start_index = max(0, len(lines) - 10)
-                for i in range(start_index, len(lines)):
-                    print(f"  {lines[i].strip()}")
+            for line in tail_lines(merged_file):
+                print(f"  {line.strip()}")
             
             # 合并成功，删除源文件
-            print(f"\n🗑️ 开始删除已处理的源文件...")
-            deleted_count = 0
-            for file_path in files:
-                try:
-                    os.remove(file_path)
-                    print(f"  已删除: {os.path.basename(file_path)}")
-                    deleted_count += 1
-                except Exception as e:
-                    print(f"  删除失败 {os.path.basename(file_path)}: {e}")
-            
-            print(f"✅ 已删除 {deleted_count}/{len(files)} 个源文件")
+            delete_source_files(files)
             
             return True
         else:
@@ -231,25 +216,281 @@ def merge_and_deduplicate_ips(target_date):
         traceback.print_exc()
         return False
 
+# 流式合并写出的文件带有此标记，表示正文已按IP数值升序排列，可直接参与归并
+SORTED_MARKER = "# 排序: 按IP数值升序"
+
+def line_sort_key(line):
+    """按 (地址族, IP数值, 原始行) 排序；无法解析IP的行排在最后"""
+    address = line.split('#', 1)[0]
+    # IPv4 走快速路径，避免每行都构造 ipaddress 对象
+    try:
+        a, b, c, d = map(int, address.split(':', 1)[0].split('.'))
+        if 0 <= min(a, b, c, d) and max(a, b, c, d) < 256:
+            return (4, (a << 24) | (b << 16) | (c << 8) | d, line)
+    except ValueError:
+        pass
+    try:
+        if address.startswith('['):
+            ip = ipaddress.ip_address(address[1:address.index(']')])
+        elif address.count(':') == 1:
+            ip = ipaddress.ip_address(address.split(':', 1)[0])
+        else:
+            ip = ipaddress.ip_address(address)
+    except ValueError:
+        return (9, 0, line)
+    return (ip.version, int(ip), line)
+
+# encode_sorted_line 生成的排序前缀长度：1位地址族 + 32位十六进制IP数值
+SORT_PREFIX_LENGTH = 33
+
+def encode_sorted_line(line):
+    """在行首加上定长的排序前缀（地址族 + 32位十六进制IP数值），使字符串比较等价于按IP数值比较"""
+    family, value, _ = line_sort_key(line)
+    return f"{family}{value:032x}\t{line}"
+
+def dedup_key(encoded_line):
+    """去重键：能解析出IP的行按地址族和IP去重（端口、注释不同也算重复），无法解析的行按整行去重"""
+    return encoded_line if encoded_line.startswith('9') else encoded_line[:SORT_PREFIX_LENGTH]
+
+def read_encoded_lines(file_path):
+    """读取 sort_run_file 生成的临时文件"""
+    with open(file_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            yield line.rstrip('\n')
+
+def read_valid_lines(file_path):
+    """逐行读取文件中的有效行"""
+    with open(file_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            original_line = extract_original_line_info(line)
+            if original_line:
+                yield original_line
+
+def is_sorted_merged_file(file_path):
+    """判断合并文件是否由流式合并生成（正文已排序）"""
+    with open(file_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if not line.startswith('#'):
+                return False
+            if line.rstrip('\n\r') == SORTED_MARKER:
+                return True
+    return False
+
+def sort_run_file(file_path, tmp_dir):
+    """将单个运行文件去重并按排序前缀排序后写入临时文件，返回 (临时文件路径, 有效行数)"""
+    lines = sorted({encode_sorted_line(line) for line in read_valid_lines(file_path)})
+    sorted_path = os.path.join(tmp_dir, os.path.basename(file_path) + ".sorted")
+    with open(sorted_path, 'w', encoding='utf-8') as f:
+        for line in lines:
+            f.write(line + '\n')
+    return sorted_path, len(lines)
+
+def merge_sorted_runs(runs, output):
+    """
+    k路归并多个带排序前缀的有序序列，按IP边合并边去重，去掉前缀后写入 output，返回写入的行数；
+    同一个IP出现多次时保留排在前面的序列中的那一行
+    """
+    count = 0
+    previous = None
+    # heapq.merge 在键相同时按序列顺序输出，同一IP的第一行来自最靠前的序列
+    for line in heapq.merge(*runs, key=dedup_key):
+        key = dedup_key(line)
+        if key != previous:
+            output.write(line.split('\t', 1)[1] + '\n')
+            count += 1
+            previous = key
+    return count
+
+def tail_lines(file_path, n=10, block_size=4096):
+    """从文件末尾向前读取最后 n 行，不读取整个文件"""
+    with open(file_path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        position = f.tell()
+        data = b''
+        while position > 0 and data.count(b'\n') <= n:
+            read_size = min(block_size, position)
+            position -= read_size
+            f.seek(position)
+            data = f.read(read_size) + data
+    return [line.decode('utf-8', errors='replace') for line in data.splitlines()[-n:]]
+
+def delete_source_files(files):
+    """删除已合并的源文件"""
+    print(f"\n🗑️ 开始删除已处理的源文件...")
+    deleted_count = 0
+    for file_path in files:
+        try:
+            os.remove(file_path)
+            print(f"  已删除: {os.path.basename(file_path)}")
+            deleted_count += 1
+        except Exception as e:
+            print(f"  删除失败 {os.path.basename(file_path)}: {e}")
+    print(f"✅ 已删除 {deleted_count}/{len(files)} 个源文件")
+
+def merge_and_deduplicate_ips_stream(target_date):
+    """
+    流式合并指定日期的文件：每个运行文件单独排序后k路归并，按IP数值排序并按IP去重，
+    内存占用只与单个运行文件的大小有关。已有的合并文件作为第一路参与归并，整体重写；
+    同一IP以合并文件中已有的行为准，其次是较早的运行文件。
+    合并成功后删除源文件
+    """
+    print(f"开始流式处理日期: {target_date}")
+    target_date_clean = target_date.replace('-', '')
+    
+    files = get_files_by_date(target_date_clean)
+    if not files:
+        print(f"❌ 未找到日期为 {target_date_clean} 的文件")
+        return False
+    
+    print(f"找到 {len(files)} 个文件进行合并和去重:")
+    for f in files:
+        print(f"  - {os.path.basename(f)}")
+    
+    merged_dir = "non_us_ips/merged"
+    os.makedirs(merged_dir, exist_ok=True)
+    output_date = f"{target_date_clean[:4]}-{target_date_clean[4:6]}-{target_date_clean[6:8]}"
+    merged_file = os.path.join(merged_dir, f"merged_ips_{output_date}.txt")
+    file_exists = os.path.exists(merged_file)
+    
+    try:
+        with tempfile.TemporaryDirectory(dir=merged_dir) as tmp_dir:
+            runs = []
+            valid_lines_count = 0
+            for file_path in files:
+                sorted_path, count = sort_run_file(file_path, tmp_dir)
+                runs.append(read_encoded_lines(sorted_path))
+                valid_lines_count += count
+                print(f"  {os.path.basename(file_path)}: {count} 个有效行")
+            
+            existing_count = 0
+            existing_sorted = file_exists and is_sorted_merged_file(merged_file)
+            if file_exists:
+                print(f"📁 合并文件已存在: {os.path.basename(merged_file)}")
+                if existing_sorted:
+                    existing_count = sum(1 for _ in read_valid_lines(merged_file))
+                    runs.insert(0, (encode_sorted_line(line) for line in read_valid_lines(merged_file)))
+                else:
+                    # 旧版追加模式生成的文件未排序，先整体排序一次
+                    existing_path, existing_count = sort_run_file(merged_file, tmp_dir)
+                    runs.insert(0, read_encoded_lines(existing_path))
+                print(f"  从现有文件中读取了 {existing_count} 个有效行")
+            
+            body_path = os.path.join(tmp_dir, "body.txt")
+            with open(body_path, 'w', encoding='utf-8') as body:
+                total_count = merge_sorted_runs(runs, body)
+            new_lines_count = total_count - existing_count
+            
+            print(f"📊 合并统计:")
+            print(f"  - 源文件有效行数: {valid_lines_count}")
+            print(f"  - 合并后总行数: {total_count}")
+            print(f"  - 新增唯一行数: {new_lines_count}")
+            
+            if total_count == 0:
+                print("❌ 没有有效的行可以写入")
+                return False
+            
+            # 已有的行总是保留，行数不变说明没有新增IP（旧文件中有重复IP时行数会减少，需要重写）
+            if existing_sorted and total_count == existing_count:
+                print("ℹ️ 没有新增的唯一行，跳过文件更新")
+            else:
+                tmp_merged = os.path.join(tmp_dir, "merged.txt")
+                with open(tmp_merged, 'w', encoding='utf-8') as f, open(body_path, 'r', encoding='utf-8') as body:
+                    f.write(f"# 合并和去重后的非美国IP地址 - {output_date}\n")
+                    f.write(f"# 源数据日期: {target_date_clean}\n")
+                    f.write(f"# 唯一行数: {total_count}\n")
+                    f.write(f"# 源文件数量: {len(files)}\n")
+                    f.write(f"# 生成时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
+                    f.write(f"# 格式: 完全保留原始格式 (IP:端口#注释)\n")
+                    f.write(f"{SORTED_MARKER}\n\n")
+                    shutil.copyfileobj(body, f)
+                os.replace(tmp_merged, merged_file)
+                print(f"✅ 成功{'更新' if file_exists else '创建'}合并文件: {merged_file}")
+                print(f"📏 文件大小: {os.path.getsize(merged_file)} 字节")
+                print("文件预览 (最后10行):")
+                for line in tail_lines(merged_file):
+                    print(f"  {line.strip()}")
+    except Exception as e:
+        print(f"❌ 流式合并时出错: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+    
+    delete_source_files(files)
+    return True
+
+def expand_dates(values):
+    """展开日期参数，支持单个日期和 起始..结束 形式的日期范围（YYYYMMDD 或 YYYY-MM-DD）"""
+    dates = []
+    for value in values:
+        if '..' in value:
+            start, end = (datetime.strptime(part.replace('-', ''), '%Y%m%d') for part in value.split('..', 1))
+            while start <= end:
+                dates.append(start.strftime('%Y%m%d'))
+                start += timedelta(days=1)
+        else:
+            dates.append(value.replace('-', ''))
+    return dates
+
+def merge_dates(dates, stream=False, workers=None):
+    """合并多个日期；多个日期时用进程池并行处理，返回 {日期: 是否成功}"""
+    merge = merge_and_deduplicate_ips_stream if stream else merge_and_deduplicate_ips
+    if len(dates) == 1:
+        results = {dates[0]: merge(dates[0])}
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = dict(zip(dates, executor.map(merge, dates)))
+    update_manifest(dates)
+    return results
+
+def update_manifest(dates):
+    """合并完成后在主进程中统一更新文件索引：登记合并文件，移除已删除的源文件"""
+    if not os.path.exists(BASE_DIR):
+        return
+    manifest = load_manifest()
+    for date in dates:
+        for key, info in list(manifest['files'].items()):
+            if info['date'] == date and info['kind'] == 'run' and not os.path.exists(os.path.join(BASE_DIR, key)):
+                del manifest['files'][key]
+        merged_file = os.path.join(BASE_DIR, "merged", f"merged_ips_{date[:4]}-{date[4:6]}-{date[6:8]}.txt")
+        if os.path.exists(merged_file):
+            record_file(manifest, merged_file, date, 'merged')
+    save_manifest(manifest)
+
 def main():
     print("=== 开始执行IP合并去重脚本 ===")
     
+    parser = argparse.ArgumentParser(description='合并和去重非美国IP文件')
+    parser.add_argument('dates', nargs='*',
+                        help='处理日期 YYYYMMDD 或 YYYY-MM-DD，可指定多个或 起始..结束 范围，默认昨天')
+    parser.add_argument('--stream', action='store_true',
+                        help='流式合并：各文件排序后k路归并，输出按IP数值排序，内存占用有界')
+    parser.add_argument('--workers', type=int, default=None, help='多个日期并行处理的进程数')
+    args = parser.parse_args()
+    
     # 获取目标日期参数
-    if len(sys.argv) > 1:
-        target_date = sys.argv[1]
-        print(f"输入日期参数: {target_date}")
+    if args.dates:
+        dates = expand_dates(args.dates)
+        print(f"输入日期参数: {', '.join(args.dates)} (共 {len(dates)} 天)")
     else:
         # 使用昨天日期
-        target_date = (datetime.now() - timedelta(days=1)).strftime('%Y%m%d')
-        print(f"使用自动计算的昨天日期: {target_date}")
+        dates = [(datetime.now() - timedelta(days=1)).strftime('%Y%m%d')]
+        print(f"使用自动计算的昨天日期: {dates[0]}")
     
-    success = merge_and_deduplicate_ips(target_date)
+    results = merge_dates(dates, args.stream, args.workers)
+    if len(results) == 1:
+        success = all(results.values())
+    else:
+        failed = [date for date, ok in results.items() if not ok]
+        print(f"\n📅 处理 {len(results)} 天, 成功 {len(results) - len(failed)} 天")
+        if failed:
+            print(f"  未成功的日期: {', '.join(failed)}")
+        success = not failed
     
     if success:
         print("🎉 合并去重成功完成，源文件已删除")
         sys.exit(0)
     else:
-        print("💥 合并去重失败，保留源文件")
+        print("💥 合并去重失败，未成功日期的源文件已保留")
         sys.exit(1)
 
 if __name__ == "__main__":
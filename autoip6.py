@@ -7,15 +7,1557 @@ Cloudflare IP地址收集器
 版本：2.0
 """
 
-import requests
 import re
 import os
+import sys
+import importlib
+import importlib.util
 import time
 import ipaddress
 import json
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import ssl
+import statistics
+import random
+import hashlib
+import codecs
+import sqlite3
+import bisect
+from array import array
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+import multiprocessing
 import threading
+import queue
+import signal
+import gzip
+import io
+import csv
+import contextlib
+from contextlib import contextmanager
 from datetime import datetime, timezone, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from html.parser import HTMLParser
+from urllib.parse import urlparse, parse_qs
+
+
+
+class LazyModule:
+    """延迟导入的模块：第一次访问属性时才真正导入
+    
+    requests、aiohttp、NumPy 等导入耗时较长，只在用到时加载，
+    查询历史、提供HTTP接口等不需要它们的命令和启动阶段都不再付出这部分开销。
+    """
+
+    def __init__(self, name):
+        self.__dict__['_name'] = name
+        self.__dict__['_module'] = None
+
+    def __getattr__(self, attr):
+        module = self._module
+        if module is None:
+            # import_module 自带导入锁，多个线程同时首次访问也只会导入一次
+            module = importlib.import_module(self._name)
+            self.__dict__['_module'] = module
+        return getattr(module, attr)
+
+    def __repr__(self):
+        return f"<lazy module '{self._name}' ({'loaded' if self._module else 'not loaded'})>"
+
+
+def lazy_import(name, required=False):
+    """返回延迟导入的模块；可选依赖未安装时返回None，必需依赖未安装时立即报错"""
+    try:
+        found = importlib.util.find_spec(name) is not None
+    except ImportError:
+        found = False
+    if not found:
+        if required:
+            raise ModuleNotFoundError(f"No module named '{name}'", name=name)
+        return None
+    return LazyModule(name)
+
+
+asyncio = lazy_import('asyncio', required=True)
+requests = lazy_import('requests', required=True)
+aiohttp = lazy_import('aiohttp')
+np = lazy_import('numpy')
+shared_memory = lazy_import('multiprocessing.shared_memory')
+maxminddb = lazy_import('maxminddb')
+
+LAZY_MODULES = {'asyncio': asyncio, 'requests': requests, 'aiohttp': aiohttp, 'numpy': np, 'maxminddb': maxminddb}
+
+# non_us_ips 文件索引的读写实现，与 .github/scripts 中的清理和合并脚本共用
+MANIFEST_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.github', 'scripts', 'manifest.py')
+
+# 需要重试的HTTP状态码（限流和服务端临时错误）
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# 单次扫描同时匹配IPv4和IPv6的预编译正则：
+# IPv4 按四段十进制匹配；IPv6 匹配由十六进制数字和冒号组成、至少含两个冒号的完整片段（可以以点分IPv4结尾，
+# 如 ::ffff:8.8.8.8），再交由 ipaddress 校验。IPv6 前面不能紧接字母数字或冒号，只有 "ID:"、"IPv6:" 这类
+# 以字母（或字母加4/6）结尾的标签后面的冒号例外，标签本身不计入地址；"a:2606:..." 这种纯字母段后接数字段的
+# 开头也视为标签（公网地址的第一段总是以2或3开头）。开头的单字符前瞻让大部分位置不必再检查后面的几个条件
+_IPV4_OCTET = r'(25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)'
+IP_TOKEN_PATTERN = re.compile(
+    r'\b(?P<v4>' + r'\.'.join([_IPV4_OCTET] * 4) + r')\b'
+    r'|(?=[0-9A-Fa-f:])(?<![0-9A-Za-z])(?:(?<!:)(?![A-Fa-f]+:\d)|(?<=[A-Za-z]:)|(?<=[G-Zg-z][46]:))'
+    r'(?P<v6>(?=[0-9A-Fa-f]*:[0-9A-Fa-f]*:)[0-9A-Fa-f:]{2,39}(?:(?<=:)\d{1,3}(?:\.\d{1,3}){3})?)'
+    r'(?![0-9A-Fa-f:]|\.\d)'
+)
+
+# 与 ipaddress 模块 is_private 判断一致的保留网段
+PRIVATE_NETWORKS = {
+    4: ['0.0.0.0/8', '10.0.0.0/8', '127.0.0.0/8', '169.254.0.0/16', '172.16.0.0/12',
+        '192.0.0.0/29', '192.0.0.170/31', '192.0.2.0/24', '192.168.0.0/16', '198.18.0.0/15',
+        '198.51.100.0/24', '203.0.113.0/24', '240.0.0.0/4', '255.255.255.255/32'],
+    6: ['::1/128', '::/128', '100::/64', '2001::/23', '2001:2::/48',
+        '2001:db8::/32', '2001:10::/28', 'fc00::/7', 'fe80::/10']
+}
+
+
+def build_range_table(networks):
+    """将网段列表转换为按起始地址排序、合并后的整数区间表 (starts, ends)"""
+    ranges = sorted(
+        (int(net.network_address), int(net.broadcast_address))
+        for net in map(ipaddress.ip_network, networks)
+    )
+    starts, ends = [], []
+    for start, end in ranges:
+        if ends and start <= ends[-1] + 1:
+            ends[-1] = max(ends[-1], end)
+        else:
+            starts.append(start)
+            ends.append(end)
+    return starts, ends
+
+
+PRIVATE_RANGES = {version: build_range_table(networks) for version, networks in PRIVATE_NETWORKS.items()}
+
+
+def in_range_table(table, value):
+    """判断整数地址是否落在区间表中"""
+    starts, ends = table
+    pos = bisect.bisect_right(starts, value) - 1
+    return pos >= 0 and value <= ends[pos]
+
+
+def is_private_value(version, value):
+    """用整数区间表判断地址是否为私有地址；IPv4映射的IPv6地址按其IPv4地址判断"""
+    if version == 6 and value >> 32 == 0xFFFF:
+        return in_range_table(PRIVATE_RANGES[4], value & 0xFFFFFFFF)
+    return in_range_table(PRIVATE_RANGES[version], value)
+
+
+# 可能出现在IP地址及其标签前缀（如 "IPv6:"）中的字符，分块扫描时块尾由这些字符组成的片段需要留到下一块
+IP_TOKEN_CHARS = frozenset('0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ.:')
+
+
+def iter_ip_tokens(text):
+    """单次扫描文本，依次产出 (版本, 原始IP字符串, IPv4整数值或None)"""
+    for match in IP_TOKEN_PATTERN.finditer(text):
+        if match.group('v4') is not None:
+            a, b, c, d = match.group(2, 3, 4, 5)
+            value = (int(a) << 24) | (int(b) << 16) | (int(c) << 8) | int(d)
+            # 与 ipaddress 一致：带前导零的段视为无效
+            valid = not any(len(part) > 1 and part[0] == '0' for part in (a, b, c, d))
+            yield 4, match.group('v4'), value if valid else None
+        else:
+            ip_str = match.group('v6')
+            if ip_str[0] == ':' and ip_str[1] != ':' and text[match.start('v6') - 1] == ':':
+                # "x::ffff:8.8.8.8"：标签后的冒号同时是 "::" 的第一个冒号
+                ip_str = ':' + ip_str
+            yield 6, ip_str, None
+
+def extract_ip_values(text, remove_private=True):
+    """提取并校验文本中的IP，返回整数形式的 (IPv4集合, IPv6集合)，结果与 extract_ips_from_text 校验模式一致"""
+    ipv4 = set()
+    ipv6 = set()
+    for version, ip_str, value in iter_ip_tokens(text):
+        if version == 4:
+            if value is None or (remove_private and is_private_value(4, value)):
+                continue
+            ipv4.add(value)
+        else:
+            try:
+                value = int(ipaddress.IPv6Address(ip_str))
+            except ValueError:
+                continue
+            if value >> 32 == 0xFFFF:
+                # IPv4映射地址按其IPv4地址收集
+                if not (remove_private and is_private_value(4, value & 0xFFFFFFFF)):
+                    ipv4.add(value & 0xFFFFFFFF)
+                continue
+            if remove_private and is_private_value(6, value):
+                continue
+            ipv6.add(value)
+    return ipv4, ipv6
+
+
+def extract_packed_ips(source, size=0, encoding=None, remove_private=True):
+    """在子进程中执行的提取函数
+    
+    source 为共享内存块名称（正文放在共享内存中）或正文 bytes；
+    返回 (IPv4 uint32 数组的字节, IPv6 每个16字节大端序拼接的字节)，比返回字符串集合的序列化开销小得多。
+    """
+    if isinstance(source, str):
+        block = shared_memory.SharedMemory(name=source)
+        try:
+            data = bytes(block.buf[:size])
+        finally:
+            block.close()
+    else:
+        data = source
+    ipv4, ipv6 = extract_ip_values(data.decode(encoding or 'utf-8', errors='replace'), remove_private)
+    return array('I', sorted(ipv4)).tobytes(), b''.join(value.to_bytes(16, 'big') for value in sorted(ipv6))
+
+
+def unpack_ips(packed):
+    """extract_packed_ips 的结果转换回字符串集合"""
+    packed_ipv4, packed_ipv6 = packed
+    ipv4 = IPSet(4)
+    ipv4.update_values(array('I', packed_ipv4))
+    ipv6 = IPSet(6)
+    ipv6.update_values(int.from_bytes(packed_ipv6[i:i + 16], 'big') for i in range(0, len(packed_ipv6), 16))
+    return set(ipv4), set(ipv6)
+
+
+async def measure_tcp_latency(host, port, samples=3, timeout=2.0, ssl_context=None, server_hostname=None):
+    """对 host:port 进行多次TCP握手（可选TLS握手）测速
+    
+    返回 {'min': 毫秒, 'median': 毫秒, 'loss': 丢包率}，全部失败时 min/median 为 None。
+    """
+    latencies = []
+    for _ in range(samples):
+        start = time.perf_counter()
+        try:
+            _, writer = await asyncio.wait_for(
+                asyncio.open_connection(
+                    host, port, ssl=ssl_context,
+                    server_hostname=server_hostname if ssl_context else None
+                ),
+                timeout
+            )
+        except (OSError, asyncio.TimeoutError, ssl.SSLError):
+            continue
+        latencies.append((time.perf_counter() - start) * 1000)
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except (OSError, ssl.SSLError):
+            pass
+    return {
+        'min': min(latencies) if latencies else None,
+        'median': statistics.median(latencies) if latencies else None,
+        'loss': 1 - len(latencies) / samples if samples else 1.0
+    }
+
+
+@contextmanager
+def atomic_open(path):
+    """写入同目录下的临时文件，成功后用 os.replace 原子替换目标文件，读者不会看到写了一半的内容"""
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            yield f
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+class StatusHandler(BaseHTTPRequestHandler):
+    """常驻模式的状态接口：GET /status 返回最近一轮收集的统计信息"""
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/status'):
+            self.send_error(404)
+            return
+        body = json.dumps(self.server.collector.daemon_status, ensure_ascii=False, indent=2).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ResultAPIServer:
+    """基于 asyncio 的只读HTTP接口，从内存中的结果快照提供过滤后的IP列表
+
+    GET /ips 支持的查询参数：
+      family=4|6          只返回指定地址族
+      country=日本,香港    地理位置包含任一关键词
+      exclude_us=1        排除 us_keywords 匹配的地址
+      top=N               按测速结果（丢包率、中位延迟）取前N个，未测速的排在后面
+      port=N              覆盖输出中的端口
+      format=text|json|csv 未指定时按 Accept 请求头协商，默认 text
+    响应带 ETag，支持 If-None-Match 返回304，客户端接受时使用 gzip 压缩。
+    """
+
+    FORMATS = {
+        'text': 'text/plain; charset=utf-8',
+        'json': 'application/json; charset=utf-8',
+        'csv': 'text/csv; charset=utf-8'
+    }
+    MAX_CACHED_RESPONSES = 256
+
+    def __init__(self, collector, host, port):
+        self.collector = collector
+        self.host = host
+        self.port = port
+        self.responses = {}
+        self.responses_generation = None
+
+    async def serve_forever(self):
+        server = await asyncio.start_server(self.handle_connection, self.host, self.port)
+        print(f'🛰️  IP列表接口: http://{self.host}:{self.port}/ips')
+        async with server:
+            await server.serve_forever()
+
+    async def handle_connection(self, reader, writer):
+        """解析HTTP/1.1请求，支持 keep-alive 复用连接"""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                
+                parts = request_line.decode('utf-8', errors='replace').split()
+                if len(parts) != 3:
+                    await self.send(writer, 400, b'bad request\n')
+                    break
+                method, target, version = parts
+                keep_alive = headers.get('connection', '').lower() != 'close' and version == 'HTTP/1.1'
+                if method not in ('GET', 'HEAD'):
+                    await self.send(writer, 405, b'method not allowed\n', keep_alive=keep_alive)
+                else:
+                    status, response_headers, body = self.respond(target, headers)
+                    await self.send(writer, status, body, response_headers, keep_alive, method == 'HEAD')
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def send(self, writer, status, body, headers=None, keep_alive=False, head_only=False):
+        reason = {200: 'OK', 304: 'Not Modified', 400: 'Bad Request', 404: 'Not Found',
+                  405: 'Method Not Allowed', 503: 'Service Unavailable'}[status]
+        lines = [f'HTTP/1.1 {status} {reason}']
+        for name, value in (headers or {'Content-Type': 'text/plain; charset=utf-8'}).items():
+            lines.append(f'{name}: {value}')
+        lines.append(f'Content-Length: {len(body)}')
+        lines.append(f'Connection: {"keep-alive" if keep_alive else "close"}')
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+        if not head_only and status != 304:
+            writer.write(body)
+        await writer.drain()
+
+    def respond(self, target, headers):
+        """返回 (状态码, 响应头, 正文)；同一快照下相同的查询直接复用已生成的响应"""
+        parsed = urlparse(target)
+        if parsed.path not in ('/', '/ips'):
+            return 404, None, b'not found\n'
+        snapshot = self.collector.current_results()
+        if snapshot is None:
+            return 503, None, b'no results yet\n'
+        generation, records = snapshot
+        
+        query = {key: values[-1] for key, values in parse_qs(parsed.query).items()}
+        fmt = query.get('format') or self.negotiate(headers.get('accept', ''))
+        if fmt not in self.FORMATS:
+            return 400, None, f'unknown format: {fmt}\n'.encode('utf-8')
+        use_gzip = 'gzip' in headers.get('accept-encoding', '')
+        
+        if self.responses_generation != generation:
+            self.responses = {}
+            self.responses_generation = generation
+        key = (tuple(sorted(query.items())), fmt, use_gzip)
+        if key not in self.responses:
+            try:
+                body = self.render(self.filter(records, query), fmt, query)
+            except ValueError as e:
+                return 400, None, f'{e}\n'.encode('utf-8')
+            etag = '"' + hashlib.sha1(f'{generation}|{key}'.encode('utf-8')).hexdigest()[:20] + '"'
+            response_headers = {'Content-Type': self.FORMATS[fmt], 'ETag': etag, 'Vary': 'Accept, Accept-Encoding'}
+            if use_gzip:
+                body = gzip.compress(body)
+                response_headers['Content-Encoding'] = 'gzip'
+            if len(self.responses) >= self.MAX_CACHED_RESPONSES:
+                self.responses.clear()
+            self.responses[key] = (response_headers, body)
+        response_headers, body = self.responses[key]
+        
+        if response_headers['ETag'] in [tag.strip() for tag in headers.get('if-none-match', '').split(',')]:
+            return 304, {'ETag': response_headers['ETag']}, b''
+        return 200, response_headers, body
+
+    def negotiate(self, accept):
+        for fmt, content_type in (('json', 'application/json'), ('csv', 'text/csv')):
+            if content_type in accept:
+                return fmt
+        return 'text'
+
+    def filter(self, records, query):
+        family = query.get('family', '')
+        if family not in ('', '4', '6', 'all'):
+            raise ValueError(f'family must be 4 or 6: {family}')
+        if family in ('4', '6'):
+            records = [record for record in records if record[1] == int(family)]
+        if query.get('country'):
+            keywords = [keyword.strip().lower() for keyword in query['country'].split(',') if keyword.strip()]
+            records = [record for record in records if any(keyword in record[2].lower() for keyword in keywords)]
+        if query.get('exclude_us') in ('1', 'true', 'yes'):
+            records = [record for record in records if not self.collector.is_us_location(record[2])]
+        if query.get('top'):
+            if not query['top'].isdigit():
+                raise ValueError(f'top must be a number: {query["top"]}')
+            # 有测速结果的按丢包率、中位延迟排序，其余保持IP顺序排在后面（sorted 是稳定排序）
+            records = sorted(
+                records,
+                key=lambda record: (0, record[3]['loss'], record[3]['median']) if record[3] else (1, 0, 0)
+            )[:int(query['top'])]
+        return records
+
+    def render(self, records, fmt, query):
+        port = query.get('port') or str(self.collector.config['output_settings']['port'])
+        if not port.isdigit():
+            raise ValueError(f'port must be a number: {port}')
+        if fmt == 'json':
+            return json.dumps([
+                {
+                    'ip': ip, 'family': version, 'port': int(port), 'location': location,
+                    'latency_ms': round(stats['median'], 1) if stats else None,
+                    'loss': stats['loss'] if stats else None,
+                    'colo': meta.get('colo'), 'line': meta.get('line'), 'speed': meta.get('speed')
+                }
+                for ip, version, location, stats, meta in records
+            ], ensure_ascii=False).encode('utf-8')
+        if fmt == 'csv':
+            output = io.StringIO()
+            csv_writer = csv.writer(output)
+            csv_writer.writerow(['ip', 'family', 'port', 'location', 'latency_ms', 'loss', 'colo', 'line', 'speed'])
+            for ip, version, location, stats, meta in records:
+                csv_writer.writerow([
+                    ip, version, port, location,
+                    f"{stats['median']:.1f}" if stats else '', stats['loss'] if stats else '',
+                    meta.get('colo', ''), meta.get('line', ''), meta.get('speed', '')
+                ])
+            return output.getvalue().encode('utf-8')
+        lines = [
+            f"[{ip}]:{port}#{location}-IPV6" if version == 6 else f"{ip}:{port}#{location}"
+            for ip, version, location, stats, meta in records
+        ]
+        return ('\n'.join(lines) + '\n' if lines else '').encode('utf-8')
+
+
+class RunReport:
+    """运行报告：记录各阶段耗时、各数据源的获取/解析统计和地理位置查询延迟分布"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started_at = time.time()
+        self.phases = {}
+        self.sources = {}
+        self.geo_latencies = []
+        self.geo_lookups = 0
+        self.geo_located = 0
+        self.api_check = None
+
+    @contextmanager
+    def phase(self, name):
+        """统计一个阶段的耗时（秒）"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0) + time.perf_counter() - start
+
+    def record_source(self, url, **fields):
+        with self.lock:
+            self.sources.setdefault(url, {}).update(fields)
+
+    def record_geo_latency(self, seconds):
+        with self.lock:
+            self.geo_latencies.append(seconds * 1000)
+
+    def record_geo_lookup(self, success):
+        """记录一次实际发出的地理位置查询（缓存命中不计入）"""
+        with self.lock:
+            self.geo_lookups += 1
+            if success:
+                self.geo_located += 1
+
+    @staticmethod
+    def percentiles(values, points=(50, 95, 99)):
+        """最近秩法计算百分位数"""
+        if not values:
+            return {f'p{point}': None for point in points}
+        ordered = sorted(values)
+        return {
+            f'p{point}': round(ordered[min(len(ordered) - 1, max(0, -(-point * len(ordered) // 100) - 1))], 2)
+            for point in points
+        }
+
+    def to_dict(self):
+        with self.lock:
+            return {
+                'started_at': datetime.fromtimestamp(self.started_at, timezone(timedelta(hours=8))).strftime('%Y-%m-%d %H:%M:%S'),
+                'total_seconds': round(time.time() - self.started_at, 3),
+                'phases': {name: round(seconds, 3) for name, seconds in self.phases.items()},
+                'sources': self.sources,
+                'geolocation': {
+                    'queries': len(self.geo_latencies),
+                    'lookups': self.geo_lookups,
+                    'located': self.geo_located,
+                    'latency_ms': self.percentiles(self.geo_latencies),
+                    'api_check': self.api_check
+                }
+            }
+
+
+class AdaptiveLimiter:
+    """自适应并发控制器
+    
+    按 AIMD 方式调整同时进行的请求数：请求成功且延迟正常时并发上限缓慢增加（每轮 +1），
+    遇到限流信号（HTTP 429/5xx、超时、接口 status 非 '0'）或延迟超过目标时成倍减小。
+    另有令牌桶限制每秒请求数，rate 为 0 时不限速。
+    """
+
+    def __init__(self, initial, min_limit, max_limit, latency_target, rate=0):
+        self.limit = float(max(min_limit, min(initial, max_limit)))
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_target = latency_target
+        self.rate = rate
+        self.tokens = float(max(1, rate))
+        self.last_refill = time.monotonic()
+        self.last_decrease = 0.0
+        self.in_flight = 0
+        self.finished = []
+        self.condition = threading.Condition()
+
+    def _take_token(self):
+        """尝试取一个令牌，返回需要等待的秒数（0表示已取得）"""
+        if not self.rate:
+            return 0
+        now = time.monotonic()
+        self.tokens = min(float(max(1, self.rate)), self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def acquire(self):
+        with self.condition:
+            while True:
+                if self.in_flight < int(self.limit):
+                    wait = self._take_token()
+                    if not wait:
+                        self.in_flight += 1
+                        return
+                else:
+                    wait = None
+                self.condition.wait(wait)
+
+    async def acquire_async(self):
+        """asyncio 版本的 acquire：不阻塞事件循环，没有空闲名额时短暂等待后重试"""
+        while True:
+            with self.condition:
+                if self.in_flight < int(self.limit):
+                    wait = self._take_token()
+                    if not wait:
+                        self.in_flight += 1
+                        return
+                else:
+                    wait = 0.01
+            await asyncio.sleep(wait)
+
+    def release(self, throttled, latency):
+        with self.condition:
+            self.in_flight -= 1
+            now = time.monotonic()
+            self.finished.append(now)
+            if throttled or latency > self.latency_target:
+                # 同一批并发请求的连续失败只减一次
+                if now - self.last_decrease > latency:
+                    self.limit = max(self.min_limit, self.limit / 2)
+                    self.last_decrease = now
+            else:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self.condition.notify_all()
+
+    def current_rate(self, window=5.0):
+        """最近 window 秒内的完成速率（次/秒）"""
+        with self.condition:
+            cutoff = time.monotonic() - window
+            self.finished = [t for t in self.finished if t >= cutoff]
+            return len(self.finished) / window
+
+
+class GeoCache:
+    """地理位置持久化缓存（SQLite），以打包后的IP地址为键，支持TTL和失败结果缓存"""
+
+    def __init__(self, db_path, ttl, negative_ttl):
+        folder = os.path.dirname(db_path)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS geo_cache ('
+            'ip BLOB PRIMARY KEY, location TEXT NOT NULL, '
+            'success INTEGER NOT NULL, updated_at REAL NOT NULL)'
+        )
+        self.conn.commit()
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def pack(ip):
+        """将IP地址转换为紧凑的二进制键（IPv4 4字节，IPv6 16字节）"""
+        return ipaddress.ip_address(ip).packed
+
+    def get_many(self, ips):
+        """批量查询缓存，返回 {ip: (location, success)}，过期条目视为未命中"""
+        now = time.time()
+        keys = {}
+        for ip in ips:
+            try:
+                keys[self.pack(ip)] = ip
+            except ValueError:
+                continue
+
+        found = {}
+        packed_keys = list(keys)
+        with self.lock:
+            for start in range(0, len(packed_keys), 500):
+                chunk = packed_keys[start:start + 500]
+                placeholders = ','.join('?' * len(chunk))
+                rows = self.conn.execute(
+                    f'SELECT ip, location, success, updated_at FROM geo_cache WHERE ip IN ({placeholders})',
+                    chunk
+                ).fetchall()
+                for key, location, success, updated_at in rows:
+                    ttl = self.ttl if success else self.negative_ttl
+                    if now - updated_at <= ttl:
+                        found[keys[key]] = (location, bool(success))
+
+            self.misses += len(ips) - len(found)
+            for location, success in found.values():
+                if success:
+                    self.hits += 1
+                else:
+                    self.negative_hits += 1
+        return found
+
+    def set_many(self, results):
+        """批量写入查询结果，results 为 (ip, location, success) 列表"""
+        now = time.time()
+        rows = []
+        for ip, location, success in results:
+            try:
+                rows.append((self.pack(ip), location, int(bool(success)), now))
+            except ValueError:
+                continue
+        with self.lock:
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO geo_cache (ip, location, success, updated_at) VALUES (?, ?, ?, ?)',
+                rows
+            )
+            self.conn.commit()
+
+    def prune(self):
+        """删除所有已过期的缓存条目"""
+        cutoff = time.time() - max(self.ttl, self.negative_ttl)
+        with self.lock:
+            deleted = self.conn.execute('DELETE FROM geo_cache WHERE updated_at < ?', (cutoff,)).rowcount
+            self.conn.commit()
+        return deleted
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+class HistoryStore:
+    """IP历史记录（SQLite）：每次运行追加一条记录，并维护每个IP及其数据源的首次/最后出现时间
+
+    表结构：
+      runs       每次运行的时间和IP数量
+      sightings  每次运行中出现的每个IP及其地理位置（只追加）
+      ips        每个IP最近一次的地理位置、是否美国以及首次/最后出现时间
+      ip_sources 每个IP来自哪些数据源及首次/最后出现时间
+    IP以打包后的二进制存储，同一地址族内按字节排序即按数值排序。
+    """
+
+    def __init__(self, db_path):
+        folder = os.path.dirname(db_path)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.executescript(
+            'CREATE TABLE IF NOT EXISTS runs ('
+            'id INTEGER PRIMARY KEY AUTOINCREMENT, seen_at REAL NOT NULL, '
+            'ipv4_count INTEGER NOT NULL, ipv6_count INTEGER NOT NULL);'
+            'CREATE TABLE IF NOT EXISTS sightings ('
+            'run_id INTEGER NOT NULL, ip BLOB NOT NULL, family INTEGER NOT NULL, '
+            'location TEXT NOT NULL, is_us INTEGER NOT NULL, seen_at REAL NOT NULL);'
+            'CREATE INDEX IF NOT EXISTS sightings_seen_at ON sightings (seen_at);'
+            'CREATE INDEX IF NOT EXISTS sightings_ip ON sightings (ip);'
+            'CREATE TABLE IF NOT EXISTS ips ('
+            'ip BLOB PRIMARY KEY, family INTEGER NOT NULL, location TEXT NOT NULL, is_us INTEGER NOT NULL, '
+            'first_seen REAL NOT NULL, last_seen REAL NOT NULL);'
+            'CREATE INDEX IF NOT EXISTS ips_last_seen ON ips (last_seen, is_us);'
+            'CREATE TABLE IF NOT EXISTS ip_sources ('
+            'ip BLOB NOT NULL, source TEXT NOT NULL, first_seen REAL NOT NULL, last_seen REAL NOT NULL, '
+            'PRIMARY KEY (ip, source));'
+        )
+        self.conn.commit()
+
+    @staticmethod
+    def unpack(packed):
+        return str(ipaddress.ip_address(bytes(packed)))
+
+    def record_run(self, results, sources, is_us):
+        """记录一次运行：results 为 (ip, 地址族, location) 列表，sources 为 {ip: 数据源集合}"""
+        now = time.time()
+        rows = []
+        source_rows = []
+        for ip, family, location in results:
+            try:
+                packed = GeoCache.pack(ip)
+            except ValueError:
+                continue
+            rows.append((packed, family, location, int(is_us(location))))
+            source_rows.extend((packed, source, now, now) for source in sources.get(ip, ()))
+        with self.lock:
+            with self.conn:
+                run_id = self.conn.execute(
+                    'INSERT INTO runs (seen_at, ipv4_count, ipv6_count) VALUES (?, ?, ?)',
+                    (now, sum(1 for row in rows if row[1] == 4), sum(1 for row in rows if row[1] == 6))
+                ).lastrowid
+                self.conn.executemany(
+                    'INSERT INTO sightings (run_id, ip, family, location, is_us, seen_at) VALUES (?, ?, ?, ?, ?, ?)',
+                    [(run_id, *row, now) for row in rows]
+                )
+                self.conn.executemany(
+                    'INSERT INTO ips (ip, family, location, is_us, first_seen, last_seen) VALUES (?, ?, ?, ?, ?, ?) '
+                    'ON CONFLICT (ip) DO UPDATE SET '
+                    'location = excluded.location, is_us = excluded.is_us, last_seen = excluded.last_seen',
+                    [(*row, now, now) for row in rows]
+                )
+                self.conn.executemany(
+                    'INSERT INTO ip_sources (ip, source, first_seen, last_seen) VALUES (?, ?, ?, ?) '
+                    'ON CONFLICT (ip, source) DO UPDATE SET last_seen = excluded.last_seen',
+                    source_rows
+                )
+        return run_id
+
+    def query(self, since, include_us=False):
+        """返回 since 之后出现过的IP：[(ip, 地址族, location, first_seen, last_seen)]，按地址族和IP排序"""
+        sql = 'SELECT ip, family, location, first_seen, last_seen FROM ips WHERE last_seen >= ?'
+        if not include_us:
+            sql += ' AND is_us = 0'
+        with self.lock:
+            rows = self.conn.execute(sql + ' ORDER BY family, ip', (since,)).fetchall()
+        return [(self.unpack(ip), family, location, first_seen, last_seen) for ip, family, location, first_seen, last_seen in rows]
+
+    def sources(self, ip):
+        """返回某个IP出现过的数据源 {url: (first_seen, last_seen)}"""
+        with self.lock:
+            rows = self.conn.execute(
+                'SELECT source, first_seen, last_seen FROM ip_sources WHERE ip = ?', (GeoCache.pack(ip),)
+            ).fetchall()
+        return {source: (first_seen, last_seen) for source, first_seen, last_seen in rows}
+
+    def prune(self, cutoff):
+        """在一个事务中删除 cutoff 之前的所有历史记录，返回删除的出现记录数"""
+        with self.lock:
+            with self.conn:
+                deleted = self.conn.execute('DELETE FROM sightings WHERE seen_at < ?', (cutoff,)).rowcount
+                self.conn.execute('DELETE FROM runs WHERE seen_at < ?', (cutoff,))
+                self.conn.execute('DELETE FROM ips WHERE last_seen < ?', (cutoff,))
+                self.conn.execute('DELETE FROM ip_sources WHERE last_seen < ?', (cutoff,))
+        return deleted
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+class SourceStateStore:
+    """数据源状态存储（JSON），记录每个URL的ETag、Last-Modified、内容哈希和上次提取的IP"""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.states = {}
+        if os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    self.states = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f'❌ 读取数据源状态文件失败: {e}，将重新获取所有数据源')
+
+    def get(self, url):
+        with self.lock:
+            return dict(self.states.get(url, {}))
+
+    def update(self, url, **fields):
+        with self.lock:
+            self.states.setdefault(url, {}).update(fields)
+
+    def save(self):
+        """先写临时文件再替换，避免中途出错损坏状态文件"""
+        folder = os.path.dirname(self.path)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+        tmp_path = self.path + '.tmp'
+        with self.lock:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.states, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+
+class StreamingExtractor:
+    """分块提取IP：块尾可能被截断的地址片段保留到下一块继续扫描，内存占用与响应大小无关
+    
+    传入 parser 时解码后的文本同时交给解析器，用于收集数据源公布的延迟、数据中心等指标。
+    """
+
+    def __init__(self, extract, encoding=None, max_bytes=0, on_ips=None, parser=None):
+        self.extract = extract
+        self.parser = parser
+        self.decoder = codecs.getincrementaldecoder(encoding or 'utf-8')(errors='ignore')
+        self.digest = hashlib.sha256()
+        self.max_bytes = max_bytes
+        self.on_ips = on_ips
+        self.carry = ''
+        self.size = 0
+        self.truncated = False
+        self.ipv4 = set()
+        self.ipv6 = set()
+
+    def _scan(self, text):
+        ipv4, ipv6 = self.extract(text)
+        self.ipv4.update(ipv4)
+        self.ipv6.update(ipv6)
+        if self.on_ips and (ipv4 or ipv6):
+            self.on_ips(ipv4, ipv6)
+
+    def feed(self, chunk):
+        """处理一个数据块，超过大小上限时返回False"""
+        self.size += len(chunk)
+        if self.max_bytes and self.size > self.max_bytes:
+            self.truncated = True
+            return False
+        self.digest.update(chunk)
+        decoded = self.decoder.decode(chunk)
+        if self.parser:
+            self.parser.feed(decoded)
+        text = self.carry + decoded
+        cut = len(text) - 1
+        while cut >= 0 and text[cut] in IP_TOKEN_CHARS:
+            cut -= 1
+        if cut < 0:
+            # 整块都是地址字符，只保留足够拼出一个地址的尾部
+            cut = max(0, len(text) - 64)
+        # 分隔字符同时留在本次扫描末尾和下一块开头，保证词边界判断与整段扫描一致
+        self._scan(text[:cut + 1])
+        self.carry = text[cut:]
+        return True
+
+    def close(self):
+        """扫描剩余片段，返回内容哈希"""
+        decoded = self.decoder.decode(b'', final=True)
+        if self.parser:
+            self.parser.feed(decoded)
+        self._scan(self.carry + decoded)
+        self.carry = ''
+        return self.digest.hexdigest()
+
+
+# 表头/JSON字段关键字 -> 元数据字段；指标列先于地址列匹配，避免 "IP延迟" 之类的列被当成地址列
+SOURCE_META_COLUMNS = (
+    ('latency', ('延迟', 'latency', 'ping', 'delay')),
+    ('loss', ('丢包', 'loss')),
+    ('speed', ('速度', 'speed', '带宽')),
+    ('colo', ('colo', '数据中心', '机房', 'datacenter')),
+    ('line', ('线路', 'line', '运营商', 'isp')),
+)
+
+NUMBER_PATTERN = re.compile(r'\d+(?:\.\d+)?')
+COLO_PATTERN = re.compile(r'^[A-Z]{3}$')
+
+
+def meta_field(name):
+    """表头或字段名对应的元数据字段，无法识别时返回None"""
+    name = name.strip().lower()
+    for field, keywords in SOURCE_META_COLUMNS:
+        if any(keyword in name for keyword in keywords):
+            return field
+    if name.startswith('ip') or '地址' in name or name in ('address', 'addr', 'host'):
+        return 'ip'
+    return None
+
+
+def normalize_meta(raw):
+    """整理数据源公布的指标：latency 转为毫秒浮点数，loss 转为 0~1，其余保留原文
+    
+    这些数据源不写单位时延迟是毫秒、丢包率是百分数；只有明确写了秒（如 "0.5s"）才按秒换算。
+    """
+    meta = {}
+    for field, value in raw.items():
+        if value is None or field == 'ip':
+            continue
+        value = str(value).strip()
+        if not value:
+            continue
+        if field in ('latency', 'loss'):
+            match = NUMBER_PATTERN.search(value)
+            if not match:
+                continue
+            number = float(match.group())
+            unit = value[match.end():].strip().lower()
+            if field == 'latency' and unit.startswith(('s', '秒')):
+                number *= 1000
+            if field == 'loss':
+                number /= 100
+            meta[field] = number
+        else:
+            meta[field] = value
+    return meta
+
+
+class SourceParser:
+    """数据源解析器基类：feed() 分块接收文本，close() 返回 [(IP候选文本, 元数据)]，无法识别时返回空列表"""
+
+    name = 'regex'
+
+    def __init__(self):
+        self.chunks = []
+
+    def feed(self, text):
+        self.chunks.append(text)
+
+    def close(self):
+        return self.parse(''.join(self.chunks))
+
+    def parse(self, text):
+        return []
+
+
+class HTMLTableParser(SourceParser, HTMLParser):
+    """流式解析HTML表格：按表头识别地址列和延迟/速度/数据中心/线路列，只处理单元格文本，不扫描整页标记"""
+
+    name = 'html_table'
+
+    def __init__(self):
+        SourceParser.__init__(self)
+        HTMLParser.__init__(self, convert_charrefs=True)
+        self.rows = []
+        self.columns = None
+        self.row = None
+        self.cell = None
+
+    def feed(self, text):
+        HTMLParser.feed(self, text)
+
+    def close(self):
+        HTMLParser.close(self)
+        return self.rows
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'table':
+            self.columns = None
+        elif tag == 'tr':
+            self.row = []
+        elif tag in ('td', 'th') and self.row is not None:
+            self.cell = []
+
+    def handle_endtag(self, tag):
+        if tag in ('td', 'th') and self.cell is not None:
+            self.row.append(''.join(self.cell).strip())
+            self.cell = None
+        elif tag == 'tr' and self.row is not None:
+            self.end_row(self.row)
+            self.row = None
+
+    def handle_data(self, data):
+        if self.cell is not None:
+            self.cell.append(data)
+
+    def end_row(self, cells):
+        if not any(IP_TOKEN_PATTERN.search(cell) for cell in cells):
+            # 不含地址的行作为表头
+            columns = [meta_field(cell) for cell in cells]
+            if 'ip' in columns:
+                self.columns = columns
+            return
+        if self.columns is None:
+            self.rows.extend((cell, {}) for cell in cells if IP_TOKEN_PATTERN.search(cell))
+            return
+        raw = {}
+        for field, cell in zip(self.columns, cells):
+            if field and field not in raw:
+                raw[field] = cell
+        if raw.get('ip'):
+            self.rows.append((raw['ip'], normalize_meta(raw)))
+
+
+class LineListParser(SourceParser):
+    """逐行解析地址列表，支持 IP、IP:端口、[IPv6]:端口、IP#数据中心 以及逗号分隔的多个地址；
+    超过一半的非空行不是以地址开头时视为无法识别"""
+
+    name = 'lines'
+    SPLIT_PATTERN = re.compile(r'[\s,;|]+')
+
+    def __init__(self):
+        super().__init__()
+        self.carry = ''
+        self.rows = []
+        self.misses = 0
+
+    def feed(self, text):
+        lines = (self.carry + text).split('\n')
+        self.carry = lines.pop()
+        for line in lines:
+            self.parse_line(line)
+
+    def close(self):
+        self.parse_line(self.carry)
+        self.carry = ''
+        if self.misses > len(self.rows):
+            return []
+        return self.rows
+
+    def parse_line(self, line):
+        line = line.strip()
+        if not line or line.startswith('#') or line.startswith('//'):
+            return
+        fields = [field for field in self.SPLIT_PATTERN.split(line) if field]
+        found = False
+        for field in fields:
+            address, _, label = field.partition('#')
+            if not IP_TOKEN_PATTERN.match(address.lstrip('[')):
+                if not found:
+                    break
+                continue
+            found = True
+            label = label.strip()
+            self.rows.append((address, {'colo': label} if COLO_PATTERN.match(label) else {}))
+        if not found:
+            self.misses += 1
+
+
+class JSONParser(SourceParser):
+    """解析JSON：字符串列表直接作为地址，对象按字段名识别地址和延迟/数据中心等指标"""
+
+    name = 'json'
+
+    def parse(self, text):
+        try:
+            data = json.loads(text)
+        except ValueError:
+            return []
+        rows = []
+        stack = [data]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, list):
+                for item in node:
+                    if isinstance(item, str):
+                        rows.append((item, {}))
+                    else:
+                        stack.append(item)
+            elif isinstance(node, dict):
+                raw = {}
+                for key, value in node.items():
+                    if isinstance(value, (dict, list)):
+                        stack.append(value)
+                        continue
+                    field = meta_field(str(key))
+                    if field and field not in raw:
+                        raw[field] = value
+                if isinstance(raw.get('ip'), str):
+                    rows.append((raw['ip'], normalize_meta(raw)))
+        return rows
+
+
+SOURCE_PARSERS = {
+    'regex': SourceParser,
+    'html_table': HTMLTableParser,
+    'lines': LineListParser,
+    'json': JSONParser,
+}
+
+
+class IPSet:
+    """整数存储的IP集合（单一地址族）
+    
+    IPv4 以 uint32、IPv6 以高/低两个 uint64 组成的 128 位整数存储，内部保持有序且无重复。
+    安装了 NumPy 时使用向量化的排序去重和集合运算，否则使用 array 模块存储。
+    新加入的地址先放入缓冲区，在需要读取时批量合并，只有输出时才转换回字符串。
+    """
+
+    _v6_dtype = None
+
+    @classmethod
+    def v6_dtype(cls):
+        """IPv6 的结构化 dtype（高/低两个 uint64），第一次使用时创建，导入本模块时不加载 NumPy"""
+        if cls._v6_dtype is None:
+            cls._v6_dtype = np.dtype([('hi', '<u8'), ('lo', '<u8')])
+        return cls._v6_dtype
+
+    def __init__(self, version, ips=()):
+        self.version = version
+        self.bits = 32 if version == 4 else 128
+        self._pending = []
+        if np is not None:
+            self._values = np.empty(0, dtype=np.uint32 if version == 4 else self.v6_dtype())
+        else:
+            self._values = array('I') if version == 4 else []
+        self.update(ips)
+
+    @staticmethod
+    def parse(ip):
+        """字符串转换为 (版本, 整数值)"""
+        if ':' in ip:
+            return 6, int(ipaddress.IPv6Address(ip))
+        a, b, c, d = ip.split('.')
+        return 4, (int(a) << 24) | (int(b) << 16) | (int(c) << 8) | int(d)
+
+    @staticmethod
+    def sort_key(ip):
+        """字符串IP的数值排序键，IPv4排在IPv6之前"""
+        try:
+            return IPSet.parse(ip)
+        except ValueError:
+            return 7, ip
+
+    def format(self, value):
+        value = int(value)
+        if self.version == 4:
+            return f'{value >> 24}.{(value >> 16) & 255}.{(value >> 8) & 255}.{value & 255}'
+        return str(ipaddress.IPv6Address(value))
+
+    def add(self, ip):
+        self.update((ip,))
+
+    def update(self, ips):
+        """批量加入字符串IP，无法解析或地址族不符的条目被忽略"""
+        for ip in ips:
+            try:
+                version, value = self.parse(ip)
+            except ValueError:
+                continue
+            if version == self.version:
+                self._pending.append(value)
+
+    def update_values(self, values):
+        """批量加入整数形式的地址"""
+        self._pending.extend(values)
+
+    def _from_ints(self, values):
+        values = list(values)
+        if np is None:
+            return array('I', values) if self.version == 4 else values
+        if self.version == 4:
+            return np.array(values, dtype=np.uint32)
+        packed = np.empty(len(values), dtype=self.v6_dtype())
+        packed['hi'] = [value >> 64 for value in values]
+        packed['lo'] = [value & 0xFFFFFFFFFFFFFFFF for value in values]
+        return packed
+
+    def _compact(self):
+        if not self._pending:
+            return
+        pending = self._from_ints(self._pending)
+        self._pending = []
+        if np is not None:
+            self._values = np.unique(np.concatenate((self._values, pending)))
+        elif self.version == 4:
+            self._values = array('I', sorted(set(self._values).union(pending)))
+        else:
+            self._values = sorted(set(self._values).union(pending))
+
+    def values(self):
+        """按数值升序返回所有地址的整数值"""
+        self._compact()
+        if np is not None and self.version == 6:
+            return [(int(hi) << 64) | int(lo) for hi, lo in self._values.tolist()]
+        return [int(value) for value in self._values]
+
+    def __len__(self):
+        self._compact()
+        return len(self._values)
+
+    def __iter__(self):
+        return (self.format(value) for value in self.values())
+
+    def __contains__(self, ip):
+        try:
+            version, value = self.parse(ip)
+        except ValueError:
+            return False
+        if version != self.version:
+            return False
+        self._compact()
+        if np is not None:
+            key = self._from_ints([value])[0] if self.version == 6 else np.uint32(value)
+            pos = int(np.searchsorted(self._values, key))
+            return pos < len(self._values) and self._values[pos] == key
+        pos = bisect.bisect_left(self._values, value)
+        return pos < len(self._values) and self._values[pos] == value
+
+    def _combine(self, other, operation):
+        self._compact()
+        other._compact()
+        result = IPSet(self.version)
+        if np is not None:
+            result._values = {
+                'union': np.union1d,
+                'intersection': np.intersect1d,
+                'difference': np.setdiff1d
+            }[operation](self._values, other._values)
+        else:
+            combined = getattr(set(self._values), operation)(other._values)
+            result._values = array('I', sorted(combined)) if self.version == 4 else sorted(combined)
+        return result
+
+    def __or__(self, other):
+        return self._combine(other, 'union')
+
+    def __and__(self, other):
+        return self._combine(other, 'intersection')
+
+    def __sub__(self, other):
+        return self._combine(other, 'difference')
+
+    def group_by_prefix(self, prefix_length):
+        """按前缀长度分组，返回 {网段: [IP字符串, ...]}，组内按数值排序"""
+        shift = self.bits - prefix_length
+        groups = {}
+        for value in self.values():
+            network = value >> shift << shift
+            groups.setdefault(network, []).append(self.format(value))
+        network_class = ipaddress.IPv4Network if self.version == 4 else ipaddress.IPv6Network
+        return {network_class((network, prefix_length)): members for network, members in groups.items()}
+
+
+class PrefixIndex:
+    """按起始地址排序的网段区间索引，用二分查找定位IP所属网段"""
+
+    def __init__(self):
+        self.starts = []
+        self.ends = []
+        self.values = []
+
+    def add(self, network, value):
+        """添加网段，重叠时保留先加入的网段"""
+        start = int(network.network_address)
+        end = int(network.broadcast_address)
+        pos = bisect.bisect_right(self.starts, start)
+        if pos > 0 and self.ends[pos - 1] >= start:
+            return
+        if pos < len(self.starts) and self.starts[pos] <= end:
+            return
+        self.starts.insert(pos, start)
+        self.ends.insert(pos, end)
+        self.values.insert(pos, value)
+
+    def lookup(self, ip, default=None):
+        """返回包含该IP的网段对应的值"""
+        value = int(ipaddress.ip_address(ip))
+        pos = bisect.bisect_right(self.starts, value) - 1
+        if pos >= 0 and value <= self.ends[pos]:
+            return self.values[pos]
+        return default
+
+    def __len__(self):
+        return len(self.starts)
+
+
+class GeoProvider:
+    """地理位置查询后端基类
+    
+    lookup(ip) 返回 (location, success, throttled)。每个后端可通过 max_concurrency
+    单独限制同时进行的查询数，is_local 为 True 的后端不访问网络。
+    """
+
+    name = 'base'
+    is_local = False
+    supports_batch = False
+
+    def __init__(self, collector, settings):
+        self.collector = collector
+        self.settings = settings
+        max_concurrency = settings.get('max_concurrency')
+        self.semaphore = threading.BoundedSemaphore(max_concurrency) if max_concurrency else None
+        self.batcher = None
+
+    def lookup(self, ip):
+        if self.semaphore is None:
+            return self.query(ip)
+        with self.semaphore:
+            return self.query(ip)
+
+    def query(self, ip):
+        raise NotImplementedError
+
+    def query_batch(self, ips):
+        """批量查询，返回 {ip: (location, success, throttled)}，缺失的IP由调用方回退到单个查询"""
+        raise NotImplementedError
+
+    def close(self):
+        if self.batcher:
+            self.batcher.close()
+
+
+class BaiduProvider(GeoProvider):
+    """百度 opendata resource_id=6006 接口"""
+
+    name = 'baidu'
+
+    def query(self, ip):
+        return self.collector.query_baidu(ip)
+
+
+class IpinfoProvider(GeoProvider):
+    """ipinfo 风格的JSON接口，url 中的 {ip} 会被替换为查询的地址"""
+
+    name = 'ipinfo'
+    supports_batch = True
+
+    def query_batch(self, ips):
+        """ipinfo /batch 接口（需要token），请求体为 "IP/字段" 路径列表"""
+        field = self.settings.get('field', 'country')
+        url = self.settings.get('batch_url', 'https://ipinfo.io/batch')
+        params = {'token': self.settings['token']} if self.settings.get('token') else None
+        try:
+            resp = self.collector.request_with_retry(
+                url, method='POST', params=params, json=[f'{ip}/{field}' for ip in ips]
+            )
+        except requests.exceptions.RequestException:
+            return {}
+        if resp.status_code != 200:
+            return {}
+        try:
+            data = resp.json()
+        except ValueError:
+            return {}
+        if not isinstance(data, dict):
+            return {}
+        results = {}
+        for ip in ips:
+            location = data.get(f'{ip}/{field}')
+            if isinstance(location, str) and location:
+                results[ip] = (location, True, False)
+        return results
+
+    def query(self, ip):
+        url = self.settings.get('url', 'https://ipinfo.io/{ip}/json').format(ip=ip)
+        params = {'token': self.settings['token']} if self.settings.get('token') else None
+        try:
+            resp = self.collector.request_with_retry(url, params=params)
+            if resp.status_code == 200:
+                data = resp.json()
+                location = data.get(self.settings.get('field', 'country')) if isinstance(data, dict) else None
+                if location:
+                    return location, True, False
+            return '未知', False, resp.status_code in RETRY_STATUS_CODES
+        except requests.exceptions.Timeout:
+            return '未知', False, True
+        except (requests.exceptions.RequestException, ValueError):
+            return '未知', False, False
+
+
+class IpApiProvider(GeoProvider):
+    """ip-api.com 接口，支持每次最多100个地址的 /batch 批量查询"""
+
+    name = 'ipapi'
+    supports_batch = True
+
+    def __init__(self, collector, settings):
+        super().__init__(collector, settings)
+        self.base_url = settings.get('url', 'http://ip-api.com').rstrip('/')
+        self.params = {'fields': 'status,country,query', 'lang': settings.get('language', 'zh-CN')}
+
+    def parse(self, item):
+        if isinstance(item, dict) and item.get('status') == 'success' and item.get('country'):
+            return item['country'], True, False
+        return '未知', False, False
+
+    def query(self, ip):
+        try:
+            resp = self.collector.request_with_retry(f'{self.base_url}/json/{ip}', params=self.params)
+            if resp.status_code == 200:
+                return self.parse(resp.json())
+            return '未知', False, resp.status_code in RETRY_STATUS_CODES
+        except requests.exceptions.Timeout:
+            return '未知', False, True
+        except (requests.exceptions.RequestException, ValueError):
+            return '未知', False, False
+
+    def query_batch(self, ips):
+        try:
+            resp = self.collector.request_with_retry(
+                f'{self.base_url}/batch', method='POST', params=self.params, json=list(ips)
+            )
+            if resp.status_code != 200:
+                return {}
+            data = resp.json()
+            if not isinstance(data, list):
+                return {}
+            return {item.get('query'): self.parse(item) for item in data if isinstance(item, dict)}
+        except (requests.exceptions.RequestException, ValueError):
+            return {}
+
+
+class GeoBatcher:
+    """批量查询层：待查询的IP攒够 batch_size 个，或最早的一个等待超过 flush_interval 秒后，
+    合并为一次批量请求；批量结果中缺失的IP按单个查询回退。submit() 返回 Future。
+    回退查询在独立的线程池中并发执行（仍受后端 max_concurrency 限制），不占用批量请求线程。
+    """
+
+    def __init__(self, provider, batch_size, flush_interval, fallback_single=True, workers=2,
+                 fallback_workers=None):
+        self.provider = provider
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.fallback_single = fallback_single
+        self.pending = []
+        self.first_pending_at = None
+        self.closed = False
+        self.condition = threading.Condition()
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.fallback_executor = ThreadPoolExecutor(max_workers=fallback_workers or workers)
+        self.batches = 0
+        self.fallbacks = 0
+        self.thread = threading.Thread(target=self._flush_loop, daemon=True)
+        self.thread.start()
+
+    def submit(self, ip):
+        future = Future()
+        with self.condition:
+            self.pending.append((ip, future))
+            if self.first_pending_at is None:
+                self.first_pending_at = time.monotonic()
+            if len(self.pending) >= self.batch_size:
+                self._dispatch()
+            else:
+                self.condition.notify()
+        return future
+
+    def flush(self):
+        """立即发出所有待查询的IP"""
+        with self.condition:
+            while self.pending:
+                self._dispatch()
+
+    def _dispatch(self):
+        batch, self.pending = self.pending[:self.batch_size], self.pending[self.batch_size:]
+        self.first_pending_at = time.monotonic() if self.pending else None
+        self.batches += 1
+        self.executor.submit(self._run_batch, batch)
+
+    def _flush_loop(self):
+        with self.condition:
+            while not self.closed:
+                if not self.pending:
+                    self.condition.wait()
+                    continue
+                remaining = self.first_pending_at + self.flush_interval - time.monotonic()
+                if remaining > 0:
+                    self.condition.wait(remaining)
+                    continue
+                self._dispatch()
+
+    def _run_batch(self, batch):
+        ips = [ip for ip, _ in batch]
+        try:
+            if self.provider.semaphore:
+                with self.provider.semaphore:
+                    results = self.provider.query_batch(ips)
+            else:
+                results = self.provider.query_batch(ips)
+        except Exception:
+            results = {}
+        if not isinstance(results, dict):
+            results = {}
+        for ip, future in batch:
+            result = results.get(ip)
+            if result is not None:
+                future.set_result(result)
+            elif self.fallback_single:
+                self.fallbacks += 1
+                self.fallback_executor.submit(self._run_single, ip, future)
+            else:
+                future.set_result(('未知', False, False))
+
+    def _run_single(self, ip, future):
+        try:
+            future.set_result(self.provider.lookup(ip))
+        except Exception as e:
+            future.set_exception(e)
+
+    def close(self):
+        self.flush()
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        self.executor.shutdown(wait=True)
+        self.fallback_executor.shutdown(wait=True)
+
+
+class MMDBProvider(GeoProvider):
+    """本地 MaxMind / DB-IP .mmdb 数据库（内存映射读取）"""
+
+    name = 'mmdb'
+    is_local = True
+
+    def __init__(self, collector, settings):
+        super().__init__(collector, settings)
+        if maxminddb is None:
+            raise RuntimeError('未安装 maxminddb')
+        self.reader = maxminddb.open_database(settings['path'], maxminddb.MODE_MMAP)
+        self.languages = [settings.get('language', 'zh-CN'), 'en']
+
+    def query(self, ip):
+        try:
+            record = self.reader.get(ip)
+        except ValueError:
+            return '未知', False, False
+        if record:
+            for key in ('country', 'registered_country', 'continent'):
+                names = record.get(key, {}).get('names', {})
+                for language in self.languages:
+                    if names.get(language):
+                        return names[language], True, False
+        return '未知', False, False
+
+    def close(self):
+        self.reader.close()
+
+
+GEO_PROVIDERS = {
+    provider.name: provider for provider in (BaiduProvider, IpinfoProvider, IpApiProvider, MMDBProvider)
+}
+
 
 class CFIPCollector:
     def __init__(self, urls_config='urls.json', main_config='config.json'):
@@ -58,7 +1600,8 @@ class CFIPCollector:
             ]
     
     def load_main_config(self, config_file):
-        """加载主配置文件，自动忽略注释"""
+        """加载主配置文件，自动忽略注释，缺失的配置项使用默认值"""
+        self.set_default_config()
         try:
             with open(config_file, 'r', encoding='utf-8') as f:
                 content = f.read()
@@ -73,7 +1616,12 @@ class CFIPCollector:
                     cleaned_lines.append(line)
             
             cleaned_content = '\n'.join(cleaned_lines)
-            self.config = json.loads(cleaned_content)
+            user_config = json.loads(cleaned_content)
+            for section, values in user_config.items():
+                if isinstance(values, dict) and isinstance(self.config.get(section), dict):
+                    self.config[section].update(values)
+                else:
+                    self.config[section] = values
             print('✅ 主配置文件加载成功')
         except Exception as e:
             print(f'❌ 加载主配置文件失败: {e}，使用默认配置')
@@ -89,7 +1637,19 @@ class CFIPCollector:
                 "max_workers_ipv4": 15,
                 "max_workers_ipv6": 10,
                 "retry_times": 2,
-                "retry_delay": 1
+                "retry_delay": 1,
+                "engine": "thread",
+                "adaptive_concurrency": False,
+                "adaptive_min_workers": 2,
+                "adaptive_max_workers": 64,
+                "adaptive_latency_target": 2.0,
+                "max_requests_per_second": 0,
+                "stream_fetch": False,
+                "stream_chunk_size": 64 * 1024,
+                "max_body_bytes": 50 * 1024 * 1024,
+                "pipeline_queue_size": 1000,
+                "extract_workers": 0,
+                "extract_min_bytes": 256 * 1024
             },
             "output_settings": {
                 "ipv4_filename": "ip.txt",
@@ -97,42 +1657,351 @@ class CFIPCollector:
                 "non_us_folder": "non_us_ips",
                 "port": 8443,
                 "save_all_ips": True,
-                "save_non_us_separately": True
+                "save_non_us_separately": True,
+                "report_filename": "run_report.json",
+                "write_delta": False,
+                "delta_suffix": ".delta"
             },
             "location_settings": {
                 "baidu_api_url": "https://opendata.baidu.com/api.php",
+                "providers": [
+                    {"type": "baidu"}
+                ],
+                "batch_size": 100,
+                "batch_flush_interval": 0.5,
+                "batch_fallback_single": True,
                 "us_keywords": ["美国", "United States", "US", "USA"],
-                "enable_location_query": True
+                "enable_location_query": True,
+                "api_test": "traffic",
+                "enable_prefix_aggregation": False,
+                "ipv4_prefix_length": 24,
+                "ipv6_prefix_length": 48,
+                "prefix_ranges_file": ""
             },
             "filter_settings": {
                 "enable_ip_validation": True,
                 "remove_private_ips": True,
                 "remove_duplicates": True
             },
+            "parser_settings": {
+                "enable_parsers": True,
+                "url_rules": [
+                    {"pattern": r"wetest\.vip/page/cloudflare/address_v[46]\.html", "parser": "html_table"},
+                    {"pattern": r"api\.uouin\.com/cloudflare\.html", "parser": "html_table"},
+                    {"pattern": r"ipTop10\.html$", "parser": "lines"},
+                    {"pattern": r"\.txt$", "parser": "lines"}
+                ],
+                "content_types": {
+                    "text/html": "html_table",
+                    "application/json": "json",
+                    "text/plain": "lines"
+                }
+            },
             "progress_settings": {
                 "show_progress": True,
                 "progress_interval": 10
+            },
+            "probe_settings": {
+                "enable_probe": False,
+                "port": 8443,
+                "samples": 3,
+                "timeout": 2,
+                "concurrency": 200,
+                "use_tls": False,
+                "tls_server_name": "",
+                "ranked_filename": "ip_ranked.txt",
+                "ranked_top_n": 0
+            },
+            "cache_settings": {
+                "cache_folder": ".cache",
+                "enable_geo_cache": True,
+                "geo_cache_file": "geo_cache.db",
+                "geo_cache_ttl": 7 * 24 * 3600,
+                "negative_cache_ttl": 6 * 3600,
+                "enable_source_state": True,
+                "source_state_file": "source_state.json",
+                "enable_history": True,
+                "history_file": "history.db",
+                "history_retention_days": 30
+            },
+            "source_settings": {
+                "enable_health": True,
+                "ewma_alpha": 0.3,
+                "adaptive_timeout": True,
+                "min_timeout": 3,
+                "timeout_multiplier": 3,
+                "failure_threshold": 3,
+                "breaker_base_delay": 1800,
+                "breaker_max_delay": 86400,
+                "skip_subset_sources": True,
+                "subset_recheck_interval": 86400
+            },
+            "daemon_settings": {
+                "interval": 300,
+                "source_intervals": {},
+                "status_host": "127.0.0.1",
+                "status_port": 8080,
+                "prune_interval": 24 * 3600
+            },
+            "api_settings": {
+                "host": "127.0.0.1",
+                "port": 8081
             }
         }
     
     def setup_global_variables(self):
         """设置全局变量"""
-        # IP地址正则表达式
-        self.ipv4_pattern = r'\b(25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)\.(25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)\.(25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)\.(25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)\b'
-        self.ipv6_pattern = r'(?:[A-Fa-f0-9]{1,4}:){7}[A-Fa-f0-9]{1,4}|(?:[A-Fa-f0-9]{1,4}:){1,7}:|(?:[A-Fa-f0-9]{1,4}:){1,6}:[A-Fa-f0-9]{1,4}'
-        
         # 请求头
         self.headers = {
             'User-Agent': self.config['request_settings']['user_agent'],
             'Accept': 'application/json',
+            'Accept-Encoding': 'gzip, deflate',
+            'Connection': 'keep-alive',
             'Referer': 'https://www.baidu.com/'
         }
+        # HTTP会话在第一次发请求时创建，requests 也在那时才导入
+        self._session = None
+        self.session_lock = threading.Lock()
+        # asyncio 引擎的事件循环和 aiohttp 会话，同样在第一次使用时创建
+        self.async_loop = None
+        self.async_session = None
         
         # 进度显示变量
         self.progress_lock = threading.Lock()
         self.completed_count = 0
         self.total_count = 0
         self.success_count = 0
+        self.ip_lock = threading.Lock()
+        self.limiter = None
+        
+        # 运行报告
+        self.run_report = RunReport()
+        
+        # 测速结果 {ip: {'min', 'median', 'loss'}}
+        self.latency_stats = {}
+        
+        # 常驻模式：本轮未到刷新时间的数据源，以及状态接口返回的信息
+        self.skip_sources = set()
+        self.daemon_status = {}
+        
+        # HTTP接口使用的结果快照 (内容哈希, [(ip, 地址族, 地理位置, 测速结果)])；
+        # 本进程还没有完成收集时从结果文件加载
+        self.results_snapshot = None
+        self.results_file_mtimes = None
+
+        # 地理位置缓存
+        self.geo_cache = None
+        cache_settings = self.config['cache_settings']
+        if cache_settings['enable_geo_cache'] and self.config['location_settings']['enable_location_query']:
+            try:
+                self.geo_cache = GeoCache(
+                    os.path.join(cache_settings['cache_folder'], cache_settings['geo_cache_file']),
+                    cache_settings['geo_cache_ttl'],
+                    cache_settings['negative_cache_ttl']
+                )
+            except sqlite3.Error as e:
+                print(f'❌ 打开地理位置缓存失败: {e}，将不使用缓存')
+                self.geo_cache = None
+
+        # 数据源条件请求状态
+        self.source_state = None
+        if cache_settings['enable_source_state']:
+            self.source_state = SourceStateStore(
+                os.path.join(cache_settings['cache_folder'], cache_settings['source_state_file'])
+            )
+
+        # IP历史记录，以及本轮每个数据源提取到的IP（用于记录IP来源）
+        self.history = None
+        self.source_ips = {}
+        # 数据源公布的延迟、数据中心、线路等指标 {IP: 元数据}
+        self.source_meta = {}
+        self.source_meta_lock = threading.Lock()
+        # 大数据源的IP提取进程池，第一次使用时创建
+        self.extract_pool = None
+        self.extract_pool_lock = threading.Lock()
+        if cache_settings['enable_history']:
+            try:
+                self.history = HistoryStore(self.history_path())
+            except sqlite3.Error as e:
+                print(f'❌ 打开IP历史记录失败: {e}，将不记录历史')
+                self.history = None
+        self.prune_stores()
+
+        # 地理位置查询后端，按配置顺序依次尝试
+        self.geo_providers = self.create_geo_providers()
+
+        # 网段聚合使用的自定义网段（如 busi.txt）
+        self.prefix_ranges = {4: PrefixIndex(), 6: PrefixIndex()}
+        ranges_file = self.config['location_settings']['prefix_ranges_file']
+        if self.config['location_settings']['enable_prefix_aggregation'] and ranges_file:
+            self.load_prefix_ranges(ranges_file)
+
+    def history_path(self):
+        cache_settings = self.config['cache_settings']
+        return os.path.join(cache_settings['cache_folder'], cache_settings['history_file'])
+
+    def create_geo_providers(self):
+        """根据 location_settings.providers 创建查询后端，创建失败的后端会被跳过"""
+        providers = []
+        for settings in self.config['location_settings']['providers']:
+            provider_class = GEO_PROVIDERS.get(settings.get('type'))
+            if provider_class is None:
+                print(f'❌ 未知的地理位置查询后端: {settings.get("type")}')
+                continue
+            try:
+                provider = provider_class(self, settings)
+            except Exception as e:
+                print(f'❌ 初始化地理位置查询后端 {provider_class.name} 失败: {e}')
+                continue
+            if settings.get('batch') and provider.supports_batch:
+                location_settings = self.config['location_settings']
+                provider.batcher = GeoBatcher(
+                    provider,
+                    settings.get('batch_size', location_settings['batch_size']),
+                    location_settings['batch_flush_interval'],
+                    location_settings['batch_fallback_single'],
+                    settings.get('max_concurrency') or 2,
+                    settings.get('max_concurrency') or self.config['request_settings']['max_workers_ipv4']
+                )
+            providers.append(provider)
+        if not providers:
+            print('⚠️  没有可用的地理位置查询后端，回退到百度接口')
+            providers.append(BaiduProvider(self, {}))
+        return providers
+
+    def get_location(self, ip, providers=None):
+        """按配置顺序依次查询各后端，返回第一个成功的结果 (location, success, throttled)"""
+        if not self.config['location_settings']['enable_location_query']:
+            return '未知', False, False
+        throttled = False
+        for provider in self.geo_providers if providers is None else providers:
+            if provider.batcher:
+                # 调用方会阻塞等待结果：提交后立即发出，把其他线程已提交的IP一并带上，
+                # 不等 flush_interval（多个IP的场景由 query_ips_batched 先全部提交再等待）
+                future = provider.batcher.submit(ip)
+                provider.batcher.flush()
+                location, success, provider_throttled = future.result()
+            else:
+                location, success, provider_throttled = provider.lookup(ip)
+            if success:
+                return location, True, throttled
+            throttled = throttled or provider_throttled
+        return '未知', False, throttled
+
+    def batch_provider_index(self):
+        """第一个在线后端支持批量查询时返回其下标，否则返回None"""
+        for index, provider in enumerate(self.geo_providers):
+            if not provider.is_local:
+                return index if provider.batcher else None
+        return None
+
+    def query_ips_batched(self, ips, batch_index, verbose=True):
+        """先用本地后端逐个查询，剩余地址交给批量后端；返回 (已解析结果, 仍未解析的IP)"""
+        batch_provider = self.geo_providers[batch_index]
+        resolved = []
+        futures = {}
+        for ip in ips:
+            for provider in self.geo_providers[:batch_index]:
+                location, success, _ = provider.lookup(ip)
+                if success:
+                    resolved.append((ip, location, True))
+                    self.update_progress(True)
+                    break
+            else:
+                futures[ip] = batch_provider.batcher.submit(ip)
+        batch_provider.batcher.flush()
+        
+        remaining = []
+        for ip, future in futures.items():
+            location, success, _ = future.result()
+            if success:
+                resolved.append((ip, location, True))
+                self.update_progress(True)
+            else:
+                remaining.append(ip)
+        if verbose:
+            print(f'📦 批量查询({batch_provider.name}): 成功 {len(resolved)}, 剩余 {len(remaining)}, '
+                  f'累计批次 {batch_provider.batcher.batches}, 单个回退 {batch_provider.batcher.fallbacks}')
+        return resolved, remaining
+
+    def load_prefix_ranges(self, filename):
+        """加载网段文件，每行一个CIDR；未写前缀长度时IPv4按/16、IPv6按/32处理"""
+        try:
+            with open(filename, 'r', encoding='utf-8') as f:
+                for line in f:
+                    entry = line.strip().strip('[]').replace(']/', '/')
+                    if not entry or entry.startswith('#'):
+                        continue
+                    try:
+                        if '/' not in entry:
+                            entry += '/32' if ':' in entry else '/16'
+                        network = ipaddress.ip_network(entry, strict=False)
+                    except ValueError:
+                        continue
+                    self.prefix_ranges[network.version].add(network, network)
+            print(f'✅ 已加载网段文件 {filename}: IPv4 {len(self.prefix_ranges[4])} 个, IPv6 {len(self.prefix_ranges[6])} 个')
+        except OSError as e:
+            print(f'❌ 加载网段文件 {filename} 失败: {e}')
+
+    def group_ips_by_prefix(self, ips, is_ipv6=False):
+        """按网段对IP分组，优先使用自定义网段，否则按配置的前缀长度分组"""
+        location_settings = self.config['location_settings']
+        prefix_length = location_settings['ipv6_prefix_length' if is_ipv6 else 'ipv4_prefix_length']
+        ranges = self.prefix_ranges[6 if is_ipv6 else 4]
+        if not ranges:
+            return IPSet(6 if is_ipv6 else 4, ips).group_by_prefix(prefix_length)
+
+        groups = {}
+        for ip in ips:
+            network = ranges.lookup(ip) if ranges else None
+            if network is None:
+                network = ipaddress.ip_network(f'{ip}/{prefix_length}', strict=False)
+            groups.setdefault(network, []).append(ip)
+        return groups
+
+    @property
+    def session(self):
+        if self._session is None:
+            with self.session_lock:
+                if self._session is None:
+                    self._session = self.create_session()
+        return self._session
+
+    def create_session(self):
+        """创建共享连接池的HTTP会话，连接池大小与最大并发线程数一致"""
+        request_settings = self.config['request_settings']
+        pool_size = max(
+            request_settings['max_workers_url'],
+            request_settings['max_workers_ipv4'],
+            request_settings['max_workers_ipv6']
+        )
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        session.headers.update(self.headers)
+        return session
+
+    def backoff_delay(self, attempt):
+        """计算第 attempt 次重试前的等待时间：指数退避加随机抖动"""
+        retry_delay = self.config['request_settings']['retry_delay']
+        return retry_delay * (2 ** attempt) + random.uniform(0, retry_delay)
+
+    def request_with_retry(self, url, method='GET', **kwargs):
+        """发送HTTP请求，网络异常或限流/服务端错误时按 retry_times 重试"""
+        retry_times = self.config['request_settings']['retry_times']
+        kwargs.setdefault('timeout', self.config['request_settings']['timeout'])
+        for attempt in range(retry_times + 1):
+            try:
+                response = self.session.request(method, url, **kwargs)
+                if response.status_code not in RETRY_STATUS_CODES or attempt == retry_times:
+                    return response
+                # 释放连接后再重试，stream=True 时未读完的响应不会自动归还连接池
+                response.close()
+            except requests.exceptions.RequestException:
+                if attempt == retry_times:
+                    raise
+            time.sleep(self.backoff_delay(attempt))
 
     def ensure_folders(self):
         """确保必要的文件夹存在"""
@@ -142,109 +2011,514 @@ class CFIPCollector:
             print(f'📁 创建文件夹: {non_us_folder}')
 
     def clean_old_files(self):
-        """清理旧文件"""
+        """清理上次运行中断后遗留的临时文件；结果文件本身保留，写入时原子替换"""
         output_settings = self.config['output_settings']
         for filename in [output_settings['ipv4_filename'], output_settings['ipv6_filename']]:
-            if os.path.exists(filename):
-                os.remove(filename)
-                print(f'🗑️  已删除旧文件: {filename}')
+            folder = os.path.dirname(os.path.abspath(filename))
+            name = os.path.basename(filename)
+            for leftover in os.listdir(folder):
+                if leftover == name + '.partial' or (leftover.startswith(name + '.') and leftover.endswith('.tmp')):
+                    os.remove(os.path.join(folder, leftover))
+                    print(f'🗑️  已删除遗留的临时文件: {leftover}')
+
+    def read_payload_lines(self, filename):
+        """读取结果文件中除注释和空行以外的内容，文件不存在时返回None"""
+        if not os.path.exists(filename):
+            return None
+        with open(filename, 'r', encoding='utf-8') as f:
+            return [line.rstrip('\n') for line in f if line.strip() and not line.startswith('#')]
+
+    def write_delta(self, filename, previous, current):
+        """写入与上次结果相比新增(+)和删除(-)的行，供下游增量更新"""
+        previous_set, current_set = set(previous or []), set(current)
+        removed = [line for line in previous or [] if line not in current_set]
+        added = [line for line in current if line not in previous_set]
+        delta_filename = filename + self.config['output_settings']['delta_suffix']
+        with atomic_open(delta_filename) as file:
+            file.write(f"# 结果变化: {filename}\n")
+            file.write(f"# 生成时间(北京时间): {self.get_beijing_time().strftime('%Y-%m-%d %H:%M:%S')}\n")
+            file.write(f"# 新增: {len(added)}, 删除: {len(removed)}\n\n")
+            for line in removed:
+                file.write(f"-{line}\n")
+            for line in added:
+                file.write(f"+{line}\n")
+        print(f'🔀 变化: 新增 {len(added)}, 删除 {len(removed)}, 已写入 {delta_filename}')
 
     def fetch_url(self, url):
         """获取URL内容"""
         try:
-            response = requests.get(
-                url, 
-                headers=self.headers, 
-                timeout=self.config['request_settings']['timeout']
-            )
+            response = self.request_with_retry(url)
             response.raise_for_status()
             return response.text
         except requests.exceptions.RequestException as e:
             print(f'❌ 请求 {url} 失败: {e}')
             return None
 
+    def conditional_headers(self, url):
+        """根据上次记录的ETag/Last-Modified生成条件请求头"""
+        if not self.source_state:
+            return {}
+        state = self.source_state.get(url)
+        if 'ipv4' not in state:
+            return {}
+        headers = {}
+        if state.get('etag'):
+            headers['If-None-Match'] = state['etag']
+        if state.get('last_modified'):
+            headers['If-Modified-Since'] = state['last_modified']
+        return headers
+
+    def health_enabled(self):
+        return bool(self.source_state) and self.config['source_settings']['enable_health']
+
+    def source_health(self, url):
+        return dict(self.source_state.get(url).get('health', {})) if self.health_enabled() else {}
+
+    def ewma(self, previous, value):
+        alpha = self.config['source_settings']['ewma_alpha']
+        return value if previous is None else previous + alpha * (value - previous)
+
+    def source_priority(self, url):
+        """排序键：没有历史记录的新数据源最先，其次按 成功率×独有IP数 从高到低，再按延迟从低到高"""
+        health = self.source_health(url)
+        if not health.get('runs'):
+            return (0, 0, 0)
+        return (1, -health.get('success_ewma', 1) * health.get('yield_ewma', 0), health.get('latency_ewma') or 0)
+
+    def source_timeout(self, url):
+        """按历史延迟计算单个数据源的超时时间，不超过全局 timeout"""
+        settings = self.config['source_settings']
+        timeout = self.config['request_settings']['timeout']
+        latency = self.source_health(url).get('latency_ewma')
+        if not settings['adaptive_timeout'] or latency is None:
+            return timeout
+        return min(timeout, max(settings['min_timeout'], latency * settings['timeout_multiplier']))
+
+    def plan_sources(self):
+        """返回本轮要获取的数据源（按优先级排序），跳过熔断中和输出被其他数据源完全包含的数据源"""
+        if not self.health_enabled():
+            return list(self.urls)
+        settings = self.config['source_settings']
+        now = time.time()
+        open_urls = {url for url in self.urls if self.source_health(url).get('open_until', 0) > now}
+        planned = []
+        for url in self.urls:
+            health = self.source_health(url)
+            if url in open_urls:
+                print(f'🔌 熔断中，跳过: {url} (连续失败 {health["consecutive_failures"]} 次, '
+                      f'{health["open_until"] - now:.0f} 秒后重试)')
+                self.run_report.record_source(url, status='skipped', reason='circuit_open')
+                continue
+            superset = health.get('subset_of')
+            if (settings['skip_subset_sources'] and superset in self.urls and superset not in open_urls
+                    and health.get('subset_until', 0) > now):
+                print(f'⏭️  输出被 {superset} 完全包含，跳过: {url}')
+                self.run_report.record_source(url, status='skipped', reason='subset', subset_of=superset)
+                continue
+            planned.append(url)
+        planned.sort(key=self.source_priority)
+        return planned
+
+    def record_source_health(self, url, success, elapsed=None, timed_out=False):
+        """记录一次获取结果，更新成功率/延迟EWMA；连续失败达到阈值后按指数退避熔断
+        
+        elapsed 只应传入真正下载了正文的耗时（304 响应很快，会把超时压到 min_timeout）；
+        超时失败时把该数据源的超时时间翻倍（不超过全局 timeout），避免慢数据源被持续截断。
+        """
+        if not self.health_enabled():
+            return
+        settings = self.config['source_settings']
+        health = self.source_health(url)
+        health['runs'] = health.get('runs', 0) + 1
+        health['success_ewma'] = self.ewma(health.get('success_ewma'), 1.0 if success else 0.0)
+        if success:
+            if elapsed is not None:
+                health['latency_ewma'] = self.ewma(health.get('latency_ewma'), elapsed)
+            health['consecutive_failures'] = 0
+            health['open_until'] = 0
+        else:
+            if timed_out and health.get('latency_ewma') is not None:
+                timeout = min(self.config['request_settings']['timeout'], self.source_timeout(url) * 2)
+                health['latency_ewma'] = timeout / settings['timeout_multiplier']
+            failures = health.get('consecutive_failures', 0) + 1
+            health['consecutive_failures'] = failures
+            if failures >= settings['failure_threshold']:
+                delay = min(settings['breaker_max_delay'],
+                            settings['breaker_base_delay'] * 2 ** (failures - settings['failure_threshold']))
+                health['open_until'] = time.time() + delay
+                print(f'🔌 {url} 连续失败 {failures} 次，{delay:.0f} 秒内不再请求')
+        self.source_state.update(url, health=health)
+
+    def update_source_yield(self):
+        """根据本轮各数据源提取到的IP更新独有IP数EWMA和重叠率，并找出输出被其他数据源完全包含的数据源"""
+        if not self.health_enabled():
+            return
+        settings = self.config['source_settings']
+        ip_sets = {url: set(ipv4) | set(ipv6) for url, (ipv4, ipv6) in self.source_ips.items()}
+        counts = {}
+        for ips in ip_sets.values():
+            for ip in ips:
+                counts[ip] = counts.get(ip, 0) + 1
+        now = time.time()
+        for url, ips in ip_sets.items():
+            health = self.source_health(url)
+            unique = sum(1 for ip in ips if counts[ip] == 1)
+            health['ip_count'] = len(ips)
+            health['yield_ewma'] = self.ewma(health.get('yield_ewma'), unique)
+            health['overlap'] = round(1 - unique / len(ips), 4) if ips else 0
+            superset = next((other for other, other_ips in ip_sets.items() if ips and ips < other_ips), None)
+            health['subset_of'] = superset
+            health['subset_until'] = now + settings['subset_recheck_interval'] if superset else 0
+            self.source_state.update(url, health=health)
+            self.run_report.record_source(url, unique_ips=unique, overlap=health['overlap'])
+        self.source_state.save()
+
+    def scheduled_result(self, url):
+        """常驻模式下未到刷新时间的数据源不发请求，按未修改处理以复用上次提取的IP"""
+        if url not in self.skip_sources or 'ipv4' not in self.source_state.get(url):
+            return None
+        return {'not_modified': True, 'scheduled': True, 'size': 0, 'elapsed': 0.0}
+
+    def fetch_source(self, url, on_ips=None):
+        """获取数据源，发送条件请求；返回包含内容和缓存校验信息的字典，失败返回None
+        
+        启用 stream_fetch 时分块读取并边读边提取IP，返回结果中不保留正文，
+        提取到的IP会即时通过 on_ips(ipv4, ipv6) 回调交给调用方。
+        """
+        scheduled = self.scheduled_result(url)
+        if scheduled:
+            return scheduled
+        request_settings = self.config['request_settings']
+        stream = request_settings['stream_fetch']
+        start = time.perf_counter()
+        try:
+            response = self.request_with_retry(
+                url, headers=self.conditional_headers(url), stream=stream, timeout=self.source_timeout(url)
+            )
+            if response.status_code == 304:
+                response.close()
+                return {'not_modified': True, 'size': 0, 'elapsed': time.perf_counter() - start}
+            response.raise_for_status()
+            fetched = {
+                'not_modified': False,
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+                'content_type': response.headers.get('Content-Type')
+            }
+            if not stream:
+                content = response.content
+                fetched.update(
+                    size=len(content),
+                    content_hash=hashlib.sha256(content).hexdigest(),
+                    elapsed=time.perf_counter() - start
+                )
+                if self.use_extract_pool(url, fetched, content):
+                    # 在获取线程中等待子进程结果，等待期间不占用GIL
+                    extract_start = time.perf_counter()
+                    packed = self.submit_extract(content, response.encoding).result()
+                    return self.process_extracted(fetched, packed, extract_start)
+                fetched['text'] = response.text
+                return fetched
+            
+            extractor = StreamingExtractor(
+                self.extract_ips_from_text, response.encoding, request_settings['max_body_bytes'], on_ips,
+                self.select_parser(url, fetched['content_type'])
+            )
+            with response:
+                for chunk in response.iter_content(chunk_size=request_settings['stream_chunk_size']):
+                    if not extractor.feed(chunk):
+                        print(f'⚠️  {url} 超过大小上限 {request_settings["max_body_bytes"]} 字节，已截断')
+                        break
+            fetched.update(
+                text=None,
+                size=extractor.size,
+                content_hash=extractor.close(),
+                ipv4=extractor.ipv4,
+                ipv6=extractor.ipv6,
+                meta=self.collect_parsed_rows(extractor.parser.close())[2] if extractor.parser else {},
+                parser=extractor.parser.name if extractor.parser else None,
+                elapsed=time.perf_counter() - start
+            )
+            return fetched
+        except requests.exceptions.RequestException as e:
+            print(f'❌ 请求 {url} 失败: {e}')
+            self.run_report.record_source(
+                url, status='failed', fetch_ms=round((time.perf_counter() - start) * 1000, 1), error=str(e)
+            )
+            # 流式读取正文时的读超时会被 requests 包装成 ConnectionError
+            timed_out = isinstance(e, requests.exceptions.Timeout) or (
+                isinstance(e, requests.exceptions.ConnectionError) and 'timed out' in str(e)
+            )
+            self.record_source_health(url, False, timed_out=timed_out)
+            return None
+
+    def use_extract_pool(self, url, fetched, content):
+        """是否把正文交给进程池提取：启用了进程池、正文足够大、使用正则扫描且内容有变化"""
+        request_settings = self.config['request_settings']
+        if not request_settings['extract_workers'] or len(content) < request_settings['extract_min_bytes']:
+            return False
+        if not self.config['filter_settings']['enable_ip_validation']:
+            return False
+        if self.select_parser(url, fetched['content_type']):
+            return False
+        state = self.source_state.get(url) if self.source_state else {}
+        return not (state.get('content_hash') == fetched['content_hash'] and 'ipv4' in state)
+
+    def submit_extract(self, content, encoding):
+        """把正文提交到提取进程池，返回 Future（结果为 extract_packed_ips 的打包数组）
+        
+        正文放入共享内存，子进程直接读取，避免再序列化一份大正文；共享内存不可用时直接传 bytes。
+        """
+        with self.extract_pool_lock:
+            if self.extract_pool is None:
+                workers = self.config['request_settings']['extract_workers']
+                # 主进程中有正在运行的线程，用 spawn 避免 fork 继承到被占用的锁
+                self.extract_pool = ProcessPoolExecutor(
+                    max_workers=workers, mp_context=multiprocessing.get_context('spawn')
+                )
+                print(f'🧮 启用 {workers} 个进程提取大数据源')
+        remove_private = self.config['filter_settings']['remove_private_ips']
+        try:
+            codecs.lookup(encoding or 'utf-8')
+        except LookupError:
+            encoding = None
+        block = None
+        if shared_memory is not None:
+            try:
+                block = shared_memory.SharedMemory(create=True, size=len(content))
+                block.buf[:len(content)] = content
+            except OSError:
+                block = None
+        if block is None:
+            return self.extract_pool.submit(extract_packed_ips, content, len(content), encoding, remove_private)
+        future = self.extract_pool.submit(extract_packed_ips, block.name, len(content), encoding, remove_private)
+        
+        def release(_):
+            block.close()
+            block.unlink()
+        
+        future.add_done_callback(release)
+        return future
+
+    def process_extracted(self, fetched, packed, start):
+        """把进程池的提取结果放入获取结果，extract_source_ips 直接使用"""
+        ipv4, ipv6 = unpack_ips(packed)
+        fetched.update(
+            text=None, ipv4=ipv4, ipv6=ipv6, meta={}, parser='regex', extract_mode='process',
+            parse_ms=round((time.perf_counter() - start) * 1000, 2)
+        )
+        return fetched
+
+    def select_parser(self, url, content_type=None):
+        """按 URL 规则、其次按 Content-Type 选择解析器，都不匹配时返回None（使用正则扫描）"""
+        settings = self.config['parser_settings']
+        if not settings['enable_parsers']:
+            return None
+        for rule in settings['url_rules']:
+            if re.search(rule['pattern'], url):
+                name = rule['parser']
+                break
+        else:
+            name = settings['content_types'].get((content_type or '').split(';')[0].strip().lower())
+        parser_class = SOURCE_PARSERS.get(name)
+        if parser_class is None:
+            if name:
+                print(f'❌ 未知的数据源解析器: {name}')
+            return None
+        return parser_class()
+
+    def collect_parsed_rows(self, rows):
+        """解析器产出的 [(IP候选文本, 元数据)] 转换为 (IPv4集合, IPv6集合, {IP: 元数据})，过滤规则与正则扫描一致"""
+        valid_ipv4, valid_ipv6, meta = set(), set(), {}
+        for candidate, fields in rows:
+            ipv4, ipv6 = self.extract_ips_from_text(candidate)
+            valid_ipv4.update(ipv4)
+            valid_ipv6.update(ipv6)
+            if fields:
+                for ip in ipv4 | ipv6:
+                    meta.setdefault(ip, fields)
+        return valid_ipv4, valid_ipv6, meta
+
+    def parse_source_text(self, url, text, content_type=None):
+        """解析数据源正文，返回 (IPv4集合, IPv6集合, {IP: 元数据}, 解析器名称)
+        
+        IP 总是由正则扫描整段正文得到，解析器只用来附加元数据，
+        解析器没识别出的行（表格外的地址、格式不同的行）不会丢失。
+        """
+        ipv4, ipv6 = self.extract_ips_from_text(text)
+        parser = self.select_parser(url, content_type)
+        if parser:
+            parser.feed(text)
+            rows = parser.close()
+            if rows:
+                parsed_ipv4, parsed_ipv6, meta = self.collect_parsed_rows(rows)
+                return ipv4 | parsed_ipv4, ipv6 | parsed_ipv6, meta, parser.name
+        return ipv4, ipv6, {}, 'regex'
+
+    def extract_source_ips(self, url, fetched):
+        """从获取结果中提取IP；未修改（304）或内容哈希不变时直接复用上次提取的结果"""
+        state = self.source_state.get(url) if self.source_state else {}
+        report = {'fetch_ms': round(fetched['elapsed'] * 1000, 1), 'bytes': fetched['size']}
+        if not fetched.get('scheduled'):
+            self.record_source_health(url, True, None if fetched['not_modified'] else fetched['elapsed'])
+        if fetched['not_modified'] and 'ipv4' in state:
+            if fetched.get('scheduled'):
+                print(f'⏭️  未到刷新时间，复用上次结果: {url}')
+            else:
+                print(f'♻️  未修改(304)，复用上次结果: {url}')
+            ipv4, ipv6 = set(state['ipv4']), set(state['ipv6'])
+            self.run_report.record_source(
+                url, status='scheduled' if fetched.get('scheduled') else 'not_modified',
+                parse_ms=0, ipv4=len(ipv4), ipv6=len(ipv6), **report
+            )
+            self.source_ips[url] = (ipv4, ipv6)
+            self.add_source_meta(state.get('meta', {}))
+            return ipv4, ipv6
+        
+        content_hash = fetched['content_hash']
+        parse_start = time.perf_counter()
+        status = 'ok'
+        parser = None
+        if 'ipv4' in fetched:
+            ipv4, ipv6, meta, parser = fetched['ipv4'], fetched['ipv6'], fetched['meta'], fetched['parser']
+            status = fetched.get('extract_mode', 'streamed')
+        elif state.get('content_hash') == content_hash and 'ipv4' in state:
+            print(f'♻️  内容未变化，复用上次结果: {url}')
+            ipv4, ipv6, meta = set(state['ipv4']), set(state['ipv6']), state.get('meta', {})
+            status = 'unchanged'
+        else:
+            ipv4, ipv6, meta, parser = self.parse_source_text(url, fetched['text'], fetched['content_type'])
+        self.run_report.record_source(
+            url, status=status, parse_ms=fetched.get('parse_ms', round((time.perf_counter() - parse_start) * 1000, 2)),
+            ipv4=len(ipv4), ipv6=len(ipv6), parser=parser, meta=len(meta), **report
+        )
+        
+        if self.source_state:
+            self.source_state.update(
+                url,
+                etag=fetched['etag'],
+                last_modified=fetched['last_modified'],
+                content_hash=content_hash,
+                ipv4=sorted(ipv4),
+                ipv6=sorted(ipv6),
+                meta=meta
+            )
+        self.source_ips[url] = (ipv4, ipv6)
+        self.add_source_meta(meta)
+        return ipv4, ipv6
+
+    def add_source_meta(self, meta):
+        """合并数据源公布的指标；同一IP出现在多个数据源时保留延迟最低的一条"""
+        with self.source_meta_lock:
+            for ip, fields in meta.items():
+                current = self.source_meta.get(ip)
+                if current is None or fields.get('latency', float('inf')) < current.get('latency', float('inf')):
+                    self.source_meta[ip] = fields
+
     def extract_ips_from_text(self, text):
-        """从文本中提取IP地址"""
-        ipv4_matches = re.findall(self.ipv4_pattern, text)
-        ipv6_matches = re.findall(self.ipv6_pattern, text)
+        """从文本中提取IP地址（单次扫描，整数区间表过滤私有地址）"""
+        filter_settings = self.config['filter_settings']
+        validate = filter_settings['enable_ip_validation']
+        remove_private = validate and filter_settings['remove_private_ips']
         
         valid_ipv4 = set()
         valid_ipv6 = set()
         
-        # 验证IPv4地址
-        for ip in ipv4_matches:
-            try:
-                if isinstance(ip, tuple):
-                    ip_str = '.'.join(ip)
-                else:
-                    ip_str = ip
-                
-                if not self.config['filter_settings']['enable_ip_validation']:
+        for version, ip_str, value in iter_ip_tokens(text):
+            if version == 4:
+                if not validate:
                     valid_ipv4.add(ip_str)
                     continue
-                    
-                ip_obj = ipaddress.IPv4Address(ip_str)
-                
+                if value is None:
+                    continue
                 # 过滤私有IP
-                if self.config['filter_settings']['remove_private_ips'] and ip_obj.is_private:
+                if remove_private and is_private_value(4, value):
                     continue
-                    
                 valid_ipv4.add(ip_str)
-            except (ValueError, ipaddress.AddressValueError):
-                continue
-        
-        # 验证IPv6地址
-        for ip in ipv6_matches:
-            try:
-                if not self.config['filter_settings']['enable_ip_validation']:
-                    valid_ipv6.add(ip.lower())
+            else:
+                if not validate:
+                    valid_ipv6.add(ip_str.lower())
+                    continue
+                try:
+                    ip_obj = ipaddress.IPv6Address(ip_str)
+                except ValueError:
                     continue
-                    
-                ip_obj = ipaddress.IPv6Address(ip)
-                
                 # 过滤私有IP
-                if self.config['filter_settings']['remove_private_ips'] and ip_obj.is_private:
+                if remove_private and is_private_value(6, int(ip_obj)):
                     continue
-                    
-                valid_ipv6.add(ip_obj.compressed.lower())
-            except (ValueError, ipaddress.AddressValueError):
-                continue
+                if ip_obj.ipv4_mapped:
+                    # IPv4映射地址（::ffff:a.b.c.d）按其IPv4地址收集
+                    valid_ipv4.add(str(ip_obj.ipv4_mapped))
+                    continue
+                valid_ipv6.add(ip_obj.compressed)
         
         return valid_ipv4, valid_ipv6
 
     def get_location_from_baidu(self, ip):
         """从百度API获取IP的地理位置信息"""
+        location, success, throttled = self.query_baidu(ip)
+        return location, success
+
+    def query_baidu(self, ip):
+        """查询百度API，额外返回是否出现限流信号（429/5xx、超时或 status 非 '0'）"""
         if not self.config['location_settings']['enable_location_query']:
-            return '未知', False
+            return '未知', False, False
             
         try:
-            api_url = self.config['location_settings']['baidu_api_url']
-            url = f'{api_url}?co=&resource_id=6006&oe=utf8&query={ip}&lang=en'
-            resp = requests.get(
-                url, 
-                headers=self.headers, 
-                timeout=self.config['request_settings']['timeout']
-            )
+            resp = self.request_with_retry(self.build_baidu_url(ip))
             
             if resp.status_code == 200:
                 try:
                     data = resp.json()
-                    status = data.get('status')
-                    if status == '0':
-                        if data.get('data') and len(data['data']) > 0:
-                            location = data['data'][0].get('location', '未知')
-                            if location and location != '未知':
-                                return location, True
+                    if not isinstance(data, dict):
+                        return '未知', False, False
+                    location, success = self.parse_baidu_response(data)
+                    return location, success, data.get('status') != '0'
                 except json.JSONDecodeError:
                     pass
-            return '未知', False
+            return '未知', False, resp.status_code in RETRY_STATUS_CODES
+        except requests.exceptions.Timeout:
+            return '未知', False, True
         except Exception as e:
+            return '未知', False, False
+
+    def build_baidu_url(self, ip):
+        """生成百度地理位置查询URL"""
+        api_url = self.config['location_settings']['baidu_api_url']
+        return f'{api_url}?co=&resource_id=6006&oe=utf8&query={ip}&lang=en'
+
+    def parse_baidu_response(self, data):
+        """解析百度API返回的JSON数据"""
+        if not isinstance(data, dict):
             return '未知', False
+        status = data.get('status')
+        if status == '0':
+            if isinstance(data.get('data'), list) and data['data'] and isinstance(data['data'][0], dict):
+                location = data['data'][0].get('location', '未知')
+                if location and location != '未知':
+                    return location, True
+        return '未知', False
 
-    def process_single_ip(self, ip):
+    def process_single_ip(self, ip, providers=None):
         """处理单个IP地址查询"""
-        location, success = self.get_location_from_baidu(ip)
-        
+        limiter = self.limiter
+        if limiter:
+            limiter.acquire()
+        start = time.perf_counter()
+        throttled = False
+        try:
+            location, success, throttled = self.get_location(ip, providers)
+        finally:
+            latency = time.perf_counter() - start
+            if limiter:
+                limiter.release(throttled, latency)
+        self.run_report.record_geo_latency(latency)
+        self.update_progress(success)
+        return ip, location, success
+
+    def update_progress(self, success):
+        """更新并打印地理位置查询进度"""
+        self.run_report.record_geo_lookup(success)
         if self.config['progress_settings']['show_progress']:
             with self.progress_lock:
                 self.completed_count += 1
@@ -254,75 +2528,152 @@ class CFIPCollector:
                 progress_interval = self.config['progress_settings']['progress_interval']
                 if self.completed_count % progress_interval == 0 or self.completed_count == self.total_count:
                     success_rate = (self.success_count / self.completed_count * 100) if self.completed_count > 0 else 0
-                    print(f'📊 进度: {self.completed_count}/{self.total_count} (成功率: {success_rate:.1f}%)')
-        
-        return ip, location, success
+                    rate_info = ''
+                    if self.limiter:
+                        rate_info = f', 并发上限: {int(self.limiter.limit)}, 速率: {self.limiter.current_rate():.1f}次/秒'
+                    print(f'📊 进度: {self.completed_count}/{self.total_count} (成功率: {success_rate:.1f}%{rate_info})')
 
     def process_urls_parallel(self):
         """并行处理URL获取"""
-        all_ipv4 = set()
-        all_ipv6 = set()
+        all_ipv4 = IPSet(4)
+        all_ipv6 = IPSet(6)
         
         max_workers = self.config['request_settings']['max_workers_url']
         
-        print(f'🚀 开始并行从 {len(self.urls)} 个数据源获取IP地址...')
+        urls = self.plan_sources()
+        print(f'🚀 开始并行从 {len(urls)} 个数据源获取IP地址...')
+        
+        def merge_ips(ipv4, ipv6):
+            with self.ip_lock:
+                all_ipv4.update(ipv4)
+                all_ipv6.update(ipv6)
         
         with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            future_to_url = {executor.submit(self.fetch_url, url): url for url in self.urls}
+            future_to_url = {executor.submit(self.fetch_source, url, merge_ips): url for url in urls}
             
             for future in as_completed(future_to_url):
                 url = future_to_url[future]
                 try:
-                    text = future.result()
-                    if text:
-                        ipv4, ipv6 = self.extract_ips_from_text(text)
-                        all_ipv4.update(ipv4)
-                        all_ipv6.update(ipv6)
+                    fetched = future.result()
+                    if fetched and (fetched['not_modified'] or fetched['size']):
+                        ipv4, ipv6 = self.extract_source_ips(url, fetched)
+                        merge_ips(ipv4, ipv6)
                         print(f'✅ 成功处理: {url} (IPv4: {len(ipv4)}, IPv6: {len(ipv6)})')
                     else:
                         print(f'❌ 获取内容为空: {url}')
                 except Exception as e:
                     print(f'❌ 处理 {url} 时出错: {e}')
         
-        # 去重处理
+        if self.source_state:
+            self.source_state.save()
+        
+        # 去重处理（IPSet 合并时已按整数值去重）
         if self.config['filter_settings']['remove_duplicates']:
-            original_ipv4_count = len(all_ipv4)
-            original_ipv6_count = len(all_ipv6)
-            all_ipv4 = set(all_ipv4)
-            all_ipv6 = set(all_ipv6)
-            print(f'🔄 去重后: IPv4 {original_ipv4_count} → {len(all_ipv4)}, IPv6 {original_ipv6_count} → {len(all_ipv6)}')
+            print(f'🔄 去重后: IPv4 {len(all_ipv4)}, IPv6 {len(all_ipv6)}')
         
         return all_ipv4, all_ipv6
 
+    def create_limiter(self, max_workers):
+        """按配置创建自适应并发限制器，返回线程池应使用的线程数"""
+        request_settings = self.config['request_settings']
+        if not request_settings['adaptive_concurrency']:
+            print(f'⚡ 使用 {max_workers} 个线程同时查询')
+            return max_workers
+        # 线程池按上限创建，实际并发由 AdaptiveLimiter 动态控制
+        self.limiter = AdaptiveLimiter(
+            max_workers,
+            request_settings['adaptive_min_workers'],
+            request_settings['adaptive_max_workers'],
+            request_settings['adaptive_latency_target'],
+            request_settings['max_requests_per_second']
+        )
+        max_workers = request_settings['adaptive_max_workers']
+        print(f'⚡ 自适应并发: 初始 {int(self.limiter.limit)}, 范围 {request_settings["adaptive_min_workers"]}-{max_workers}'
+              f', 限速 {request_settings["max_requests_per_second"] or "不限"} 次/秒')
+        return max_workers
+
     def query_ips_parallel(self, ip_set, is_ipv6=False):
         """并行查询IP地址的地理位置"""
-        # 重置计数器
-        self.completed_count = 0
-        self.total_count = len(ip_set)
-        self.success_count = 0
-        
         if not ip_set:
             return []
         
+        ip_set = list(ip_set)
         worker_type = "IPv6" if is_ipv6 else "IPv4"
+        results = []
+        
+        # 先从缓存中取结果，只对未命中或已过期的IP发起网络查询
+        pending_ips = ip_set
+        if self.geo_cache:
+            cached = self.geo_cache.get_many(ip_set)
+            results.extend((ip, location) for ip, (location, success) in cached.items())
+            pending_ips = [ip for ip in ip_set if ip not in cached]
+            print(f'💽 {worker_type}缓存命中: {len(cached)}, 需要查询: {len(pending_ips)}')
+            if not pending_ips:
+                return results
+        
+        # 网段聚合：每个网段只查询一个代表IP，结果通过区间索引分发给同网段的其他IP
+        representatives = None
+        query_ips = pending_ips
+        if self.config['location_settings']['enable_prefix_aggregation']:
+            groups = self.group_ips_by_prefix(pending_ips, is_ipv6)
+            representatives = {
+                network: min(members, key=lambda ip: int(ipaddress.ip_address(ip)))
+                for network, members in groups.items()
+            }
+            query_ips = list(representatives.values())
+            print(f'🧩 网段聚合: {len(pending_ips)} 个地址归入 {len(groups)} 个网段')
+        
+        # 重置计数器
+        self.completed_count = 0
+        self.total_count = len(query_ips)
+        self.success_count = 0
+        
         max_workers = self.config['request_settings'][f'max_workers_{"ipv6" if is_ipv6 else "ipv4"}']
         
         print(f'🌍 开始并行查询 {self.total_count} 个{worker_type}地址的地理位置...')
-        print(f'⚡ 使用 {max_workers} 个线程同时查询')
+        max_workers = self.create_limiter(max_workers)
         
-        results = []
+        queried = []
+        per_ip_providers = None
+        
+        # 第一个在线后端支持批量接口时，先批量查询，失败的地址再交给后面的后端逐个查询
+        batch_index = self.batch_provider_index()
+        if batch_index is not None and self.config['location_settings']['enable_location_query']:
+            queried, query_ips = self.query_ips_batched(query_ips, batch_index)
+            per_ip_providers = self.geo_providers[batch_index + 1:]
+            if not per_ip_providers:
+                for ip in query_ips:
+                    queried.append((ip, '未知', False))
+                    self.update_progress(False)
+                query_ips = []
         
         with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            future_to_ip = {executor.submit(self.process_single_ip, ip): ip for ip in ip_set}
+            future_to_ip = {executor.submit(self.process_single_ip, ip, per_ip_providers): ip for ip in query_ips}
             
             for future in as_completed(future_to_ip):
                 try:
                     ip, location, success = future.result()
-                    results.append((ip, location))
+                    queried.append((ip, location, success))
                 except Exception as e:
                     ip = future_to_ip[future]
                     print(f"❌ 处理IP {ip} 时发生异常: {e}")
-                    results.append((ip, '未知'))
+                    queried.append((ip, '未知', False))
+        
+        if self.limiter:
+            print(f'⚡ 自适应并发结束时上限: {int(self.limiter.limit)}')
+            self.limiter = None
+        
+        if representatives is not None:
+            answers = {ip: (location, success) for ip, location, success in queried}
+            index = PrefixIndex()
+            for network, representative in representatives.items():
+                index.add(network, answers[representative])
+            queried = [(ip, *index.lookup(ip, ('未知', False))) for ip in pending_ips]
+        
+        results.extend((ip, location) for ip, location, success in queried)
+        
+        if self.geo_cache:
+            self.geo_cache.set_many(queried)
         
         # 最终进度显示
         if self.config['progress_settings']['show_progress']:
@@ -331,6 +2682,552 @@ class CFIPCollector:
         
         return results
 
+    def partial_filenames(self):
+        """流水线模式下增量写入的临时结果文件"""
+        output_settings = self.config['output_settings']
+        return {
+            4: output_settings['ipv4_filename'] + '.partial',
+            6: output_settings['ipv6_filename'] + '.partial'
+        }
+
+    def collect_pipelined(self):
+        """线程流水线：每个数据源完成后立即把从未出现过的IP放入有界队列，
+        IPv4/IPv6 查询线程同时消费，结果由写入线程增量追加到 .partial 文件"""
+        request_settings = self.config['request_settings']
+        location_settings = self.config['location_settings']
+        query_enabled = location_settings['enable_location_query']
+        aggregate = query_enabled and location_settings['enable_prefix_aggregation']
+        port = self.config['output_settings']['port']
+        
+        all_ips = {4: IPSet(4), 6: IPSet(6)}
+        lookups = {4: {}, 6: {}}
+        prefix_futures = {}
+        queues = {version: queue.Queue(maxsize=request_settings['pipeline_queue_size']) for version in (4, 6)}
+        write_queue = queue.Queue()
+        
+        self.completed_count = 0
+        self.total_count = 0
+        self.success_count = 0
+        
+        def write_partial():
+            files = {
+                version: open(filename, 'w', encoding='utf-8')
+                for version, filename in self.partial_filenames().items()
+            }
+            try:
+                while True:
+                    item = write_queue.get()
+                    if item is None:
+                        break
+                    version, ip, location = item
+                    if version == 6:
+                        files[6].write(f"[{ip}]:{port}#{location}-IPV6\n")
+                    else:
+                        files[4].write(f"{ip}:{port}#{location}\n")
+                    if write_queue.empty():
+                        for file in files.values():
+                            file.flush()
+            finally:
+                for file in files.values():
+                    file.close()
+        
+        # 第一个在线后端支持批量接口时，查询线程每次取出队列中已有的一批IP一起提交
+        batch_index = self.batch_provider_index() if query_enabled else None
+        
+        def resolve_batch(items):
+            futures = dict(items)
+            resolved, remaining = self.query_ips_batched(list(futures), batch_index, verbose=False)
+            for ip, location, success in resolved:
+                futures[ip].set_result((location, success))
+            per_ip_providers = self.geo_providers[batch_index + 1:]
+            for ip in remaining:
+                if per_ip_providers:
+                    _, location, success = self.process_single_ip(ip, per_ip_providers)
+                else:
+                    location, success = '未知', False
+                    self.update_progress(False)
+                futures[ip].set_result((location, success))
+        
+        # 同一时间只有一个查询线程在攒批，避免多个线程各自取走一部分导致批次过小
+        drain_locks = {4: threading.Lock(), 6: threading.Lock()}
+        
+        def next_batch(version):
+            """取出一批IP：攒够 batch_size 个、等待超过 batch_flush_interval 秒或遇到结束标记为止"""
+            with drain_locks[version]:
+                item = queues[version].get()
+                if item is None:
+                    return [], True
+                items = [item]
+                deadline = time.monotonic() + location_settings['batch_flush_interval']
+                while len(items) < location_settings['batch_size']:
+                    remaining = deadline - time.monotonic()
+                    try:
+                        item = queues[version].get(timeout=remaining) if remaining > 0 else queues[version].get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is None:
+                        return items, True
+                    items.append(item)
+                return items, False
+        
+        def consume(version):
+            finished = False
+            while not finished:
+                if batch_index is not None:
+                    items, finished = next_batch(version)
+                    if not items:
+                        break
+                else:
+                    item = queues[version].get()
+                    if item is None:
+                        break
+                    items = [item]
+                try:
+                    if batch_index is not None:
+                        resolve_batch(items)
+                        continue
+                    ip, future = item
+                    _, location, success = self.process_single_ip(ip)
+                    future.set_result((location, success))
+                except Exception as e:
+                    print(f"❌ 处理IP {', '.join(ip for ip, future in items)} 时发生异常: {e}")
+                    for ip, future in items:
+                        if not future.done():
+                            future.set_result(('未知', False))
+        
+        schedule_lock = threading.Lock()
+        
+        def add_ips(ipv4, ipv6):
+            """把从未出现过的IP放入查询队列；启用 stream_fetch 时获取线程边读边调用"""
+            with schedule_lock:
+                for version, ips in ((4, ipv4), (6, ipv6)):
+                    new_ips = IPSet(version, ips) - all_ips[version]
+                    all_ips[version].update(new_ips)
+                    if query_enabled and new_ips:
+                        schedule(version, list(new_ips))
+        
+        def schedule(version, ips):
+            cached = self.geo_cache.get_many(ips) if self.geo_cache else {}
+            for ip in ips:
+                future = network = None
+                if ip in cached:
+                    future = Future()
+                    future.set_result(cached[ip])
+                elif aggregate:
+                    network = next(iter(self.group_ips_by_prefix([ip], version == 6)))
+                    future = prefix_futures.get(network)
+                if future is None:
+                    future = Future()
+                    if network is not None:
+                        prefix_futures[network] = future
+                    with self.progress_lock:
+                        self.total_count += 1
+                    # 队列已满时阻塞，防止获取速度远超查询速度时无限堆积
+                    queues[version].put((ip, future))
+                lookups[version][ip] = future
+                future.add_done_callback(
+                    lambda done, version=version, ip=ip: write_queue.put((version, ip, done.result()[0]))
+                )
+        
+        workers = {4: request_settings['max_workers_ipv4'], 6: request_settings['max_workers_ipv6']}
+        if not query_enabled:
+            workers = {4: 0, 6: 0}
+        elif request_settings['adaptive_concurrency']:
+            # 两个地址族共用一个限制器
+            workers[4] = workers[6] = self.create_limiter(workers[4] + workers[6])
+        consumers = [
+            threading.Thread(target=consume, args=(version,), daemon=True)
+            for version in (4, 6) for _ in range(workers[version])
+        ]
+        writer = threading.Thread(target=write_partial, daemon=True)
+        for thread in consumers + [writer]:
+            thread.start()
+        
+        urls = self.plan_sources()
+        print(f'🚀 [流水线] 开始从 {len(urls)} 个数据源获取IP地址并同步查询地理位置...')
+        with ThreadPoolExecutor(max_workers=request_settings['max_workers_url']) as executor:
+            future_to_url = {executor.submit(self.fetch_source, url, add_ips): url for url in urls}
+            for future in as_completed(future_to_url):
+                url = future_to_url[future]
+                try:
+                    fetched = future.result()
+                    if not fetched or not (fetched['not_modified'] or fetched['size']):
+                        print(f'❌ 获取内容为空: {url}')
+                        continue
+                    ipv4, ipv6 = self.extract_source_ips(url, fetched)
+                    print(f'✅ 成功处理: {url} (IPv4: {len(ipv4)}, IPv6: {len(ipv6)})')
+                    add_ips(ipv4, ipv6)
+                except Exception as e:
+                    print(f'❌ 处理 {url} 时出错: {e}')
+        
+        if self.source_state:
+            self.source_state.save()
+        
+        for version in (4, 6):
+            for _ in range(workers[version]):
+                queues[version].put(None)
+        for thread in consumers:
+            thread.join()
+        write_queue.put(None)
+        writer.join()
+        
+        if self.limiter:
+            print(f'⚡ 自适应并发结束时上限: {int(self.limiter.limit)}')
+            self.limiter = None
+        
+        results = {4: [], 6: []}
+        queried = []
+        for version in (4, 6):
+            if not query_enabled:
+                results[version] = [(ip, '未知') for ip in all_ips[version]]
+                continue
+            for ip, future in lookups[version].items():
+                location, success = future.result()
+                results[version].append((ip, location))
+                queried.append((ip, location, success))
+        
+        if self.geo_cache:
+            self.geo_cache.set_many(queried)
+        
+        if self.config['progress_settings']['show_progress']:
+            success_rate = (self.success_count / self.total_count * 100) if self.total_count > 0 else 0
+            print(f'✅ 查询完成: 网络查询 {self.total_count}, 成功 {self.success_count}, 成功率: {success_rate:.1f}%')
+        
+        return all_ips[4], all_ips[6], results[4], results[6]
+
+    def use_async_engine(self):
+        """是否使用asyncio引擎（需要安装aiohttp）"""
+        if self.config['request_settings']['engine'] != 'async':
+            return False
+        if aiohttp is None:
+            print('⚠️  未安装 aiohttp，回退到线程池引擎')
+            return False
+        return True
+
+    async def fetch_url_async(self, session, url, semaphore):
+        """异步获取数据源，返回值与 fetch_source 相同"""
+        scheduled = self.scheduled_result(url)
+        if scheduled:
+            return scheduled
+        request_settings = self.config['request_settings']
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                async with session.get(
+                    url, headers=self.conditional_headers(url),
+                    timeout=aiohttp.ClientTimeout(total=self.source_timeout(url))
+                ) as response:
+                    if response.status == 304:
+                        return {'not_modified': True, 'size': 0, 'elapsed': time.perf_counter() - start}
+                    response.raise_for_status()
+                    fetched = {
+                        'not_modified': False,
+                        'etag': response.headers.get('ETag'),
+                        'last_modified': response.headers.get('Last-Modified'),
+                        'content_type': response.headers.get('Content-Type')
+                    }
+                    if not request_settings['stream_fetch']:
+                        content = await response.read()
+                        fetched.update(
+                            size=len(content),
+                            content_hash=hashlib.sha256(content).hexdigest(),
+                            elapsed=time.perf_counter() - start
+                        )
+                        if self.use_extract_pool(url, fetched, content):
+                            extract_start = time.perf_counter()
+                            packed = await asyncio.wrap_future(self.submit_extract(content, response.get_encoding()))
+                            return self.process_extracted(fetched, packed, extract_start)
+                        fetched['text'] = content.decode(response.get_encoding(), errors='ignore')
+                        return fetched
+                    
+                    extractor = StreamingExtractor(
+                        self.extract_ips_from_text, response.charset, request_settings['max_body_bytes'],
+                        parser=self.select_parser(url, fetched['content_type'])
+                    )
+                    async for chunk in response.content.iter_chunked(request_settings['stream_chunk_size']):
+                        if not extractor.feed(chunk):
+                            print(f'⚠️  {url} 超过大小上限 {request_settings["max_body_bytes"]} 字节，已截断')
+                            break
+                    fetched.update(
+                        text=None,
+                        size=extractor.size,
+                        content_hash=extractor.close(),
+                        ipv4=extractor.ipv4,
+                        ipv6=extractor.ipv6,
+                        meta=self.collect_parsed_rows(extractor.parser.close())[2] if extractor.parser else {},
+                        parser=extractor.parser.name if extractor.parser else None,
+                        elapsed=time.perf_counter() - start
+                    )
+                    return fetched
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                print(f'❌ 请求 {url} 失败: {e}')
+                self.run_report.record_source(
+                    url, status='failed', fetch_ms=round((time.perf_counter() - start) * 1000, 1), error=str(e)
+                )
+                self.record_source_health(url, False, timed_out=isinstance(e, asyncio.TimeoutError))
+                return None
+
+    async def query_baidu_async(self, session, ip):
+        """异步查询百度接口，返回值与 query_baidu 相同 (location, success, throttled)"""
+        try:
+            async with session.get(self.build_baidu_url(ip)) as resp:
+                if resp.status != 200:
+                    return '未知', False, resp.status in RETRY_STATUS_CODES
+                data = await resp.json(content_type=None)
+                if not isinstance(data, dict):
+                    return '未知', False, False
+                location, success = self.parse_baidu_response(data)
+                return location, success, data.get('status') != '0'
+        except asyncio.TimeoutError:
+            return '未知', False, True
+        except (aiohttp.ClientError, ValueError):
+            return '未知', False, False
+
+    async def lookup_async(self, session, provider, ip, provider_semaphores):
+        """通过单个在线后端异步查询；与线程池路径一样遵守后端的 max_concurrency 和自适应并发限制"""
+        provider_semaphore = provider_semaphores.get(provider)
+        if provider_semaphore:
+            await provider_semaphore.acquire()
+        try:
+            limiter = self.limiter
+            if limiter:
+                await limiter.acquire_async()
+            start = time.perf_counter()
+            throttled = False
+            try:
+                if isinstance(provider, BaiduProvider):
+                    location, success, throttled = await self.query_baidu_async(session, ip)
+                else:
+                    location, success, throttled = await asyncio.get_running_loop().run_in_executor(
+                        None, provider.query, ip
+                    )
+            finally:
+                if limiter:
+                    limiter.release(throttled, time.perf_counter() - start)
+            return location, success
+        finally:
+            if provider_semaphore:
+                provider_semaphore.release()
+
+    async def get_location_async(self, session, ip, semaphore, provider_semaphores):
+        """异步查询单个IP的地理位置：本地后端直接查询，百度接口走 aiohttp，其他在线后端放到线程池执行"""
+        location, success = '未知', False
+        start = time.perf_counter()
+        for provider in self.geo_providers:
+            if provider.is_local:
+                location, success, _ = provider.lookup(ip)
+            elif provider.batcher:
+                # 批量后端由 GeoBatcher 控制并发；等待时不占用信号量，所有待查询的IP才能攒进同一批
+                location, success, _ = await asyncio.wrap_future(provider.batcher.submit(ip))
+            else:
+                async with semaphore:
+                    location, success = await self.lookup_async(session, provider, ip, provider_semaphores)
+            if success:
+                break
+        self.run_report.record_geo_latency(time.perf_counter() - start)
+        self.update_progress(success)
+        return location, success
+
+    def run_async(self, coro):
+        """在本收集器专用的事件循环中运行协程；循环和 aiohttp 会话在常驻模式的各轮之间保留，close() 时关闭"""
+        if self.async_loop is None:
+            self.async_loop = asyncio.new_event_loop()
+        return self.async_loop.run_until_complete(coro)
+
+    async def get_async_session(self):
+        """返回复用的 aiohttp 会话，第一次调用时创建（连接池和DNS缓存在各轮之间保留）"""
+        if self.async_session is None or self.async_session.closed:
+            request_settings = self.config['request_settings']
+            connector = aiohttp.TCPConnector(
+                limit=request_settings['max_workers_url'] + request_settings['max_workers_ipv4'] + request_settings['max_workers_ipv6'],
+                ttl_dns_cache=300
+            )
+            self.async_session = aiohttp.ClientSession(
+                headers=self.headers, connector=connector,
+                timeout=aiohttp.ClientTimeout(total=request_settings['timeout'])
+            )
+        return self.async_session
+
+    async def collect_async(self):
+        """asyncio引擎：获取数据源与查询地理位置流水线执行，每发现新IP立即开始查询"""
+        request_settings = self.config['request_settings']
+        location_settings = self.config['location_settings']
+        query_enabled = location_settings['enable_location_query']
+        aggregate = query_enabled and location_settings['enable_prefix_aggregation']
+        
+        all_ips = {4: set(), 6: set()}
+        lookups = {4: {}, 6: {}}
+        prefix_tasks = {}
+        workers = {4: request_settings['max_workers_ipv4'], 6: request_settings['max_workers_ipv6']}
+        if query_enabled and request_settings['adaptive_concurrency']:
+            # 两个地址族共用一个限制器，实际并发由 AdaptiveLimiter 控制
+            workers[4] = workers[6] = self.create_limiter(workers[4] + workers[6])
+        semaphores = {version: asyncio.Semaphore(workers[version]) for version in (4, 6)}
+        provider_semaphores = {
+            provider: asyncio.Semaphore(provider.settings['max_concurrency'])
+            for provider in self.geo_providers if provider.settings.get('max_concurrency')
+        }
+        url_semaphore = asyncio.Semaphore(request_settings['max_workers_url'])
+        
+        self.completed_count = 0
+        self.total_count = 0
+        self.success_count = 0
+        
+        urls = self.plan_sources()
+        print(f'🚀 [asyncio] 开始从 {len(urls)} 个数据源获取IP地址并同步查询地理位置...')
+        
+        session = await self.get_async_session()
+        
+        def schedule_lookups(version, ips):
+            cached = self.geo_cache.get_many(ips) if self.geo_cache else {}
+            for ip in ips:
+                if ip in cached:
+                    lookups[version][ip] = asyncio.get_running_loop().create_future()
+                    lookups[version][ip].set_result(cached[ip])
+                    continue
+                if aggregate:
+                    network = next(iter(self.group_ips_by_prefix([ip], version == 6)))
+                    if network not in prefix_tasks:
+                        self.total_count += 1
+                        prefix_tasks[network] = asyncio.ensure_future(
+                            self.get_location_async(session, ip, semaphores[version], provider_semaphores)
+                        )
+                    lookups[version][ip] = prefix_tasks[network]
+                else:
+                    self.total_count += 1
+                    lookups[version][ip] = asyncio.ensure_future(
+                        self.get_location_async(session, ip, semaphores[version], provider_semaphores)
+                    )
+        
+        async def handle_source(url):
+            # 与线程池引擎一样，单个数据源出错只跳过该数据源
+            try:
+                fetched = await self.fetch_url_async(session, url, url_semaphore)
+                if not fetched or not (fetched['not_modified'] or fetched['size']):
+                    print(f'❌ 获取内容为空: {url}')
+                    return
+                ipv4, ipv6 = self.extract_source_ips(url, fetched)
+                print(f'✅ 成功处理: {url} (IPv4: {len(ipv4)}, IPv6: {len(ipv6)})')
+                for version, ips in ((4, ipv4), (6, ipv6)):
+                    new_ips = ips - all_ips[version]
+                    all_ips[version].update(new_ips)
+                    if query_enabled and new_ips:
+                        schedule_lookups(version, new_ips)
+            except Exception as e:
+                print(f'❌ 处理 {url} 时出错: {e}')
+        
+        await asyncio.gather(*(handle_source(url) for url in urls))
+        if self.source_state:
+            self.source_state.save()
+        
+        # 所有数据源都已处理，不会再有新的IP：让刚创建的查询任务提交到批量队列后立即发出剩余的批次
+        await asyncio.sleep(0)
+        for provider in self.geo_providers:
+            if provider.batcher:
+                provider.batcher.flush()
+        
+        results = {4: [], 6: []}
+        queried = []
+        for version in (4, 6):
+            if not query_enabled:
+                results[version] = [(ip, '未知') for ip in all_ips[version]]
+                continue
+            ips = list(lookups[version])
+            answers = await asyncio.gather(*(lookups[version][ip] for ip in ips))
+            for ip, (location, success) in zip(ips, answers):
+                results[version].append((ip, location))
+                queried.append((ip, location, success))
+        
+        if self.limiter:
+            print(f'⚡ 自适应并发结束时上限: {int(self.limiter.limit)}')
+            self.limiter = None
+        
+        if self.geo_cache:
+            self.geo_cache.set_many(queried)
+        
+        if self.config['progress_settings']['show_progress']:
+            success_rate = (self.success_count / self.total_count * 100) if self.total_count > 0 else 0
+            print(f'✅ 查询完成: 网络查询 {self.total_count}, 成功 {self.success_count}, 成功率: {success_rate:.1f}%')
+        
+        return IPSet(4, all_ips[4]), IPSet(6, all_ips[6]), results[4], results[6]
+
+    async def probe_latency_async(self, ips):
+        """并发测速，返回 {ip: 测速结果}"""
+        probe_settings = self.config['probe_settings']
+        semaphore = asyncio.Semaphore(probe_settings['concurrency'])
+        ssl_context = None
+        if probe_settings['use_tls']:
+            # 只测量握手耗时，不校验证书
+            ssl_context = ssl.create_default_context()
+            ssl_context.check_hostname = False
+            ssl_context.verify_mode = ssl.CERT_NONE
+        server_hostname = probe_settings['tls_server_name'] or None
+        
+        async def probe(ip):
+            async with semaphore:
+                return ip, await measure_tcp_latency(
+                    ip, probe_settings['port'], probe_settings['samples'], probe_settings['timeout'],
+                    ssl_context, server_hostname
+                )
+        
+        return dict(await asyncio.gather(*(probe(ip) for ip in ips)))
+
+    def probe_ips(self, *ip_sets):
+        """对收集到的IP进行TCP/TLS握手测速"""
+        ips = [ip for ip_set in ip_sets for ip in ip_set]
+        if not ips:
+            return {}
+        probe_settings = self.config['probe_settings']
+        mode = 'TLS' if probe_settings['use_tls'] else 'TCP'
+        print(f'⏱️  开始{mode}握手测速: {len(ips)} 个地址, 端口 {probe_settings["port"]}, '
+              f'每个 {probe_settings["samples"]} 次, 并发 {probe_settings["concurrency"]}')
+        start = time.perf_counter()
+        stats = self.run_async(self.probe_latency_async(ips))
+        reachable = sum(1 for result in stats.values() if result['median'] is not None)
+        print(f'✅ 测速完成: 可连接 {reachable}/{len(ips)}, 耗时 {time.perf_counter() - start:.1f} 秒')
+        return stats
+
+    def ranking_stats(self, ip):
+        """排序用的延迟指标：优先使用测速结果；未测速时使用数据源公布的延迟/丢包率，都没有时返回None"""
+        if ip in self.latency_stats:
+            stats = self.latency_stats[ip]
+            return stats if stats['median'] is not None else None
+        meta = self.source_meta.get(ip)
+        if not meta or meta.get('latency') is None:
+            return None
+        return {'min': meta['latency'], 'median': meta['latency'], 'loss': meta.get('loss', 0.0)}
+
+    def has_ranking_stats(self):
+        return bool(self.latency_stats) or any('latency' in meta for meta in self.source_meta.values())
+
+    def save_ranked_results(self, ip_results, filename):
+        """按测速结果排序保存（丢包率优先，其次中位延迟），测速指标写在#注释中；
+        未测速的地址使用数据源公布的延迟"""
+        ranked = []
+        for ip, location, is_ipv6 in ip_results:
+            stats = self.ranking_stats(ip)
+            if not stats:
+                continue
+            ranked.append((stats['loss'], stats['median'], ip, location, is_ipv6, stats))
+        ranked.sort(key=lambda item: item[:2])
+        
+        top_n = self.config['probe_settings']['ranked_top_n']
+        if top_n:
+            ranked = ranked[:top_n]
+        
+        port = self.config['output_settings']['port']
+        with atomic_open(filename) as file:
+            file.write(f"# Cloudflare IP测速排名\n")
+            file.write(f"# 生成时间(北京时间): {self.get_beijing_time().strftime('%Y-%m-%d %H:%M:%S')}\n")
+            file.write(f"# 排序: 丢包率, 中位延迟; 格式: IP:端口#地理位置|中位延迟|最小延迟|丢包率\n\n")
+            for loss, median, ip, location, is_ipv6, stats in ranked:
+                address = f"[{ip}]" if is_ipv6 else ip
+                suffix = "-IPV6" if is_ipv6 else ""
+                file.write(f"{address}:{port}#{location}{suffix}|{median:.1f}ms|{stats['min']:.1f}ms|{loss:.0%}\n")
+        
+        print(f'🏆 已保存 {len(ranked)} 个测速排名结果到 {filename}')
+        return len(ranked)
+
     def is_us_location(self, location):
         """判断是否为美国区域"""
         if location == '未知':
@@ -344,16 +3241,12 @@ class CFIPCollector:
         return False
 
     def save_results_with_location(self, ip_results, filename, is_ipv6=False):
-        """保存结果到文件"""
+        """保存结果到文件；没有结果时也写入只有文件头的空列表，不保留上一次的地址"""
         if not ip_results:
-            print(f'⚠️  没有要保存的{"IPv6" if is_ipv6 else "IPv4"}地址结果。')
-            return [], []
+            print(f'⚠️  没有要保存的{"IPv6" if is_ipv6 else "IPv4"}地址结果，将写入空列表。')
         
-        # 按IP地址排序结果
-        if is_ipv6:
-            sorted_results = sorted(ip_results, key=lambda x: x[0])
-        else:
-            sorted_results = sorted(ip_results, key=lambda x: [int(part) for part in x[0].split('.')])
+        # 按IP地址数值排序结果
+        sorted_results = sorted(ip_results, key=lambda x: IPSet.sort_key(x[0]))
         
         all_results = []
         us_results = []
@@ -380,17 +3273,24 @@ class CFIPCollector:
             else:
                 non_us_results.append(result_line)
         
-        # 保存所有结果
-        if self.config['output_settings']['save_all_ips']:
-            with open(filename, 'w', encoding='utf-8') as file:
-                file.write(f"# Cloudflare IP地址列表\n")
-                file.write(f"# 生成时间(北京时间): {current_time}\n")
-                file.write(f"# 类型: {'IPv6' if is_ipv6 else 'IPv4'}\n")
-                file.write(f"# 总数: {len(all_results)}, 美国: {len(us_results)}, 非美国: {len(non_us_results)}\n\n")
-                for line in all_results:
-                    file.write(line + '\n')
+        # 保存所有结果；IP和地理位置都没有变化时不重写文件，避免只有生成时间不同的提交
+        output_settings = self.config['output_settings']
+        if output_settings['save_all_ips']:
+            previous = self.read_payload_lines(filename)
+            if previous == all_results:
+                print(f'⏸️  {filename} 内容未变化，跳过写入')
+            else:
+                with atomic_open(filename) as file:
+                    file.write(f"# Cloudflare IP地址列表\n")
+                    file.write(f"# 生成时间(北京时间): {current_time}\n")
+                    file.write(f"# 类型: {'IPv6' if is_ipv6 else 'IPv4'}\n")
+                    file.write(f"# 总数: {len(all_results)}, 美国: {len(us_results)}, 非美国: {len(non_us_results)}\n\n")
+                    for line in all_results:
+                        file.write(line + '\n')
+                print(f'💾 已保存 {len(all_results)} 个{"IPv6" if is_ipv6 else "IPv4"}地址到 {filename}')
+                if output_settings['write_delta']:
+                    self.write_delta(filename, previous, all_results)
         
-        print(f'💾 已保存 {len(all_results)} 个{"IPv6" if is_ipv6 else "IPv4"}地址到 {filename}')
         print(f'📍 成功获取地理位置: {len(all_results) - failed_count}, 失败: {failed_count}')
         print(f'🇺🇸 美国区域: {len(us_results)}, 🌍 非美国区域: {len(non_us_results)}')
         
@@ -405,12 +3305,22 @@ class CFIPCollector:
         if not self.config['output_settings']['save_non_us_separately']:
             return None
             
+        # 与最近一个文件内容相同时不再生成新文件
+        non_us_folder = self.config['output_settings']['non_us_folder']
+        existing = sorted(
+            name for name in os.listdir(non_us_folder) if name.startswith('non_us_ips_') and name.endswith('.txt')
+        )
+        if existing:
+            latest = f"{non_us_folder}/{existing[-1]}"
+            if self.read_payload_lines(latest) == list(non_us_ipv4) + list(non_us_ipv6):
+                print(f'⏸️  非美国区域IP与 {latest} 相同，不生成新文件')
+                return latest
+        
         # 生成日期时间文件名
         current_time = self.get_beijing_time().strftime("%Y%m%d_%H%M%S")
-        non_us_folder = self.config['output_settings']['non_us_folder']
         filename = f"{non_us_folder}/non_us_ips_{current_time}.txt"
         
-        with open(filename, 'w', encoding='utf-8') as file:
+        with atomic_open(filename) as file:
             file.write(f"# 非美国区域Cloudflare IP收集\n")
             file.write(f"# 生成时间(北京时间): {self.get_beijing_time().strftime('%Y-%m-%d %H:%M:%S')}\n")
             file.write(f"# IPv4数量: {len(non_us_ipv4)}, IPv6数量: {len(non_us_ipv6)}\n")
@@ -428,8 +3338,61 @@ class CFIPCollector:
                     file.write(line + '\n')
         
         print(f'💾 已保存非美国区域IP到: {filename}')
+        self.update_non_us_manifest(filename, current_time[:8], len(non_us_ipv4) + len(non_us_ipv6))
         return filename
 
+    def update_non_us_manifest(self, filename, date, ip_count):
+        """在 non_us_ips/manifest.json 中登记新文件，读写逻辑与 .github/scripts/manifest.py 共用；
+        索引不存在或损坏时先扫描目录重建，保证索引和目录一致"""
+        non_us_folder = self.config['output_settings']['non_us_folder']
+        if not os.path.exists(MANIFEST_SCRIPT):
+            print(f'⚠️  未找到 {MANIFEST_SCRIPT}，跳过更新文件索引')
+            return
+        try:
+            spec = importlib.util.spec_from_file_location('non_us_manifest', MANIFEST_SCRIPT)
+            manifest_module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(manifest_module)
+            manifest = manifest_module.load_manifest(non_us_folder)
+            manifest_module.record_file(manifest, filename, date, 'run', ip_count, base_dir=non_us_folder)
+            manifest_module.save_manifest(manifest, non_us_folder)
+        except (OSError, ValueError, KeyError) as e:
+            print(f'❌ 更新文件索引失败: {e}')
+
+    def record_history(self, ipv4_results, ipv6_results):
+        """把本轮结果及每个IP的数据源写入历史记录"""
+        sources = {}
+        for url, ip_sets in self.source_ips.items():
+            for ips in ip_sets:
+                for ip in ips:
+                    sources.setdefault(ip, set()).add(url)
+        results = [(ip, 4, location) for ip, location in ipv4_results] + \
+                  [(ip, 6, location) for ip, location in ipv6_results]
+        try:
+            run_id = self.history.record_run(results, sources, self.is_us_location)
+            print(f'🗃️  已写入IP历史记录: 第 {run_id} 次运行, {len(results)} 个地址')
+        except sqlite3.Error as e:
+            print(f'❌ 写入IP历史记录失败: {e}')
+
+    def query_history(self, days, include_us=False):
+        """打印最近 days 天内出现过的IP，格式与结果文件相同"""
+        rows = self.history.query(time.time() - days * 86400, include_us)
+        port = self.config['output_settings']['port']
+        for ip, family, location, first_seen, last_seen in rows:
+            print(f"[{ip}]:{port}#{location}-IPV6" if family == 6 else f"{ip}:{port}#{location}")
+        return rows
+
+    def run_history_command(self, query_days=None, prune_days=None, include_us=False):
+        """命令行的历史记录查询/清理；标准输出只有查询结果，提示信息输出到标准错误"""
+        if not self.history:
+            print('❌ IP历史记录未启用', file=sys.stderr)
+            return
+        if prune_days is not None:
+            deleted = self.history.prune(time.time() - prune_days * 86400)
+            print(f'🧹 已删除 {deleted} 条 {prune_days:g} 天以前的IP历史记录', file=sys.stderr)
+        if query_days is not None:
+            self.query_history(query_days, include_us)
+        self.close()
+
     def verify_results(self):
         """验证结果文件中的IP和地理位置对应关系"""
         output_settings = self.config['output_settings']
@@ -447,30 +3410,105 @@ class CFIPCollector:
                             print(f'   {i}. {line}')
 
     def test_baidu_api(self):
-        """测试百度API接口是否正常工作"""
+        """测试地理位置接口是否正常工作
+        
+        location_settings.api_test 控制测试方式：traffic 不发测试请求，由本轮的实际查询结果判断（check_api_traffic）；
+        parallel 同时发出测试请求；serial 逐个测试并间隔0.5秒；off 跳过测试。
+        """
         if not self.config['location_settings']['enable_location_query']:
             print("ℹ️  地理位置查询已禁用")
             return
+        
+        mode = self.config['location_settings']['api_test']
+        if mode == 'off':
+            print("ℹ️  已跳过地理位置接口测试")
+            return
+        if mode == 'traffic':
+            print("ℹ️  地理位置接口将根据本轮实际查询结果检查")
+            return
             
         test_ips = ['8.8.8.8', '1.1.1.1', '162.159.58.65']
-        print("🧪 测试百度API接口...")
+        print(f"🧪 测试地理位置接口 ({' → '.join(provider.name for provider in self.geo_providers)})...")
+        if mode == 'parallel':
+            with ThreadPoolExecutor(max_workers=len(test_ips)) as executor:
+                results = list(executor.map(self.get_location, test_ips))
+            for ip, (location, success, throttled) in zip(test_ips, results):
+                print(f"{'✅' if success else '❌'} 测试 {ip} -> {location}")
+            return
         for ip in test_ips:
-            location, success = self.get_location_from_baidu(ip)
+            location, success, throttled = self.get_location(ip)
             status = "✅" if success else "❌"
             print(f"{status} 测试 {ip} -> {location}")
             time.sleep(0.5)  # 避免触发频率限制
 
+    def check_api_traffic(self, ipv4_results, ipv6_results):
+        """api_test 为 traffic 时，用本轮实际发出的查询结果代替启动时的测试请求
+        
+        只统计真正发出的查询（缓存命中和网段聚合分发的结果不算），全部命中缓存时记为无实际查询。
+        """
+        location_settings = self.config['location_settings']
+        if location_settings['api_test'] != 'traffic' or not location_settings['enable_location_query']:
+            return
+        if not ipv4_results and not ipv6_results:
+            return
+        total, located = self.run_report.geo_lookups, self.run_report.geo_located
+        if not total:
+            self.run_report.api_check = {'mode': 'traffic', 'status': 'no_traffic', 'located': 0, 'total': 0}
+            print("\n🧪 地理位置接口检查(本轮实际查询): 结果全部来自缓存，本轮无实际查询，未检查接口")
+            return
+        self.run_report.api_check = {
+            'mode': 'traffic', 'status': 'ok' if located else 'failed', 'located': located, 'total': total
+        }
+        print(f"\n🧪 地理位置接口检查(本轮实际查询): 成功 {located}/{total}")
+        if not located:
+            print(f"❌ 地理位置接口 ({' → '.join(provider.name for provider in self.geo_providers)}) 没有返回任何结果，"
+                  f"请检查 location_settings.providers 配置或接口状态")
+
     def print_config_summary(self):
         """打印配置摘要"""
         print('\n📋 配置摘要:')
         print(f'  • 数据源数量: {len(self.urls)}')
+        print(f'  • 并发引擎: {self.config["request_settings"]["engine"]}')
         print(f'  • URL获取线程: {self.config["request_settings"]["max_workers_url"]}')
         print(f'  • IPv4查询线程: {self.config["request_settings"]["max_workers_ipv4"]}')
         print(f'  • IPv6查询线程: {self.config["request_settings"]["max_workers_ipv6"]}')
         print(f'  • 地理位置查询: {"启用" if self.config["location_settings"]["enable_location_query"] else "禁用"}')
+        print(f'  • 查询后端: {" → ".join(provider.name for provider in self.geo_providers)}')
         print(f'  • 保存非美国IP: {"是" if self.config["output_settings"]["save_non_us_separately"] else "否"}')
+        print(f'  • 失败重试: {self.config["request_settings"]["retry_times"]} 次 (初始间隔 {self.config["request_settings"]["retry_delay"]} 秒)')
+        print(f'  • 地理位置缓存: {"启用" if self.geo_cache else "禁用"}')
+        print(f'  • 握手测速: {"启用" if self.config["probe_settings"]["enable_probe"] else "禁用"}')
         print(f'  • 使用时区: 北京时间(UTC+8)')
 
+    def save_run_report(self, ipv4_count, ipv6_count):
+        """打印各阶段耗时并保存JSON运行报告"""
+        report = self.run_report.to_dict()
+        report['ip_counts'] = {'ipv4': ipv4_count, 'ipv6': ipv6_count}
+        if self.geo_cache:
+            report['geo_cache'] = {
+                'hits': self.geo_cache.hits,
+                'negative_hits': self.geo_cache.negative_hits,
+                'misses': self.geo_cache.misses
+            }
+        
+        print('⏱️  阶段耗时:')
+        for name, seconds in report['phases'].items():
+            print(f'  • {name}: {seconds:.2f} 秒')
+        latency = report['geolocation']['latency_ms']
+        if report['geolocation']['queries']:
+            print(f"  • 地理位置查询延迟: p50 {latency['p50']}ms, p95 {latency['p95']}ms, p99 {latency['p99']}ms")
+        failed = [url for url, source in report['sources'].items() if source.get('status') == 'failed']
+        if failed:
+            print(f'  • 失败的数据源: {len(failed)} 个')
+        
+        filename = self.config['output_settings']['report_filename']
+        folder = os.path.dirname(os.path.abspath(self.config['output_settings']['ipv4_filename']))
+        path = os.path.join(folder, filename)
+        with atomic_open(path) as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f'📄 运行报告已保存到: {path}')
+        return report
+
     def main(self):
         """主函数"""
         print("=" * 50)
@@ -480,66 +3518,441 @@ class CFIPCollector:
         
         # 打印配置摘要
         self.print_config_summary()
+        self.run_report = RunReport()
         
         # 确保文件夹存在
         self.ensure_folders()
         
         # 先测试API
         print('\n' + '='*30)
-        self.test_baidu_api()
+        with self.run_report.phase('api_test'):
+            self.test_baidu_api()
         
         # 清理旧文件
         print('\n' + '='*30)
         self.clean_old_files()
         
-        # 并行获取IP地址
-        print('\n' + '='*30)
-        unique_ipv4, unique_ipv6 = self.process_urls_parallel()
+        self.run_cycle(self.run_report)
+        self.close()
         
-        print(f"\n🎉 收集完成: IPv4: {len(unique_ipv4)}个, IPv6: {len(unique_ipv6)}个")
+        print(f"\n" + '='*50)
+        print("🎊 任务完成！")
+        print(f"🕐 完成时间(北京时间): {self.get_beijing_time().strftime('%Y-%m-%d %H:%M:%S')}")
+        print("=" * 50)
+
+    def run_cycle(self, report):
+        """执行一轮收集：获取、查询、测速、写入、生成报告；不关闭缓存和连接，可重复调用"""
+        self.run_report = report
+        self.source_ips = {}
+        self.source_meta = {}
         
-        # 并行查询地理位置并保存结果
+        # 并行获取IP地址
+        print('\n' + '='*30)
         non_us_ipv4 = []
         non_us_ipv6 = []
         output_settings = self.config['output_settings']
         
-        if unique_ipv4:
+        if self.use_async_engine():
+            with report.phase('fetch_and_geolocation'):
+                unique_ipv4, unique_ipv6, ipv4_results, ipv6_results = self.run_async(self.collect_async())
+            print(f"\n🎉 收集完成: IPv4: {len(unique_ipv4)}个, IPv6: {len(unique_ipv6)}个")
+        elif self.config['request_settings']['engine'] == 'pipeline':
+            with report.phase('fetch_and_geolocation'):
+                unique_ipv4, unique_ipv6, ipv4_results, ipv6_results = self.collect_pipelined()
+            print(f"\n🎉 收集完成: IPv4: {len(unique_ipv4)}个, IPv6: {len(unique_ipv6)}个")
+        else:
+            with report.phase('fetch'):
+                unique_ipv4, unique_ipv6 = self.process_urls_parallel()
+            print(f"\n🎉 收集完成: IPv4: {len(unique_ipv4)}个, IPv6: {len(unique_ipv6)}个")
+            
+            # 并行查询地理位置
+            ipv4_results = []
+            ipv6_results = []
+            with report.phase('geolocation'):
+                if unique_ipv4:
+                    print(f"\n" + '='*30)
+                    ipv4_results = self.query_ips_parallel(unique_ipv4, False)
+                if unique_ipv6:
+                    print(f"\n" + '='*30)
+                    ipv6_results = self.query_ips_parallel(unique_ipv6, True)
+        
+        self.check_api_traffic(ipv4_results, ipv6_results)
+        
+        # TCP/TLS握手测速
+        if self.config['probe_settings']['enable_probe']:
+            print(f"\n" + '='*30)
+            with report.phase('probe'):
+                self.latency_stats = self.probe_ips(unique_ipv4, unique_ipv6)
+        
+        self.update_source_yield()
+        self.publish_results(ipv4_results, ipv6_results)
+        
+        # 保存结果
+        with report.phase('write'):
             print(f"\n" + '='*30)
-            ipv4_results = self.query_ips_parallel(unique_ipv4, False)
             us_ipv4, non_us_ipv4 = self.save_results_with_location(
                 ipv4_results, output_settings['ipv4_filename'], False
             )
-        
-        if unique_ipv6:
+            
             print(f"\n" + '='*30)
-            ipv6_results = self.query_ips_parallel(unique_ipv6, True)
             us_ipv6, non_us_ipv6 = self.save_results_with_location(
                 ipv6_results, output_settings['ipv6_filename'], True
             )
+            
+            if self.has_ranking_stats():
+                print(f"\n" + '='*30)
+                self.save_ranked_results(
+                    [(ip, location, False) for ip, location in ipv4_results] +
+                    [(ip, location, True) for ip, location in ipv6_results],
+                    self.config['probe_settings']['ranked_filename']
+                )
+            
+            # 保存非美国区域IP
+            if non_us_ipv4 or non_us_ipv6:
+                print(f"\n" + '='*30)
+                non_us_filename = self.save_non_us_ips(non_us_ipv4, non_us_ipv6)
+                if non_us_filename:
+                    print(f"\n📊 非美国区域IP统计:")
+                    print(f"  • IPv4: {len(non_us_ipv4)}个")
+                    print(f"  • IPv6: {len(non_us_ipv6)}个")
+                    print(f"  • 保存位置: {non_us_filename}")
+            
+            if self.history:
+                self.record_history(ipv4_results, ipv6_results)
+            
+            # 最终排序结果已写入，删除流水线模式的增量文件
+            for filename in self.partial_filenames().values():
+                if os.path.exists(filename):
+                    os.remove(filename)
         
-        # 保存非美国区域IP
-        if non_us_ipv4 or non_us_ipv6:
-            print(f"\n" + '='*30)
-            non_us_filename = self.save_non_us_ips(non_us_ipv4, non_us_ipv6)
-            if non_us_filename:
-                print(f"\n📊 非美国区域IP统计:")
-                print(f"  • IPv4: {len(non_us_ipv4)}个")
-                print(f"  • IPv6: {len(non_us_ipv6)}个")
-                print(f"  • 保存位置: {non_us_filename}")
+        if self.geo_cache:
+            print(f"\n💽 地理位置缓存: 命中 {self.geo_cache.hits}, 失败结果命中 {self.geo_cache.negative_hits}, 未命中 {self.geo_cache.misses}")
         
         # 验证结果
         print(f"\n" + '='*30)
         self.verify_results()
         
-        print(f"\n" + '='*50)
-        print("🎊 任务完成！")
-        print(f"🕐 完成时间(北京时间): {self.get_beijing_time().strftime('%Y-%m-%d %H:%M:%S')}")
+        # 运行报告
+        print(f"\n" + '='*30)
+        return self.save_run_report(len(unique_ipv4), len(unique_ipv6))
+
+    def close(self):
+        """关闭地理位置缓存、历史记录、提取进程池和查询后端"""
+        if self.geo_cache:
+            self.geo_cache.close()
+        if self.extract_pool:
+            self.extract_pool.shutdown()
+            self.extract_pool = None
+        if self.async_loop:
+            if self.async_session:
+                self.async_loop.run_until_complete(self.async_session.close())
+                self.async_session = None
+            self.async_loop.close()
+            self.async_loop = None
+        if self.history:
+            self.history.close()
+        for provider in self.geo_providers:
+            provider.close()
+
+    def prune_stores(self):
+        """清理过期的地理位置缓存和超过保留天数的IP历史记录；常驻模式下按 daemon_settings.prune_interval 定期调用"""
+        self.last_pruned_at = time.time()
+        try:
+            if self.geo_cache:
+                pruned = self.geo_cache.prune()
+                if pruned:
+                    print(f'🧹 已清理 {pruned} 条过期地理位置缓存')
+            if self.history:
+                cutoff = time.time() - self.config['cache_settings']['history_retention_days'] * 86400
+                pruned = self.history.prune(cutoff)
+                if pruned:
+                    print(f'🧹 已清理 {pruned} 条过期IP历史记录')
+        except sqlite3.Error as e:
+            print(f'❌ 清理缓存失败: {e}')
+
+    def source_interval(self, url):
+        """数据源的刷新间隔（秒），未单独配置时使用全局间隔"""
+        daemon_settings = self.config['daemon_settings']
+        return daemon_settings['source_intervals'].get(url, daemon_settings['interval'])
+
+    def start_status_server(self):
+        """在后台线程启动状态接口"""
+        daemon_settings = self.config['daemon_settings']
+        if not daemon_settings['status_port']:
+            return None
+        try:
+            server = ThreadingHTTPServer((daemon_settings['status_host'], daemon_settings['status_port']), StatusHandler)
+        except OSError as e:
+            print(f'❌ 启动状态接口失败: {e}')
+            return None
+        server.collector = self
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        print(f'📡 状态接口: http://{daemon_settings["status_host"]}:{server.server_port}/status')
+        return server
+
+    def publish_results(self, ipv4_results, ipv6_results):
+        """生成新的结果快照供HTTP接口使用"""
+        records = []
+        for version, results in ((4, ipv4_results), (6, ipv6_results)):
+            for ip, location in sorted(results, key=lambda item: IPSet.sort_key(item[0])):
+                records.append((ip, version, location, self.ranking_stats(ip), self.source_meta.get(ip, {})))
+        digest = hashlib.sha1()
+        for ip, version, location, stats, meta in records:
+            digest.update(
+                f"{ip}#{location}|{stats and (stats['loss'], round(stats['median']))}|{sorted(meta.items())}\n"
+                .encode('utf-8')
+            )
+        self.results_snapshot = (digest.hexdigest(), records)
+        self.results_file_mtimes = None
+
+    def load_results_from_files(self):
+        """从 ip.txt / ipv6.txt 读取结果，格式为 IP:端口#地理位置 或 [IPv6]:端口#地理位置-IPV6"""
+        results = {4: [], 6: []}
+        output_settings = self.config['output_settings']
+        for version, filename in ((4, output_settings['ipv4_filename']), (6, output_settings['ipv6_filename'])):
+            if not os.path.exists(filename):
+                continue
+            with open(filename, 'r', encoding='utf-8') as f:
+                for line in f:
+                    line = line.strip()
+                    if not line or line.startswith('#'):
+                        continue
+                    address, _, location = line.partition('#')
+                    if address.startswith('['):
+                        ip = address[1:address.find(']')]
+                        location = location[:-len('-IPV6')] if location.endswith('-IPV6') else location
+                    else:
+                        ip = address.rsplit(':', 1)[0]
+                    results[version].append((ip, location))
+        return results[4], results[6]
+
+    def current_results(self):
+        """返回当前结果快照；使用文件中的结果时，文件修改后自动重新加载"""
+        if self.results_snapshot is not None and self.results_file_mtimes is None:
+            return self.results_snapshot
+        output_settings = self.config['output_settings']
+        mtimes = tuple(
+            os.path.getmtime(filename) if os.path.exists(filename) else None
+            for filename in (output_settings['ipv4_filename'], output_settings['ipv6_filename'])
+        )
+        if mtimes == (None, None):
+            return None
+        if mtimes != self.results_file_mtimes:
+            self.publish_results(*self.load_results_from_files())
+            self.results_file_mtimes = mtimes
+        return self.results_snapshot
+
+    def serve_results(self, background=False):
+        """启动 asyncio HTTP接口；background=True 时在后台线程运行"""
+        api_settings = self.config['api_settings']
+        server = ResultAPIServer(self, api_settings['host'], api_settings['port'])
+        if background:
+            threading.Thread(target=asyncio.run, args=(server.serve_forever(),), daemon=True).start()
+        else:
+            asyncio.run(server.serve_forever())
+
+    def run_daemon(self):
+        """常驻模式：按各数据源的刷新间隔循环收集，缓存、连接池和数据源状态在各轮之间保留在内存中"""
+        print("=" * 50)
+        print("🌐 Cloudflare IP地址收集器 v2.0 (常驻模式)")
         print("=" * 50)
+        self.print_config_summary()
+        self.ensure_folders()
+        print('\n' + '='*30)
+        self.test_baidu_api()
+        
+        stop = threading.Event()
+        signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+        server = self.start_status_server()
+        next_due = {url: 0.0 for url in self.urls}
+        started_at = self.get_beijing_time().strftime('%Y-%m-%d %H:%M:%S')
+        self.daemon_status = {'started_at': started_at, 'cycles': 0, 'running': False}
+        
+        try:
+            while not stop.is_set():
+                now = time.time()
+                due = [url for url in self.urls if next_due[url] <= now]
+                if not due:
+                    stop.wait(min(next_due.values()) - now)
+                    continue
+                
+                # 常驻进程不会重启，过期的缓存和历史记录按 prune_interval 在两轮之间清理
+                if now - self.last_pruned_at >= self.config['daemon_settings']['prune_interval']:
+                    self.prune_stores()
+                
+                # 没有保存过状态的数据源无法复用，本轮也要获取
+                self.skip_sources = {
+                    url for url in self.urls
+                    if url not in due and self.source_state and 'ipv4' in self.source_state.get(url)
+                }
+                cycle_start = time.time()
+                self.daemon_status['running'] = True
+                print('\n' + '='*50)
+                print(f"🔁 第 {self.daemon_status['cycles'] + 1} 轮收集, 到期数据源 {len(due)}/{len(self.urls)}, "
+                      f"时间(北京时间): {self.get_beijing_time().strftime('%Y-%m-%d %H:%M:%S')}")
+                report = None
+                try:
+                    report = self.run_cycle(RunReport())
+                except Exception as e:
+                    print(f'💥 本轮收集出错: {e}')
+                    import traceback
+                    traceback.print_exc()
+                for url in self.urls:
+                    if url not in self.skip_sources:
+                        next_due[url] = cycle_start + self.source_interval(url)
+                
+                self.daemon_status = {
+                    'started_at': started_at,
+                    'cycles': self.daemon_status['cycles'] + 1,
+                    'running': False,
+                    'last_cycle': {
+                        'finished_at': self.get_beijing_time().strftime('%Y-%m-%d %H:%M:%S'),
+                        'duration': round(time.time() - cycle_start, 2),
+                        'fetched_sources': len(self.urls) - len(self.skip_sources),
+                        'error': report is None,
+                        'report': report
+                    },
+                    'next_due': {
+                        url: datetime.fromtimestamp(due_at, timezone(timedelta(hours=8))).strftime('%Y-%m-%d %H:%M:%S')
+                        for url, due_at in next_due.items()
+                    }
+                }
+                print(f"😴 本轮耗时 {time.time() - cycle_start:.1f} 秒, 下一个数据源将在 "
+                      f"{max(0, min(next_due.values()) - time.time()):.0f} 秒后到期")
+        finally:
+            if server:
+                server.shutdown()
+            self.close()
+            print('👋 常驻模式已停止')
+
+
+def parse_args():
+    """解析命令行参数"""
+    import argparse
+    parser = argparse.ArgumentParser(description='Cloudflare IP地址收集器')
+    parser.add_argument('--urls-config', default='urls.json', help='URL列表配置文件')
+    parser.add_argument('--config', default='config.json', help='主配置文件')
+    parser.add_argument('--profile', nargs='?', const='profile.pstats', metavar='FILE',
+                        help='使用 cProfile 分析本次运行并保存统计数据（默认 profile.pstats）')
+    parser.add_argument('--daemon', action='store_true',
+                        help='常驻运行，按 daemon_settings 中的间隔循环收集，并提供HTTP状态接口')
+    parser.add_argument('--history-query', type=float, metavar='DAYS',
+                        help='输出最近 DAYS 天内出现过的非美国IP（来自IP历史记录）后退出')
+    parser.add_argument('--history-include-us', action='store_true',
+                        help='与 --history-query 一起使用时包含美国IP')
+    parser.add_argument('--history-prune', type=float, metavar='DAYS',
+                        help='删除 DAYS 天以前的IP历史记录后退出')
+    parser.add_argument('--serve', action='store_true',
+                        help='启动IP列表HTTP接口（api_settings）；与 --daemon 同时使用时提供每轮收集的最新结果')
+    parser.add_argument('--measure-startup', action='store_true',
+                        help='统计启动开销（模块导入耗时、延迟加载的模块、初始化耗时）后退出')
+    return parser.parse_args()
+
+
+def run_with_profile(func, stats_file):
+    """在 cProfile 下运行，保存统计数据并打印累计耗时最多的函数"""
+    import cProfile
+    import pstats
+    profiler = cProfile.Profile()
+    try:
+        profiler.runcall(func)
+    finally:
+        profiler.dump_stats(stats_file)
+        print(f'\n📈 性能分析数据已保存到: {stats_file}')
+        pstats.Stats(stats_file).sort_stats('cumulative').print_stats(20)
+
+
+def parse_importtime(output):
+    """解析 python -X importtime 的输出，返回 [(模块名, 层级, 自身耗时ms, 累计耗时ms)]"""
+    entries = []
+    for line in output.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        if not self_us.strip().isdigit():
+            continue
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        entries.append((name.strip(), depth, int(self_us) / 1000, int(cumulative_us) / 1000))
+    return entries
+
+
+def measure_startup(urls_config, main_config, top_n=15):
+    """统计启动开销：子进程中用 -X importtime 统计导入本模块的耗时明细，
+    再在当前进程中统计各延迟加载模块首次使用时的导入耗时和 CFIPCollector 初始化耗时"""
+    import subprocess
+    print("=" * 50)
+    print("⏱️  启动开销统计")
+    print("=" * 50)
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import autoip6'],
+        cwd=script_dir, capture_output=True, text=True
+    )
+    wall = (time.perf_counter() - start) * 1000
+    entries = parse_importtime(result.stderr)
+    module = next((entry for entry in entries if entry[0] == 'autoip6' and entry[1] == 0), None)
+    if result.returncode != 0 or module is None:
+        print(f'❌ 统计导入耗时失败: {result.stderr.strip()[-500:]}')
+        return
+    
+    # autoip6 的导入明细位于它之前、层级大于0的连续条目中
+    index = entries.index(module)
+    first = index
+    while first > 0 and entries[first - 1][1] > 0:
+        first -= 1
+    children = [entry for entry in entries[first:index] if entry[1] == 1]
+    print(f'\n📦 导入 autoip6: {module[3]:.1f}ms（自身 {module[2]:.1f}ms，子进程总耗时 {wall:.0f}ms）')
+    print(f'  直接导入的模块（累计耗时前 {top_n}）:')
+    for name, depth, self_ms, cumulative_ms in sorted(children, key=lambda entry: -entry[3])[:top_n]:
+        print(f'  • {name:<36} {cumulative_ms:8.1f}ms')
+    print(f'  自身耗时最多的模块（前 {top_n}）:')
+    for name, depth, self_ms, cumulative_ms in sorted(entries[first:index + 1], key=lambda entry: -entry[2])[:top_n]:
+        print(f'  • {name:<36} {self_ms:8.1f}ms')
+    
+    print('\n💤 延迟加载的模块（首次使用时导入）:')
+    for name, lazy_module in LAZY_MODULES.items():
+        if lazy_module is None:
+            print(f'  • {name:<36} 未安装')
+            continue
+        loaded = name in sys.modules
+        start = time.perf_counter()
+        importlib.import_module(name)
+        print(f'  • {name:<36} {(time.perf_counter() - start) * 1000:8.1f}ms{"（已加载）" if loaded else ""}')
+    
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        collector = CFIPCollector(urls_config, main_config)
+    print(f'\n🏗️  CFIPCollector 初始化: {(time.perf_counter() - start) * 1000:.1f}ms')
+    mode = collector.config['location_settings']['api_test']
+    print(f'🧪 地理位置接口测试: {mode}' + ('（串行测试约需 1.5 秒以上）' if mode == 'serial' else ''))
+    collector.close()
+
 
 if __name__ == "__main__":
     try:
-        collector = CFIPCollector('urls.json', 'config.json')
-        collector.main()
+        args = parse_args()
+        if args.measure_startup:
+            measure_startup(args.urls_config, args.config)
+            sys.exit(0)
+        history_mode = args.history_query is not None or args.history_prune is not None
+        # 历史记录查询的结果写到标准输出，初始化过程中的提示信息改到标准错误，便于重定向或管道处理
+        with contextlib.redirect_stdout(sys.stderr if history_mode else sys.stdout):
+            collector = CFIPCollector(args.urls_config, args.config)
+        if history_mode:
+            entry = lambda: collector.run_history_command(args.history_query, args.history_prune, args.history_include_us)
+        elif args.daemon:
+            if args.serve:
+                collector.serve_results(background=True)
+            entry = collector.run_daemon
+        elif args.serve:
+            entry = collector.serve_results
+        else:
+            entry = collector.main
+        if args.profile:
+            run_with_profile(entry, args.profile)
+        else:
+            entry()
     except KeyboardInterrupt:
         print("\n\n❌ 用户中断程序执行")
     except Exception as e:
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+IP提取性能对比：旧版双正则 re.findall 实现 vs 单次扫描实现
+用法：
+    python benchmarks/bench_extract.py --fetch        # 下载默认数据源页面到 benchmarks/pages/ 后测试
+    python benchmarks/bench_extract.py [页面文件或目录 ...]
+"""
+
+import argparse
+import contextlib
+import glob
+import hashlib
+import io
+import ipaddress
+import json
+import os
+import re
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from autoip6 import CFIPCollector
+
+PAGES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pages')
+
+LEGACY_IPV4_PATTERN = r'\b(25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)\.(25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)\.(25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)\.(25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)\b'
+LEGACY_IPV6_PATTERN = r'(?:[A-Fa-f0-9]{1,4}:){7}[A-Fa-f0-9]{1,4}|(?:[A-Fa-f0-9]{1,4}:){1,7}:|(?:[A-Fa-f0-9]{1,4}:){1,6}:[A-Fa-f0-9]{1,4}'
+
+
+def legacy_extract(text):
+    """旧版实现：两次 re.findall，逐个构造 ipaddress 对象判断 is_private"""
+    valid_ipv4 = set()
+    valid_ipv6 = set()
+    for ip in re.findall(LEGACY_IPV4_PATTERN, text):
+        try:
+            ip_str = '.'.join(ip)
+            if ipaddress.IPv4Address(ip_str).is_private:
+                continue
+            valid_ipv4.add(ip_str)
+        except ValueError:
+            continue
+    for ip in re.findall(LEGACY_IPV6_PATTERN, text):
+        try:
+            ip_obj = ipaddress.IPv6Address(ip)
+            if ip_obj.is_private:
+                continue
+            valid_ipv6.add(ip_obj.compressed.lower())
+        except ValueError:
+            continue
+    return valid_ipv4, valid_ipv6
+
+
+def make_collector(workdir):
+    """创建不读写持久缓存的收集器（数据源列表仍取自仓库的 urls.json），用完后调用 collector.close()"""
+    config = {
+        'progress_settings': {'show_progress': False},
+        'cache_settings': {
+            'cache_folder': os.path.join(workdir, '.cache'),
+            'enable_geo_cache': False,
+            'enable_source_state': False,
+            'enable_history': False
+        }
+    }
+    config_file = os.path.join(workdir, 'config.json')
+    with open(config_file, 'w', encoding='utf-8') as f:
+        json.dump(config, f)
+    with contextlib.redirect_stdout(io.StringIO()):
+        return CFIPCollector(os.path.join(REPO_DIR, 'urls.json'), config_file)
+
+
+def fetch_pages(collector):
+    """下载数据源页面到本地目录，供后续重复测试"""
+    os.makedirs(PAGES_DIR, exist_ok=True)
+    for url in collector.urls:
+        text = collector.fetch_url(url)
+        if not text:
+            continue
+        name = hashlib.md5(url.encode()).hexdigest()[:12] + '.txt'
+        with open(os.path.join(PAGES_DIR, name), 'w', encoding='utf-8') as f:
+            f.write(text)
+        print(f'📥 {url} -> {name} ({len(text)} 字符)')
+
+
+def collect_page_files(paths):
+    files = []
+    for path in paths or [PAGES_DIR]:
+        if os.path.isdir(path):
+            files.extend(sorted(glob.glob(os.path.join(path, '*'))))
+        elif os.path.isfile(path):
+            files.append(path)
+    return files
+
+
+def best_time(func, text, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(text)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def run_comparison(collector, files, repeat):
+    """逐个页面对比旧版与新版提取的耗时和结果差异"""
+    if not files:
+        print('❌ 没有可测试的页面，请先使用 --fetch 下载或指定页面文件')
+        return 1
+
+    total_legacy = total_new = 0.0
+    print(f'\n{"页面":<20} {"大小":>10} {"旧版(ms)":>10} {"新版(ms)":>10} {"加速":>7}  结果差异')
+    for path in files:
+        with open(path, 'r', encoding='utf-8', errors='ignore') as f:
+            text = f.read()
+        legacy_time, (legacy_v4, legacy_v6) = best_time(legacy_extract, text, repeat)
+        new_time, (new_v4, new_v6) = best_time(collector.extract_ips_from_text, text, repeat)
+        total_legacy += legacy_time
+        total_new += new_time
+        diff = f'v4 +{len(new_v4 - legacy_v4)}/-{len(legacy_v4 - new_v4)} v6 +{len(new_v6 - legacy_v6)}/-{len(legacy_v6 - new_v6)}'
+        speedup = legacy_time / new_time if new_time else float('inf')
+        print(f'{os.path.basename(path)[:20]:<20} {len(text):>10} {legacy_time * 1000:>10.2f} {new_time * 1000:>10.2f} {speedup:>6.1f}x  {diff}')
+
+    print(f'\n总计: 旧版 {total_legacy * 1000:.2f} ms, 新版 {total_new * 1000:.2f} ms, 加速 {total_legacy / total_new:.1f}x')
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='IP提取性能对比')
+    parser.add_argument('paths', nargs='*', help='页面文件或目录，默认 benchmarks/pages/')
+    parser.add_argument('--fetch', action='store_true', help='先下载默认数据源页面')
+    parser.add_argument('--repeat', type=int, default=5, help='每个页面重复次数，取最快一次')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        collector = make_collector(workdir)
+        try:
+            if args.fetch:
+                fetch_pages(collector)
+            return run_comparison(collector, collect_page_files(args.paths), args.repeat)
+        finally:
+            collector.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
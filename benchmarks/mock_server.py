@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+本地模拟服务器：提供合成的数据源页面和仿百度 resource_id=6006 地理位置接口，用于离线性能测试
+
+数据源：
+    /source/plain?n=1000&seed=1        每行一个 IP:端口
+    /source/html?n=1000&seed=1         wetest 风格的HTML表格
+    /source/mixed?n=1000&v6=0.2        IPv4/IPv6 混合列表，v6 为IPv6占比
+地理位置：
+    /api.php?query=IP                  返回与百度接口相同结构的JSON
+    延迟和错误率由启动参数控制，也可用 latency_ms / error_rate 查询参数覆盖
+
+用法：
+    python benchmarks/mock_server.py --port 8800 --latency-ms 20 --error-rate 0.05
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+import zlib
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+LOCATIONS = ['美国', '美国', '美国', '日本', '新加坡', '香港', '德国', '荷兰']
+
+
+def synthetic_ips(n, seed=1, v6_ratio=0.0):
+    """生成 n 个可复现的公网地址"""
+    rng = random.Random(seed)
+    for _ in range(n):
+        if rng.random() < v6_ratio:
+            yield '2606:4700:%x:%x::%x' % (rng.getrandbits(16), rng.getrandbits(16), rng.getrandbits(16))
+        else:
+            yield '104.%d.%d.%d' % (rng.randint(16, 27), rng.randint(0, 255), rng.randint(1, 254))
+
+
+def render_source(kind, n, seed=1, v6_ratio=0.2):
+    """生成指定类型的数据源页面"""
+    if kind == 'plain':
+        return '\n'.join(f'{ip}:443#US' for ip in synthetic_ips(n, seed))
+    if kind == 'html':
+        rows = [
+            f'<tr><td data-label="线路">电信</td><td data-label="优选地址">{ip}</td>'
+            f'<td data-label="网络延迟">{120 + i % 80}ms</td><td data-label="下载速度">{i % 30}MB/s</td>'
+            f'<td data-label="数据中心">LAX</td><td data-label="更新时间">2026-08-23 05:47:39</td></tr>'
+            for i, ip in enumerate(synthetic_ips(n, seed))
+        ]
+        return '<html><body><table><tbody>\n' + '\n'.join(rows) + '\n</tbody></table></body></html>'
+    return '\n'.join(synthetic_ips(n, seed, v6_ratio))
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    latency_ms = 0.0
+    error_rate = 0.0
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_body(self, status, body, content_type):
+        data = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+
+        if url.path == '/api.php':
+            latency_ms = float(query.get('latency_ms', self.latency_ms))
+            error_rate = float(query.get('error_rate', self.error_rate))
+            if latency_ms:
+                time.sleep(latency_ms / 1000)
+            if random.random() < error_rate:
+                self.send_body(503, 'busy', 'text/plain')
+                return
+            ip = query.get('query', '')
+            location = LOCATIONS[zlib.crc32(ip.encode()) % len(LOCATIONS)]
+            payload = {'status': '0', 'data': [{'location': location, 'origip': ip}]}
+            self.send_body(200, json.dumps(payload, ensure_ascii=False), 'application/json')
+            return
+
+        if url.path.startswith('/source/'):
+            kind = url.path.rsplit('/', 1)[-1]
+            body = render_source(
+                kind, int(query.get('n', 1000)), int(query.get('seed', 1)), float(query.get('v6', 0.2))
+            )
+            self.send_body(200, body, 'text/html; charset=utf-8' if kind == 'html' else 'text/plain; charset=utf-8')
+            return
+
+        self.send_body(404, 'not found', 'text/plain')
+
+
+def start_mock_server(port=0, latency_ms=0.0, error_rate=0.0):
+    """在后台线程启动模拟服务器，返回 (server, base_url)"""
+    handler = type('ConfiguredMockHandler', (MockHandler,), {'latency_ms': latency_ms, 'error_rate': error_rate})
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_address[1]}'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='离线性能测试用模拟服务器')
+    parser.add_argument('--port', type=int, default=8800)
+    parser.add_argument('--latency-ms', type=float, default=0.0, help='地理位置接口延迟（毫秒）')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='地理位置接口错误率（0-1）')
+    args = parser.parse_args()
+
+    server, base_url = start_mock_server(args.port, args.latency_ms, args.error_rate)
+    print(f'🧪 模拟服务器已启动: {base_url}')
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+离线性能测试：使用本地模拟服务器，在不同规模下测量各阶段耗时，结果输出为JSON便于对比
+
+场景：
+    extract     extract_ips_from_text 解析合成页面
+    fetch       process_urls_parallel 从模拟数据源获取并提取
+    geolocation query_ips_parallel 查询模拟地理位置接口（规模受 --geo-max 限制）
+    merge       merge_non_us_ips.merge_and_deduplicate_ips 合并一天的运行文件
+    merge_stream merge_non_us_ips.merge_and_deduplicate_ips_stream 流式k路归并同样的文件
+
+用法：
+    python benchmarks/run_benchmarks.py --sizes 1000 100000 1000000 --output results.json
+"""
+
+import argparse
+import contextlib
+import importlib.util
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from autoip6 import CFIPCollector
+from mock_server import render_source, start_mock_server, synthetic_ips
+
+SCENARIOS = ['extract', 'fetch', 'geolocation', 'merge', 'merge_stream']
+
+
+def load_merge_module():
+    scripts_dir = os.path.join(REPO_DIR, '.github', 'scripts')
+    if scripts_dir not in sys.path:
+        # 合并脚本会导入同目录下的 manifest.py
+        sys.path.insert(0, scripts_dir)
+    path = os.path.join(scripts_dir, 'merge_non_us_ips.py')
+    spec = importlib.util.spec_from_file_location('merge_non_us_ips', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def make_collector(base_url, workdir):
+    """创建使用模拟服务器、不读写持久缓存的收集器
+
+    缓存、数据源状态和历史记录在构造前通过配置文件关闭（缓存目录也指向 workdir），
+    不会打开或清理仓库 .cache 目录下的数据库；用完后调用 collector.close()。
+    """
+    config = {
+        'location_settings': {'baidu_api_url': f'{base_url}/api.php'},
+        'progress_settings': {'show_progress': False},
+        'request_settings': {'retry_delay': 0.05},
+        'cache_settings': {
+            'cache_folder': os.path.join(workdir, '.cache'),
+            'enable_geo_cache': False,
+            'enable_source_state': False,
+            'enable_history': False
+        }
+    }
+    config_file = os.path.join(workdir, 'config.json')
+    with open(config_file, 'w', encoding='utf-8') as f:
+        json.dump(config, f)
+    with contextlib.redirect_stdout(io.StringIO()):
+        return CFIPCollector(os.path.join(workdir, 'urls.json'), config_file)
+
+
+def timed(func, *args):
+    """静默执行并返回 (耗时秒, 返回值)"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        result = func(*args)
+        return time.perf_counter() - start, result
+
+
+def bench_extract(collector, base_url, size, args):
+    text = render_source('html', size) + '\n' + render_source('mixed', size // 10 or 1, seed=2)
+    seconds, (ipv4, ipv6) = timed(collector.extract_ips_from_text, text)
+    return {'seconds': seconds, 'bytes': len(text), 'ipv4': len(ipv4), 'ipv6': len(ipv6),
+            'ips_per_second': (len(ipv4) + len(ipv6)) / seconds if seconds else None}
+
+
+def bench_fetch(collector, base_url, size, args):
+    per_source = max(1, size // args.sources)
+    kinds = ['plain', 'html', 'mixed']
+    collector.urls = [
+        f'{base_url}/source/{kinds[i % len(kinds)]}?n={per_source}&seed={i}' for i in range(args.sources)
+    ]
+    seconds, (ipv4, ipv6) = timed(collector.process_urls_parallel)
+    return {'seconds': seconds, 'sources': args.sources, 'ipv4': len(ipv4), 'ipv6': len(ipv6)}
+
+
+def bench_geolocation(collector, base_url, size, args):
+    count = min(size, args.geo_max)
+    ips = set(synthetic_ips(count, seed=3))
+    seconds, results = timed(collector.query_ips_parallel, ips, False)
+    failed = sum(1 for _, location in results if location == '未知')
+    return {'seconds': seconds, 'queries': len(ips), 'failed': failed,
+            'queries_per_second': len(ips) / seconds if seconds else None,
+            'latency_ms': collector.run_report.percentiles(collector.run_report.geo_latencies)}
+
+
+def bench_merge(collector, base_url, size, args, function='merge_and_deduplicate_ips'):
+    merge_module = load_merge_module()
+    runs = args.merge_runs
+    per_run = max(1, size // runs)
+    with tempfile.TemporaryDirectory() as workdir:
+        folder = os.path.join(workdir, 'non_us_ips')
+        os.makedirs(folder)
+        for run in range(runs):
+            # 相邻两次运行有一半地址重复，模拟真实的重复率
+            ips = synthetic_ips(per_run, seed=run // 2)
+            with open(os.path.join(folder, f'non_us_ips_20260101_{run:06d}.txt'), 'w', encoding='utf-8') as f:
+                f.write('# 非美国区域Cloudflare IP收集\n\n')
+                f.writelines(f'{ip}:8443#日本\n' for ip in ips)
+        cwd = os.getcwd()
+        os.chdir(workdir)
+        try:
+            seconds, success = timed(getattr(merge_module, function), '20260101')
+        finally:
+            os.chdir(cwd)
+    return {'seconds': seconds, 'run_files': runs, 'lines': per_run * runs, 'success': success}
+
+
+def bench_merge_stream(collector, base_url, size, args):
+    return bench_merge(collector, base_url, size, args, 'merge_and_deduplicate_ips_stream')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='CFIPCollector 离线性能测试')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 100000, 1000000], help='IP规模')
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument('--sources', type=int, default=14, help='fetch 场景的数据源数量')
+    parser.add_argument('--geo-max', type=int, default=5000, help='geolocation 场景的最大查询数')
+    parser.add_argument('--geo-latency-ms', type=float, default=20.0, help='模拟地理位置接口延迟')
+    parser.add_argument('--geo-error-rate', type=float, default=0.0, help='模拟地理位置接口错误率')
+    parser.add_argument('--merge-runs', type=int, default=48, help='merge 场景一天内的运行文件数')
+    parser.add_argument('--output', help='结果JSON文件，默认输出到标准输出')
+    args = parser.parse_args()
+
+    server, base_url = start_mock_server(latency_ms=args.geo_latency_ms, error_rate=args.geo_error_rate)
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for size in args.sizes:
+            for scenario in args.scenarios:
+                collector = make_collector(base_url, workdir)
+                try:
+                    result = globals()[f'bench_{scenario}'](collector, base_url, size, args)
+                finally:
+                    collector.close()
+                result.update(scenario=scenario, size=size)
+                results.append(result)
+                print(f'⏱️  {scenario:<12} {size:>9}  {result["seconds"]:.3f} 秒', file=sys.stderr)
+    server.shutdown()
+
+    report = {
+        'timestamp': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'settings': {
+            'geo_latency_ms': args.geo_latency_ms,
+            'geo_error_rate': args.geo_error_rate,
+            'geo_max': args.geo_max
+        },
+        'results': results
+    }
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output)
+        print(f'📄 结果已保存到: {args.output}', file=sys.stderr)
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
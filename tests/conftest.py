@@ -0,0 +1,58 @@
+import json
+import os
+import sys
+import threading
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import autoip6  # noqa: E402
+
+
+@pytest.fixture
+def make_collector(tmp_path, monkeypatch):
+    """在临时目录中创建 CFIPCollector：不读写仓库目录下的缓存、历史记录和结果文件"""
+    monkeypatch.chdir(tmp_path)
+    collectors = []
+
+    def factory(urls=(), **sections):
+        config = {
+            'cache_settings': {
+                'cache_folder': str(tmp_path / '.cache'),
+                'enable_geo_cache': False,
+                'enable_source_state': False,
+                'enable_history': False
+            },
+            'progress_settings': {'show_progress': False}
+        }
+        for section, values in sections.items():
+            config.setdefault(section, {}).update(values)
+        (tmp_path / 'config.json').write_text(json.dumps(config), encoding='utf-8')
+        (tmp_path / 'urls.json').write_text(json.dumps({'url_sources': list(urls)}), encoding='utf-8')
+        collector = autoip6.CFIPCollector(str(tmp_path / 'urls.json'), str(tmp_path / 'config.json'))
+        collectors.append(collector)
+        return collector
+
+    yield factory
+    for collector in collectors:
+        collector.close()
+
+
+@pytest.fixture
+def http_server():
+    """在后台线程启动 ThreadingHTTPServer，返回 http://127.0.0.1:端口"""
+    servers = []
+
+    def start(handler_class):
+        server = ThreadingHTTPServer(('127.0.0.1', 0), handler_class)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return f'http://127.0.0.1:{server.server_port}'
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,142 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler
+
+import pytest
+
+import autoip6
+
+
+def make_limiter(**kwargs):
+    settings = dict(initial=4, min_limit=1, max_limit=8, latency_target=1.0)
+    settings.update(kwargs)
+    return autoip6.AdaptiveLimiter(**settings)
+
+
+def test_initial_limit_is_clamped():
+    assert make_limiter(initial=100).limit == 8
+    assert make_limiter(initial=0).limit == 1
+
+
+def test_additive_increase():
+    limiter = make_limiter()
+    for _ in range(4):
+        limiter.acquire()
+    for _ in range(4):
+        limiter.release(False, 0.1)
+    assert limiter.limit == pytest.approx(5, abs=0.1)
+    assert limiter.in_flight == 0
+
+
+def test_multiplicative_decrease_once_per_burst():
+    limiter = make_limiter(initial=8)
+    for _ in range(3):
+        limiter.acquire()
+    # 同一批并发请求连续被限流，只减半一次
+    for _ in range(3):
+        limiter.release(True, 0.5)
+    assert limiter.limit == 4
+
+
+def test_slow_responses_count_as_throttled():
+    limiter = make_limiter(initial=8, latency_target=0.2)
+    limiter.acquire()
+    limiter.release(False, 0.5)
+    assert limiter.limit == 4
+
+
+def test_limit_never_below_minimum():
+    limiter = make_limiter(initial=2, min_limit=2)
+    limiter.acquire()
+    limiter.release(True, 0.1)
+    assert limiter.limit == 2
+
+
+def test_acquire_blocks_at_limit():
+    limiter = make_limiter(initial=2, max_limit=2)
+    limiter.acquire()
+    limiter.acquire()
+    acquired = threading.Event()
+    thread = threading.Thread(target=lambda: (limiter.acquire(), acquired.set()), daemon=True)
+    thread.start()
+    assert not acquired.wait(0.1)
+    limiter.release(False, 0.01)
+    assert acquired.wait(1)
+    thread.join(1)
+
+
+def test_token_bucket_rate():
+    limiter = make_limiter(initial=8, rate=20)
+    start = time.monotonic()
+    for _ in range(30):
+        limiter.acquire()
+        limiter.release(False, 0.0)
+    # 桶容量 20，之后每个令牌 1/20 秒
+    assert time.monotonic() - start >= 0.4
+
+
+def test_acquire_async(make_collector):
+    collector = make_collector()
+    limiter = make_limiter(initial=1, max_limit=1)
+    asyncio = autoip6.asyncio
+    active = []
+
+    async def worker():
+        await limiter.acquire_async()
+        active.append(limiter.in_flight)
+        await asyncio.sleep(0.01)
+        limiter.release(False, 0.01)
+
+    async def run():
+        await asyncio.gather(*(worker() for _ in range(5)))
+
+    collector.run_async(run())
+    assert active == [1] * 5
+    assert limiter.in_flight == 0
+
+
+def test_slot_released_when_lookup_raises(make_collector, monkeypatch):
+    collector = make_collector()
+    collector.limiter = make_limiter(initial=1, max_limit=1)
+
+    def broken_lookup(ip, providers=None):
+        raise RuntimeError('provider crashed')
+
+    monkeypatch.setattr(collector, 'get_location', broken_lookup)
+    for _ in range(2):
+        with pytest.raises(RuntimeError):
+            collector.process_single_ip('104.16.0.1')
+    assert collector.limiter.in_flight == 0
+
+
+class ListJsonHandler(BaseHTTPRequestHandler):
+    """对所有请求返回合法但不是对象的JSON"""
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self):
+        body = json.dumps(['104.16.0.1', 'unexpected']).encode()
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self.reply()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        self.reply()
+
+
+def test_providers_treat_non_object_json_as_failure(make_collector, http_server):
+    base_url = http_server(ListJsonHandler)
+    collector = make_collector(location_settings={'baidu_api_url': base_url + '/api.php'})
+    ipinfo = autoip6.IpinfoProvider(collector, {'url': base_url + '/{ip}', 'batch_url': base_url + '/batch'})
+    ipapi = autoip6.IpApiProvider(collector, {'url': base_url})
+    for provider in (ipinfo, ipapi, autoip6.BaiduProvider(collector, {})):
+        assert provider.query('104.16.0.1') == ('未知', False, False)
+    assert ipinfo.query_batch(['104.16.0.1']) == {}
+    assert ipapi.parse('unexpected') == ('未知', False, False)
@@ -0,0 +1,33 @@
+import pytest
+
+RESULTS = [('104.16.0.1', '美国'), ('104.16.0.2', '美国')]
+
+
+@pytest.fixture
+def collector(make_collector):
+    return make_collector(location_settings={'api_test': 'traffic'})
+
+
+def test_cache_hits_are_not_traffic(collector):
+    # 结果全部来自缓存，没有调用 update_progress
+    collector.check_api_traffic(RESULTS, [])
+    assert collector.run_report.api_check == {'mode': 'traffic', 'status': 'no_traffic', 'located': 0, 'total': 0}
+
+
+@pytest.mark.parametrize('lookups, status, located', [
+    ([True, False, True], 'ok', 2),
+    ([False, False], 'failed', 0),
+])
+def test_counts_network_lookups_only(collector, lookups, status, located):
+    for success in lookups:
+        collector.update_progress(success)
+    collector.check_api_traffic(RESULTS * 50, [])
+    assert collector.run_report.api_check == {
+        'mode': 'traffic', 'status': status, 'located': located, 'total': len(lookups)
+    }
+
+
+def test_skipped_without_results(collector):
+    collector.update_progress(True)
+    collector.check_api_traffic([], [])
+    assert collector.run_report.api_check is None
@@ -0,0 +1,95 @@
+import json
+import os
+import subprocess
+import sys
+from datetime import datetime, timedelta
+
+import pytest
+
+SCRIPTS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '.github', 'scripts')
+sys.path.insert(0, SCRIPTS_DIR)
+
+import autoip6  # noqa: E402
+import cleanup_old_files  # noqa: E402
+
+
+def write_run_file(base_dir, date, lines=('104.16.0.1:443#日本',)):
+    path = base_dir / f'non_us_ips_{date}_120000.txt'
+    path.write_text('# 注释\n' + '\n'.join(lines) + '\n', encoding='utf-8')
+    return path
+
+
+def days_ago(days):
+    return (datetime.now() - timedelta(days=days)).strftime('%Y%m%d')
+
+
+def manifest_files(base_dir):
+    return json.loads((base_dir / 'manifest.json').read_text(encoding='utf-8'))['files']
+
+
+def test_rebuilt_manifest_is_saved_when_nothing_expires(tmp_path):
+    write_run_file(tmp_path, days_ago(1))
+    assert cleanup_old_files.cleanup_old_files(7, base_dir=str(tmp_path)) == 0
+    assert list(manifest_files(tmp_path)) == [f'non_us_ips_{days_ago(1)}_120000.txt']
+
+
+def test_cutoff_keeps_datetime_semantics(tmp_path):
+    # 与原来的 datetime 比较一致：retention_days 天前当天的文件已过期，之后一天的保留
+    expired = write_run_file(tmp_path, days_ago(7))
+    kept = write_run_file(tmp_path, days_ago(6))
+    assert cleanup_old_files.cleanup_old_files(7, base_dir=str(tmp_path)) == 1
+    assert not expired.exists()
+    assert kept.exists()
+    assert list(manifest_files(tmp_path)) == [kept.name]
+
+
+def test_prune_history_uses_history_store(tmp_path):
+    db_path = str(tmp_path / 'history.db')
+    store = autoip6.HistoryStore(db_path)
+    store.record_run([('104.16.0.1', 4, '日本'), ('2606:4700::1', 6, '日本')], {}, lambda location: False)
+    store.close()
+    assert cleanup_old_files.prune_history(db_path, retention_days=1) == 0
+    assert cleanup_old_files.prune_history(db_path, retention_days=-1) == 2
+    store = autoip6.HistoryStore(db_path)
+    assert store.query(0) == []
+    store.close()
+
+
+def test_writer_reconciles_missing_manifest(make_collector, tmp_path):
+    collector = make_collector()
+    folder = tmp_path / collector.config['output_settings']['non_us_folder']
+    folder.mkdir()
+    old = write_run_file(folder, days_ago(2))
+    new = write_run_file(folder, days_ago(0), ['104.16.0.1:443#日本', '104.16.0.2:443#日本'])
+    collector.update_non_us_manifest(str(new), days_ago(0), 2)
+    files = manifest_files(folder)
+    assert sorted(files) == sorted([old.name, new.name])
+    assert files[new.name]['ip_count'] == 2
+    assert files[old.name] == {'date': days_ago(2), 'kind': 'run', 'size': old.stat().st_size, 'ip_count': 1}
+
+
+def run_without_requests(script, cwd):
+    """在没有 requests 的环境中运行脚本（模拟合并工作流），返回 (退出码, 输出)"""
+    code = (
+        'import runpy, sys\n'
+        "sys.modules['requests'] = None\n"
+        f'sys.path.insert(0, {SCRIPTS_DIR!r})\n'
+        f'sys.argv = [{script!r}]\n'
+        f'runpy.run_path({script!r}, run_name="__main__")\n'
+    )
+    result = subprocess.run([sys.executable, '-c', code], cwd=cwd, capture_output=True, text=True)
+    return result.returncode, result.stdout + result.stderr
+
+
+@pytest.mark.parametrize('with_history', [False, True])
+def test_cleanup_runs_without_collector_dependencies(tmp_path, with_history):
+    script = os.path.join(SCRIPTS_DIR, 'cleanup_old_files.py')
+    (tmp_path / 'non_us_ips').mkdir()
+    old = write_run_file(tmp_path / 'non_us_ips', days_ago(30))
+    if with_history:
+        (tmp_path / '.cache').mkdir()
+        autoip6.HistoryStore(str(tmp_path / '.cache' / 'history.db')).close()
+    returncode, output = run_without_requests(script, tmp_path)
+    assert returncode == 0, output
+    assert not old.exists()
+    assert '跳过历史记录清理' in output
@@ -0,0 +1,61 @@
+import time
+
+
+def count_rows(store, table):
+    with store.lock:
+        return store.conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+
+
+def test_daemon_prunes_caches_between_cycles(make_collector, monkeypatch):
+    collector = make_collector(
+        ['http://127.0.0.1:9/ips.txt'],
+        cache_settings={'enable_geo_cache': True, 'enable_history': True, 'history_retention_days': 1},
+        daemon_settings={'interval': 0, 'status_port': 0, 'prune_interval': 0}
+    )
+    monkeypatch.setattr(collector, 'test_baidu_api', lambda: None)
+    expired = time.time() - 30 * 86400
+    cycles = []
+
+    def fake_cycle(report):
+        cycles.append((count_rows(collector.geo_cache, 'geo_cache'), count_rows(collector.history, 'runs')))
+        if len(cycles) == 3:
+            raise KeyboardInterrupt
+        # 第一轮写入已过期的缓存和历史记录，第二轮开始前应已被清理
+        collector.geo_cache.set_many([('104.16.0.1', '美国', True)])
+        with collector.geo_cache.lock:
+            collector.geo_cache.conn.execute('UPDATE geo_cache SET updated_at = ?', (expired,))
+            collector.geo_cache.conn.commit()
+        with collector.history.lock:
+            collector.history.conn.execute(
+                'INSERT INTO runs (seen_at, ipv4_count, ipv6_count) VALUES (?, 0, 0)', (expired,)
+            )
+            collector.history.conn.commit()
+        cycles.append((count_rows(collector.geo_cache, 'geo_cache'), count_rows(collector.history, 'runs')))
+        return report
+
+    monkeypatch.setattr(collector, 'run_cycle', fake_cycle)
+    try:
+        collector.run_daemon()
+    except KeyboardInterrupt:
+        pass
+    assert cycles == [(0, 0), (1, 1), (0, 0)]
+
+
+def test_daemon_skips_prune_before_interval(make_collector, monkeypatch):
+    collector = make_collector(
+        ['http://127.0.0.1:9/ips.txt'],
+        daemon_settings={'interval': 0, 'status_port': 0}
+    )
+    monkeypatch.setattr(collector, 'test_baidu_api', lambda: None)
+    prunes = []
+    monkeypatch.setattr(collector, 'prune_stores', lambda: prunes.append(time.time()))
+
+    def fake_cycle(report):
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(collector, 'run_cycle', fake_cycle)
+    try:
+        collector.run_daemon()
+    except KeyboardInterrupt:
+        pass
+    assert prunes == []
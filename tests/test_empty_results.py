@@ -0,0 +1,15 @@
+import autoip6
+
+
+def test_empty_cycle_replaces_stale_results(make_collector, tmp_path):
+    collector = make_collector(location_settings={'enable_location_query': False})
+    (tmp_path / 'ip.txt').write_text('# 旧结果\n\n104.16.0.1:443#日本\n', encoding='utf-8')
+    (tmp_path / 'ipv6.txt').write_text('[2606:4700::1]:443#日本-IPV6\n', encoding='utf-8')
+
+    collector.run_cycle(autoip6.RunReport())
+
+    for filename in ('ip.txt', 'ipv6.txt'):
+        text = (tmp_path / filename).read_text(encoding='utf-8')
+        assert '# 总数: 0, 美国: 0, 非美国: 0' in text
+        assert collector.read_payload_lines(str(tmp_path / filename)) == []
+    assert collector.current_results()[1] == []
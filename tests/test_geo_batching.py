@@ -0,0 +1,184 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler
+
+import pytest
+
+import autoip6
+
+IP_COUNT = 600
+
+
+class SourceHandler(BaseHTTPRequestHandler):
+    """数据源：/ 返回 IP_COUNT 个地址，每行一个"""
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        body = '\n'.join(f'104.{16 + i // 65536}.{i // 256 % 256}.{i % 256}' for i in range(IP_COUNT)).encode()
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def make_ipapi_handler(batch_sizes, single_lookups):
+    """ip-api 风格的 /batch 与 /json/<ip> 接口，记录每个批次的大小"""
+    lock = threading.Lock()
+
+    class IpApiHandler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def reply(self, payload):
+            body = json.dumps(payload).encode()
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            ips = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+            with lock:
+                batch_sizes.append(len(ips))
+            time.sleep(0.02)
+            self.reply([{'status': 'success', 'country': '美国', 'query': ip} for ip in ips])
+
+        def do_GET(self):
+            with lock:
+                single_lookups.append(self.path)
+            self.reply({'status': 'success', 'country': '美国'})
+
+    return IpApiHandler
+
+
+def run_engine(collector, engine):
+    """按 run_cycle 的方式执行一种并发引擎的获取和查询阶段，返回IPv4查询结果"""
+    if engine == 'async':
+        return collector.run_async(collector.collect_async())[2]
+    if engine == 'pipeline':
+        return collector.collect_pipelined()[2]
+    ipv4, ipv6 = collector.process_urls_parallel()
+    return collector.query_ips_parallel(ipv4, False)
+
+
+@pytest.mark.parametrize('engine', ['thread', 'async', 'pipeline'])
+def test_batches_fill_up_for_each_engine(engine, make_collector, http_server):
+    if engine == 'async' and autoip6.aiohttp is None:
+        pytest.skip('aiohttp 未安装')
+    batch_sizes, single_lookups = [], []
+    source_url = http_server(SourceHandler)
+    api_url = http_server(make_ipapi_handler(batch_sizes, single_lookups))
+    collector = make_collector(
+        [source_url + '/'],
+        request_settings={'engine': engine},
+        location_settings={
+            'providers': [{'type': 'ipapi', 'url': api_url, 'batch': True}],
+            'batch_size': 100,
+            'batch_flush_interval': 0.5
+        }
+    )
+
+    start = time.perf_counter()
+    ipv4_results = run_engine(collector, engine)
+    elapsed = time.perf_counter() - start
+
+    assert len(ipv4_results) == IP_COUNT
+    assert all(location == '美国' for ip, location in ipv4_results)
+    assert sum(batch_sizes) == IP_COUNT
+    assert not single_lookups
+    # 600 个地址应合并成约 6 个满批次，而不是受并发线程数（15）限制的小批次
+    assert len(batch_sizes) <= 8, batch_sizes
+    assert max(batch_sizes) == 100
+    assert elapsed < 5
+
+
+class FakeProvider(autoip6.GeoProvider):
+    """记录批量与单个查询的后端，missing 中的IP不出现在批量结果里"""
+
+    name = 'fake'
+    supports_batch = True
+
+    def __init__(self, missing=(), fail=False, single_delay=0, max_concurrency=None):
+        super().__init__(None, {'max_concurrency': max_concurrency} if max_concurrency else {})
+        self.missing = set(missing)
+        self.fail = fail
+        self.single_delay = single_delay
+        self.batches = []
+        self.singles = []
+        self.lock = threading.Lock()
+
+    def query_batch(self, ips):
+        with self.lock:
+            self.batches.append(list(ips))
+        if self.fail:
+            raise RuntimeError('batch endpoint down')
+        return {ip: ('日本', True, False) for ip in ips if ip not in self.missing}
+
+    def query(self, ip):
+        with self.lock:
+            self.singles.append(ip)
+        time.sleep(self.single_delay)
+        return '香港', True, False
+
+
+def ips(count):
+    return [f'104.16.0.{i}' for i in range(count)]
+
+
+def test_partial_batch_flushed_after_interval():
+    provider = FakeProvider()
+    batcher = autoip6.GeoBatcher(provider, batch_size=100, flush_interval=0.1)
+    start = time.monotonic()
+    futures = [batcher.submit(ip) for ip in ips(5)]
+    for future in futures:
+        future.result(timeout=2)
+    assert 0.1 <= time.monotonic() - start < 1
+    assert provider.batches == [ips(5)]
+    batcher.close()
+
+
+def test_flush_and_close_send_pending_immediately():
+    provider = FakeProvider()
+    batcher = autoip6.GeoBatcher(provider, batch_size=100, flush_interval=60)
+    futures = [batcher.submit(ip) for ip in ips(3)]
+    batcher.flush()
+    assert [future.result(timeout=1)[0] for future in futures] == ['日本'] * 3
+    future = batcher.submit('104.16.0.9')
+    batcher.close()
+    assert future.result(timeout=0) == ('日本', True, False)
+    assert batcher.batches == 2
+
+
+def test_missing_results_fall_back_to_single_lookup():
+    provider = FakeProvider(missing={'104.16.0.1'})
+    batcher = autoip6.GeoBatcher(provider, batch_size=3, flush_interval=60)
+    results = [future.result(timeout=1) for future in [batcher.submit(ip) for ip in ips(3)]]
+    assert results[1] == ('香港', True, False)
+    assert provider.singles == ['104.16.0.1']
+    assert batcher.fallbacks == 1
+    batcher.close()
+
+
+def test_fallback_lookups_run_concurrently():
+    provider = FakeProvider(fail=True, single_delay=0.2, max_concurrency=10)
+    batcher = autoip6.GeoBatcher(provider, batch_size=20, flush_interval=60, workers=1, fallback_workers=10)
+    start = time.monotonic()
+    results = [future.result(timeout=5) for future in [batcher.submit(ip) for ip in ips(20)]]
+    elapsed = time.monotonic() - start
+    assert results == [('香港', True, False)] * 20
+    assert batcher.fallbacks == 20
+    # 串行回退需要 20 * 0.2 = 4 秒，10 路并发约 0.4 秒
+    assert elapsed < 1.5, elapsed
+    batcher.close()
+
+
+def test_failed_batch_without_fallback():
+    provider = FakeProvider(fail=True)
+    batcher = autoip6.GeoBatcher(provider, batch_size=2, flush_interval=60, fallback_single=False)
+    results = [future.result(timeout=1) for future in [batcher.submit(ip) for ip in ips(2)]]
+    assert results == [('未知', False, False)] * 2
+    assert provider.singles == []
+    batcher.close()
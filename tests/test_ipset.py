@@ -0,0 +1,63 @@
+import pytest
+
+import autoip6
+
+
+@pytest.fixture(params=['numpy', 'array'])
+def backend(request, monkeypatch):
+    """分别测试 NumPy 和 array 两种存储"""
+    if request.param == 'numpy':
+        if autoip6.np is None:
+            pytest.skip('NumPy 未安装')
+    else:
+        monkeypatch.setattr(autoip6, 'np', None)
+    return request.param
+
+
+def test_dedup_and_numeric_order(backend):
+    ips = autoip6.IPSet(4, ['104.16.0.10', '104.16.0.2', '1.1.1.1', '104.16.0.2', 'bad', '2606:4700::1'])
+    assert list(ips) == ['1.1.1.1', '104.16.0.2', '104.16.0.10']
+    assert len(ips) == 3
+
+
+def test_ipv6_values(backend):
+    ips = autoip6.IPSet(6, ['2606:4700::10', '2606:4700:0:0::2', '2400:cb00::1', '104.16.0.1'])
+    assert list(ips) == ['2400:cb00::1', '2606:4700::2', '2606:4700::10']
+    assert ips.values()[0] == int(autoip6.ipaddress.IPv6Address('2400:cb00::1'))
+
+
+def test_membership(backend):
+    ips = autoip6.IPSet(6, ['2606:4700::1'])
+    ips.add('2606:4700::2')
+    assert '2606:4700::2' in ips
+    assert '2606:4700:0::1' in ips
+    assert '2606:4700::3' not in ips
+    assert '104.16.0.1' not in ips
+    assert 'not-an-ip' not in ips
+
+
+@pytest.mark.parametrize('version, left, right', [
+    (4, ['104.16.0.1', '104.16.0.2', '104.16.0.3'], ['104.16.0.2', '104.16.0.4']),
+    (6, ['2606:4700::1', '2606:4700::2', 'ffff::1'], ['2606:4700::2', '::1']),
+])
+def test_set_operations_match_builtin_sets(backend, version, left, right):
+    a, b = autoip6.IPSet(version, left), autoip6.IPSet(version, right)
+    as_set = lambda ips: {autoip6.ipaddress.ip_address(ip) for ip in ips}
+    assert as_set(a | b) == as_set(left) | as_set(right)
+    assert as_set(a & b) == as_set(left) & as_set(right)
+    assert as_set(a - b) == as_set(left) - as_set(right)
+
+
+def test_update_values_and_group_by_prefix(backend):
+    ips = autoip6.IPSet(4)
+    ips.update_values([(104 << 24) | (16 << 16) | 5, (104 << 24) | (16 << 16) | 300, (104 << 24) | (16 << 16) | 5])
+    assert ips.group_by_prefix(24) == {
+        autoip6.ipaddress.IPv4Network('104.16.0.0/24'): ['104.16.0.5'],
+        autoip6.ipaddress.IPv4Network('104.16.1.0/24'): ['104.16.1.44'],
+    }
+
+
+def test_sort_key():
+    assert sorted(['2606:4700::1', 'junk', '104.16.0.10', '104.16.0.9'], key=autoip6.IPSet.sort_key) == [
+        '104.16.0.9', '104.16.0.10', '2606:4700::1', 'junk'
+    ]
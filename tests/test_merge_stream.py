@@ -0,0 +1,59 @@
+import io
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '.github', 'scripts'))
+
+import merge_non_us_ips  # noqa: E402
+
+
+def merge(*runs):
+    output = io.StringIO()
+    encoded = [sorted(merge_non_us_ips.encode_sorted_line(line) for line in run) for run in runs]
+    count = merge_non_us_ips.merge_sorted_runs([iter(run) for run in encoded], output)
+    lines = output.getvalue().splitlines()
+    assert count == len(lines)
+    return lines
+
+
+def test_dedup_keyed_on_address():
+    assert merge(
+        ['104.16.0.2:8443#日本', '104.16.0.1:8443#日本'],
+        ['104.16.0.1:8443#新加坡', '104.16.0.1:443#日本', '[2606:4700::1]:8443#日本-IPV6'],
+        ['[2606:4700::1]:443#香港-IPV6', '104.16.0.10:8443#日本'],
+    ) == ['104.16.0.1:8443#日本', '104.16.0.2:8443#日本', '104.16.0.10:8443#日本', '[2606:4700::1]:8443#日本-IPV6']
+
+
+def test_unparseable_lines_dedup_on_whole_line():
+    assert merge(['bad.line#x', 'other.line#y'], ['bad.line#x']) == ['bad.line#x', 'other.line#y']
+
+
+def write_run_file(folder, date, index, lines):
+    path = folder / f'non_us_ips_{date}_{index:06d}.txt'
+    path.write_text('# 非美国区域Cloudflare IP收集\n\n' + ''.join(line + '\n' for line in lines), encoding='utf-8')
+
+
+def test_stream_merge_keeps_existing_lines(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    folder = tmp_path / 'non_us_ips'
+    folder.mkdir()
+    write_run_file(folder, '20260101', 1, ['104.16.0.1:8443#日本'])
+    assert merge_non_us_ips.merge_and_deduplicate_ips_stream('20260101')
+    write_run_file(folder, '20260101', 2, ['104.16.0.1:8443#新加坡', '104.16.0.2:8443#日本'])
+    assert merge_non_us_ips.merge_and_deduplicate_ips_stream('20260101')
+    merged = folder / 'merged' / 'merged_ips_2026-01-01.txt'
+    body = [line for line in merged.read_text(encoding='utf-8').splitlines() if line and not line.startswith('#')]
+    assert body == ['104.16.0.1:8443#日本', '104.16.0.2:8443#日本']
+
+
+def test_exit_code_nonzero_when_any_date_fails(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    folder = tmp_path / 'non_us_ips'
+    folder.mkdir()
+    write_run_file(folder, '20260101', 1, ['104.16.0.1:8443#日本'])
+    monkeypatch.setattr(sys, 'argv', ['merge_non_us_ips.py', '--stream', '--workers', '2', '20260101', '20260102'])
+    with pytest.raises(SystemExit) as exc_info:
+        merge_non_us_ips.main()
+    assert exc_info.value.code == 1
@@ -0,0 +1,69 @@
+import socket
+
+import pytest
+
+import autoip6
+
+
+@pytest.fixture
+def collector(make_collector):
+    return make_collector(probe_settings={'samples': 3, 'timeout': 1, 'concurrency': 4})
+
+
+@pytest.fixture
+def tcp_server(collector):
+    """在收集器的事件循环中启动 asyncio TCP 服务器，返回 (端口, 已接受的连接数列表)"""
+    accepted = []
+
+    async def handle(reader, writer):
+        accepted.append(writer.get_extra_info('peername'))
+        writer.close()
+
+    server = collector.run_async(autoip6.asyncio.start_server(handle, '127.0.0.1', 0))
+    yield server.sockets[0].getsockname()[1], accepted
+    server.close()
+    collector.run_async(server.wait_closed())
+
+
+def closed_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def test_measure_tcp_latency_open_port(collector, tcp_server):
+    port, accepted = tcp_server
+    stats = collector.run_async(autoip6.measure_tcp_latency('127.0.0.1', port, samples=3, timeout=1))
+    assert stats['loss'] == 0
+    assert 0 <= stats['min'] <= stats['median'] < 1000
+    collector.run_async(autoip6.asyncio.sleep(0.05))
+    assert len(accepted) == 3
+
+
+def test_measure_tcp_latency_closed_port(collector):
+    stats = collector.run_async(autoip6.measure_tcp_latency('127.0.0.1', closed_port(), samples=2, timeout=1))
+    assert stats == {'min': None, 'median': None, 'loss': 1.0}
+
+
+def test_probe_ips(collector, tcp_server):
+    port, accepted = tcp_server
+    collector.config['probe_settings']['port'] = port
+    stats = collector.probe_ips(['127.0.0.1'], ['::1'] if socket.has_ipv6 else [])
+    assert stats['127.0.0.1']['loss'] == 0
+    assert stats['127.0.0.1']['median'] is not None
+    if socket.has_ipv6:
+        # 服务器只监听 IPv4，IPv6 地址全部失败
+        assert stats['::1'] == {'min': None, 'median': None, 'loss': 1.0}
+
+
+def test_probe_results_rank_output(collector, tcp_server, tmp_path):
+    port, _ = tcp_server
+    collector.config['probe_settings']['port'] = port
+    # 服务器只监听 127.0.0.1，127.0.0.2 不可连接，不出现在排名中
+    collector.latency_stats = collector.probe_ips(['127.0.0.1', '127.0.0.2'])
+    assert collector.latency_stats['127.0.0.2']['loss'] == 1.0
+    filename = tmp_path / 'ranked.txt'
+    collector.save_ranked_results([('127.0.0.1', '本地', False), ('127.0.0.2', '本地', False)], str(filename))
+    body = [line for line in filename.read_text(encoding='utf-8').splitlines() if line and not line.startswith('#')]
+    assert len(body) == 1
+    assert body[0].startswith('127.0.0.1:')
@@ -0,0 +1,42 @@
+import pytest
+
+import autoip6
+
+
+class FakeResponse:
+    def __init__(self, status_code):
+        self.status_code = status_code
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class FakeSession:
+    def __init__(self, statuses):
+        self.responses = [FakeResponse(status) for status in statuses]
+        self.calls = 0
+
+    def request(self, method, url, **kwargs):
+        response = self.responses[self.calls]
+        self.calls += 1
+        return response
+
+
+@pytest.mark.parametrize('stream', [False, True])
+def test_retryable_responses_are_closed(make_collector, monkeypatch, stream):
+    collector = make_collector(request_settings={'retry_times': 3, 'retry_delay': 0})
+    fake = FakeSession([503, 429, 200])
+    monkeypatch.setattr(autoip6.CFIPCollector, 'session', fake)
+    response = collector.request_with_retry('http://example.invalid/', stream=stream)
+    assert response is fake.responses[2]
+    assert [r.closed for r in fake.responses] == [True, True, False]
+
+
+def test_last_attempt_is_returned_open(make_collector, monkeypatch):
+    collector = make_collector(request_settings={'retry_times': 1, 'retry_delay': 0})
+    fake = FakeSession([503, 503])
+    monkeypatch.setattr(autoip6.CFIPCollector, 'session', fake)
+    response = collector.request_with_retry('http://example.invalid/')
+    assert response.status_code == 503
+    assert [r.closed for r in fake.responses] == [True, False]
@@ -0,0 +1,71 @@
+import time
+from http.server import BaseHTTPRequestHandler
+
+import pytest
+
+URL = 'http://example.invalid/list.txt'
+
+
+@pytest.fixture
+def collector(make_collector):
+    collector = make_collector(
+        [URL],
+        cache_settings={'enable_source_state': True},
+        request_settings={'timeout': 10, 'retry_times': 0}
+    )
+    collector.source_state.update(URL, ipv4=['104.16.0.1'], ipv6=[], health={'runs': 5, 'latency_ewma': 2.0})
+    return collector
+
+
+def test_not_modified_does_not_shrink_timeout(collector):
+    assert collector.source_timeout(URL) == 6
+    for _ in range(10):
+        collector.extract_source_ips(URL, {'not_modified': True, 'size': 0, 'elapsed': 0.01})
+    assert collector.source_timeout(URL) == 6
+    assert collector.source_health(URL)['runs'] == 15
+
+
+def test_full_fetch_updates_latency(collector):
+    collector.record_source_health(URL, True, 1.0)
+    assert collector.source_health(URL)['latency_ewma'] == pytest.approx(1.7)
+
+
+def test_timeout_backs_off_up_to_global_timeout(collector):
+    collector.record_source_health(URL, False, timed_out=True)
+    assert collector.source_timeout(URL) == pytest.approx(10)
+    collector.record_source_health(URL, False, timed_out=True)
+    assert collector.source_timeout(URL) == pytest.approx(10)
+
+
+def test_other_failures_keep_timeout(collector):
+    collector.record_source_health(URL, False)
+    assert collector.source_timeout(URL) == 6
+
+
+class SlowHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        # 先返回响应头再卡住正文，读超时发生在读取正文阶段
+        self.send_response(200)
+        self.send_header('Content-Length', '11')
+        self.end_headers()
+        self.wfile.flush()
+        time.sleep(1)
+        self.wfile.write(b'104.16.0.1\n')
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.mark.parametrize('stream_fetch', [False, True])
+def test_fetch_timeout_raises_source_timeout(make_collector, http_server, stream_fetch):
+    url = http_server(SlowHandler) + '/list.txt'
+    collector = make_collector(
+        [url],
+        cache_settings={'enable_source_state': True},
+        request_settings={'timeout': 2, 'retry_times': 0, 'stream_fetch': stream_fetch},
+        source_settings={'min_timeout': 0.2, 'timeout_multiplier': 2}
+    )
+    collector.source_state.update(url, health={'runs': 5, 'latency_ewma': 0.15})
+    assert collector.source_timeout(url) == pytest.approx(0.3)
+    assert collector.fetch_source(url) is None
+    assert collector.source_timeout(url) == pytest.approx(0.6)
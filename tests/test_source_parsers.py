@@ -0,0 +1,123 @@
+import pytest
+
+import autoip6
+
+
+@pytest.mark.parametrize('raw, expected', [
+    ({'latency': '8.5'}, {'latency': 8.5}),
+    ({'latency': '120'}, {'latency': 120.0}),
+    ({'latency': '63.21ms'}, {'latency': 63.21}),
+    ({'latency': '63.21 ms'}, {'latency': 63.21}),
+    ({'latency': '0.5s'}, {'latency': 500.0}),
+    ({'latency': '1.2秒'}, {'latency': 1200.0}),
+    ({'latency': 42}, {'latency': 42.0}),
+    ({'latency': 'n/a'}, {}),
+    ({'loss': '1'}, {'loss': 0.01}),
+    ({'loss': '0.00%'}, {'loss': 0.0}),
+    ({'loss': '25%'}, {'loss': 0.25}),
+    ({'loss': 100}, {'loss': 1.0}),
+    ({'colo': ' HKG ', 'line': '电信', 'speed': '12.3MB/s'}, {'colo': 'HKG', 'line': '电信', 'speed': '12.3MB/s'}),
+    ({'ip': '104.16.0.1', 'colo': '', 'line': None}, {}),
+])
+def test_normalize_meta(raw, expected):
+    assert autoip6.normalize_meta(raw) == expected
+
+
+@pytest.mark.parametrize('name, field', [
+    ('网络延迟', 'latency'),
+    ('Latency(ms)', 'latency'),
+    ('丢包率', 'loss'),
+    ('下载速度', 'speed'),
+    ('数据中心', 'colo'),
+    ('线路名称', 'line'),
+    ('优选地址', 'ip'),
+    ('IP', 'ip'),
+    ('ipAddress', 'ip'),
+    ('description', None),
+    ('更新时间', None),
+])
+def test_meta_field(name, field):
+    assert autoip6.meta_field(name) == field
+
+
+def parse(parser_class, text, chunk_size=None):
+    parser = parser_class()
+    if chunk_size:
+        for start in range(0, len(text), chunk_size):
+            parser.feed(text[start:start + chunk_size])
+    else:
+        parser.feed(text)
+    return parser.close()
+
+
+TABLE_PAGE = (
+    '<html><script>var ip = "9.9.9.9";</script><p>104.16.9.9</p><table>'
+    '<tr><th>线路名称</th><th>优选地址</th><th>网络延迟</th><th>下载速度</th><th>数据中心</th><th>更新时间</th></tr>'
+    '<tr><td>电信</td><td>104.17.0.1</td><td>50.5ms</td><td>10MB/s</td><td>HKG</td><td>2026-10-18 12:00:00</td></tr>'
+    '<tr><td>联通</td><td>2606:4700::1</td><td>80</td><td>5MB/s</td><td>NRT</td><td>2026-10-18 12:00:00</td></tr>'
+    '</table></html>'
+)
+
+
+@pytest.mark.parametrize('chunk_size', [None, 7])
+def test_html_table_parser_reads_header_columns(chunk_size):
+    rows = parse(autoip6.HTMLTableParser, TABLE_PAGE, chunk_size)
+    assert rows == [
+        ('104.17.0.1', {'line': '电信', 'latency': 50.5, 'speed': '10MB/s', 'colo': 'HKG'}),
+        ('2606:4700::1', {'line': '联通', 'latency': 80.0, 'speed': '5MB/s', 'colo': 'NRT'}),
+    ]
+
+
+def test_html_table_parser_without_header_keeps_address_cells():
+    rows = parse(autoip6.HTMLTableParser, '<table><tr><td>104.16.0.1</td><td>foo</td></tr></table>')
+    assert rows == [('104.16.0.1', {})]
+
+
+@pytest.mark.parametrize('chunk_size', [None, 5])
+def test_line_list_parser(chunk_size):
+    text = '# comment\n104.18.0.1:443#SJC\n104.18.0.2\n[2606:4700::2]:443#LAX\n104.18.0.3,104.18.0.4\n'
+    rows = parse(autoip6.LineListParser, text, chunk_size)
+    assert rows == [
+        ('104.18.0.1:443', {'colo': 'SJC'}),
+        ('104.18.0.2', {}),
+        ('[2606:4700::2]:443', {'colo': 'LAX'}),
+        ('104.18.0.3', {}),
+        ('104.18.0.4', {}),
+    ]
+
+
+def test_line_list_parser_rejects_non_list_text():
+    assert parse(autoip6.LineListParser, 'hello world\nnothing here 104.16.0.1\nmore text\n') == []
+
+
+def test_json_parser():
+    text = '{"data": [{"ip": "104.19.0.1", "latency": "10ms", "colo": "FRA", "description": "x"}, "104.19.0.2"]}'
+    rows = sorted(parse(autoip6.JSONParser, text))
+    assert rows == [('104.19.0.1', {'latency': 10.0, 'colo': 'FRA'}), ('104.19.0.2', {})]
+
+
+def test_json_parser_invalid_json():
+    assert parse(autoip6.JSONParser, '{not json') == []
+
+
+@pytest.mark.parametrize('content_type, text, expected_ipv4', [
+    # 部分行不是以地址开头：解析器识别出的行之外的地址也要保留
+    ('text/plain', '104.16.1.1\n104.16.1.2\n104.16.1.5\n节点 104.16.1.3\nHK 104.16.1.4\n',
+     {'104.16.1.1', '104.16.1.2', '104.16.1.3', '104.16.1.4', '104.16.1.5'}),
+    # 表格之外的地址
+    ('text/html', TABLE_PAGE, {'9.9.9.9', '104.16.9.9', '104.17.0.1'}),
+])
+def test_parse_source_text_never_drops_regex_hits(make_collector, content_type, text, expected_ipv4):
+    collector = make_collector()
+    ipv4, ipv6, meta, parser = collector.parse_source_text('http://example.invalid/list', text, content_type)
+    assert ipv4 == expected_ipv4
+    assert parser != 'regex'
+
+
+def test_parse_source_text_attaches_metadata(make_collector):
+    collector = make_collector()
+    ipv4, ipv6, meta, parser = collector.parse_source_text('http://example.invalid/page', TABLE_PAGE, 'text/html')
+    assert parser == 'html_table'
+    assert ipv6 == {'2606:4700::1'}
+    assert meta['104.17.0.1']['colo'] == 'HKG'
+    assert meta['2606:4700::1']['latency'] == 80.0
@@ -0,0 +1,57 @@
+import hashlib
+
+import pytest
+
+import autoip6
+
+BODY = ('<table><tr><th>IP</th><th>延迟</th></tr>'
+        + ''.join(f'<tr><td>104.16.{i}.1</td><td>{i}ms</td></tr>' for i in range(50))
+        + '</table><p>IPv6:2606:4700::1 10.0.0.1</p>').encode()
+
+
+@pytest.fixture
+def extract(make_collector):
+    return make_collector().extract_ips_from_text
+
+
+def feed_all(extractor, data, chunk_size):
+    for start in range(0, len(data), chunk_size):
+        if not extractor.feed(data[start:start + chunk_size]):
+            return False
+    return True
+
+
+@pytest.mark.parametrize('chunk_size', [1, 5, 13, 4096])
+def test_chunked_scan_matches_whole_body(extract, chunk_size):
+    calls = []
+    extractor = autoip6.StreamingExtractor(extract, on_ips=lambda ipv4, ipv6: calls.append((set(ipv4), set(ipv6))))
+    assert feed_all(extractor, BODY, chunk_size)
+    digest = extractor.close()
+    expected = extract(BODY.decode())
+    assert (extractor.ipv4, extractor.ipv6) == expected
+    assert digest == hashlib.sha256(BODY).hexdigest()
+    assert extractor.size == len(BODY)
+    assert set().union(*(ipv4 for ipv4, ipv6 in calls)) == expected[0]
+
+
+def test_multibyte_characters_split_across_chunks(extract):
+    data = '节点：104.16.0.1，节点：2606:4700::1'.encode('utf-8')
+    extractor = autoip6.StreamingExtractor(extract)
+    assert feed_all(extractor, data, 1)
+    extractor.close()
+    assert (extractor.ipv4, extractor.ipv6) == ({'104.16.0.1'}, {'2606:4700::1'})
+
+
+def test_max_bytes_truncates(extract):
+    extractor = autoip6.StreamingExtractor(extract, max_bytes=100)
+    assert not feed_all(extractor, BODY, 64)
+    assert extractor.truncated
+
+
+def test_parser_receives_decoded_text(extract):
+    extractor = autoip6.StreamingExtractor(extract, parser=autoip6.HTMLTableParser())
+    assert feed_all(extractor, BODY, 7)
+    extractor.close()
+    rows = extractor.parser.close()
+    assert len(rows) == 50
+    assert rows[3] == ('104.16.3.1', {'latency': 3.0})
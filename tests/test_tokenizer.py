@@ -0,0 +1,83 @@
+import time
+
+import pytest
+
+import autoip6
+
+
+def tokens(text):
+    return [(version, ip) for version, ip, value in autoip6.iter_ip_tokens(text)]
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('104.16.0.1', [(4, '104.16.0.1')]),
+    ('104.16.0.1:443#HKG', [(4, '104.16.0.1')]),
+    ('<td>104.16.0.1</td>', [(4, '104.16.0.1')]),
+    ('2606:4700::1', [(6, '2606:4700::1')]),
+    ('[2606:4700::1]:443', [(6, '2606:4700::1')]),
+    ('IPv6:2606:4700::1', [(6, '2606:4700::1')]),
+    ('ip:2606:4700::1', [(6, '2606:4700::1')]),
+    ('addr=2606:4700::1,', [(6, '2606:4700::1')]),
+    ('节点2606:4700::1', [(6, '2606:4700::1')]),
+    ('2606:4700::1.', [(6, '2606:4700::1')]),
+    ('::ffff:8.8.8.8', [(6, '::ffff:8.8.8.8')]),
+    ('IPv6:::ffff:104.16.0.1', [(6, '::ffff:104.16.0.1')]),
+    ('2606:4700::104.16.0.1', [(6, '2606:4700::104.16.0.1')]),
+    ('ID:2606:4700::1', [(6, '2606:4700::1')]),
+    ('a:2606:4700::1', [(6, '2606:4700::1')]),
+    ('x::ffff:8.8.8.8', [(6, '::ffff:8.8.8.8')]),
+    ('IPv6::ffff:8.8.8.8', [(6, '::ffff:8.8.8.8')]),
+    ('dead:beef::1', [(6, 'dead:beef::1')]),
+    ('x2606:4700::1', []),
+    ('IPV4:2606:4700::1 host:[2606:4700::2]', [(6, '2606:4700::1'), (6, '2606:4700::2')]),
+    ('12:30', []),
+])
+def test_iter_ip_tokens(text, expected):
+    assert tokens(text) == expected
+
+
+def test_octet_groups_feed_integer_value():
+    assert list(autoip6.iter_ip_tokens('104.16.0.1 010.0.0.1')) == [
+        (4, '104.16.0.1', (104 << 24) | (16 << 16) | 1),
+        (4, '010.0.0.1', None),
+    ]
+
+
+TEXT = (
+    'IPv6:2606:4700::1 ip:2606:4700::2 ::ffff:8.8.8.8 ::ffff:10.0.0.1 '
+    '104.16.0.1:443 10.0.0.2 fe80::1 1:2:3:4:5:6:7:8:9 [2606:4700::3]:443 '
+    'ID:2606:4700::4 a:2606:4700::5 x::ffff:8.8.4.4'
+)
+EXPECTED_IPV4 = {'8.8.8.8', '8.8.4.4', '104.16.0.1'}
+EXPECTED_IPV6 = {'2606:4700::1', '2606:4700::2', '2606:4700::3', '2606:4700::4', '2606:4700::5'}
+
+
+def test_extract_ips_from_text(make_collector):
+    collector = make_collector()
+    assert collector.extract_ips_from_text(TEXT) == (EXPECTED_IPV4, EXPECTED_IPV6)
+
+
+def test_extract_ip_values_matches_extract_ips_from_text():
+    ipv4, ipv6 = autoip6.extract_ip_values(TEXT)
+    assert autoip6.unpack_ips((autoip6.array('I', sorted(ipv4)).tobytes(),
+                               b''.join(value.to_bytes(16, 'big') for value in sorted(ipv6)))) == \
+        (EXPECTED_IPV4, EXPECTED_IPV6)
+
+
+@pytest.mark.parametrize('chunk_size', [1, 3, 7, 64])
+def test_streaming_extractor_matches_whole_text(make_collector, chunk_size):
+    collector = make_collector()
+    data = (TEXT + '\n') * 3
+    extractor = autoip6.StreamingExtractor(collector.extract_ips_from_text)
+    raw = data.encode()
+    for start in range(0, len(raw), chunk_size):
+        assert extractor.feed(raw[start:start + chunk_size])
+    extractor.close()
+    assert (extractor.ipv4, extractor.ipv6) == (EXPECTED_IPV4, EXPECTED_IPV6)
+
+
+def test_long_words_scan_in_linear_time():
+    text = ('q' + 'a' * 20000 + ' ') * 5
+    start = time.perf_counter()
+    assert tokens(text) == []
+    assert time.perf_counter() - start < 1